@@ -1,14 +1,21 @@
 import streamlit as st
 import asyncio
-from backend import ShoppingAssistant
-import pandas as pd
-from PIL import Image
-import requests
-from io import BytesIO
+from backend import PIPELINE_PROFILES, ShoppingAssistant
+from image_cache import ThumbnailCache
+from recommendation_parser import parse_recommendations
+import os
 import time
-from typing import Dict, Any, List
+import html
+import re
+import logging
+from typing import Dict, Any, List, Tuple
 import json
 
+logger = logging.getLogger(__name__)
+
+# Thumbnails are stored under ./static, which Streamlit serves when server.enableStaticServing is on
+THUMBNAIL_STATIC_PATH = "thumbnails"
+
 # Set page config
 st.set_page_config(
     page_title="AI Shopping Assistant",
@@ -293,6 +300,182 @@ st.markdown("""
         max-width: none !important;
     }
 
+    .product-card {
+        background-color: #ffffff;
+        border-radius: 10px;
+        padding: 20px;
+        margin: 10px 0;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    }
+    .product-title {
+        color: white !important;
+        font-size: 1.5em;
+        margin-bottom: 10px;
+        text-align: center;
+    }
+    .product-price {
+        color: white;
+        font-size: 1.2em;
+        font-weight: bold;
+        text-align: center;
+    }
+    .product-rating {
+        color: white;
+        margin: 5px 0;
+        text-align: center;
+    }
+    .product-features {
+        background-color: #f8f9fa;
+        padding: 15px;
+        border-radius: 5px;
+        margin: 10px 0;
+    }
+    .pros-cons {
+        display: flex;
+        gap: 20px;
+        margin: 10px 0;
+    }
+    .pros {
+        color: #2e7d32;
+    }
+    .cons {
+        color: #c62828;
+    }
+    .recommendation {
+        background-color: #e3f2fd;
+        padding: 15px;
+        border-radius: 5px;
+        margin: 10px 0;
+    }
+    .product-link {
+        display: inline-block;
+        background-color: white;
+        color: black !important;
+        padding: 8px 16px;
+        border-radius: 5px;
+        text-decoration: none;
+        margin-top: 10px;
+        font-weight: bold;
+        border: 1px solid #e0e0e0;
+        text-align: center;
+    }
+    .product-link:hover {
+        background-color: #f5f5f5;
+        border-color: #bdbdbd;
+    }
+    .score-container {
+        display: flex;
+        gap: 10px;
+        margin: 10px 0;
+        flex-wrap: wrap;
+    }
+    .score-item {
+        background-color: #f8f9fa;
+        padding: 5px 10px;
+        border-radius: 5px;
+        min-width: 100px;
+        text-align: center;
+    }
+    .score-label {
+        font-size: 0.8em;
+        color: #666;
+    }
+    .score-value {
+        font-size: 1.1em;
+        font-weight: bold;
+        color: #1a237e;
+    }
+    .overall-score {
+        background-color: white;
+        color: black;
+        padding: 8px;
+        border-radius: 5px;
+        text-align: center;
+        margin-top: 10px;
+        width: fit-content;
+    }
+    .overall-score-label {
+        font-size: 0.8em;
+        opacity: 0.9;
+        color: black;
+    }
+    .overall-score-value {
+        font-size: 1.2em;
+        font-weight: bold;
+        color: black;
+    }
+    .analysis-section {
+        background-color: #f8f9fa;
+        padding: 12px;
+        border-radius: 5px;
+        margin: 8px 0;
+    }
+    .analysis-title {
+        font-size: 0.9em;
+        font-weight: bold;
+        color: #1a237e;
+        margin-bottom: 5px;
+    }
+    .analysis-content {
+        font-size: 0.9em;
+        color: #333;
+        line-height: 1.4;
+    }
+    /* Card layout, built as one HTML block per card */
+    .card-body {
+        display: flex;
+        gap: 1.5rem;
+        width: 100%;
+    }
+    .card-left {
+        flex: 1;
+        display: flex;
+        flex-direction: column;
+        align-items: center;
+    }
+    .card-right {
+        flex: 2;
+        text-align: left;
+    }
+    .compact .card-right {
+        flex: 3;
+    }
+    .card-image {
+        display: flex;
+        justify-content: center;
+        margin-bottom: 1rem;
+    }
+    .card-price {
+        font-size: 1.2rem;
+        color: white;
+        font-weight: bold;
+        margin-bottom: 0.5rem;
+    }
+    .alternative-sellers {
+        color: white;
+        font-size: 0.9rem;
+        margin-top: 0.5rem;
+    }
+    .recommendation-title {
+        font-size: 1.8rem;
+        margin-bottom: 1rem;
+        text-align: center;
+        width: 100%;
+    }
+    .recommendation-reason {
+        font-size: 1.1rem;
+        line-height: 1.6;
+        color: white;
+        padding: 1rem;
+        background: rgba(255, 255, 255, 0.1);
+        border-radius: 8px;
+        width: 100%;
+    }
+    .preview-status {
+        color: #bbbbbb;
+        font-size: 0.9rem;
+    }
+
     /* Ensure the main container doesn't restrict width */
     .main .block-container {
         max-width: none !important;
@@ -303,406 +486,216 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'assistant' not in st.session_state:
-    st.session_state.assistant = ShoppingAssistant()
 if 'results' not in st.session_state:
     st.session_state.results = None
 if 'processing' not in st.session_state:
     st.session_state.processing = False
 
-def load_image(url):
-    """Load image from URL with error handling"""
-    try:
-        response = requests.get(url)
-        return Image.open(BytesIO(response.content))
-    except:
-        return None
+def product_image_src(image_url: str, width: int) -> str:
+    """URL of the downscaled thumbnail of a product, or its original URL until the thumbnail has been fetched"""
+    filename = get_thumbnail_cache().cached_filename(image_url, width)
+    if filename is None:
+        return html.escape(image_url or '')
+    # Served by Streamlit from the static directory next to this script
+    return f"app/static/{THUMBNAIL_STATIC_PATH}/{filename}"
 
-def display_rating(rating: str, reviews: str) -> None:
-    """Display rating and reviews in a formatted way"""
-    if rating != 'N/A':
-        st.markdown(f'<div class="product-rating" style="color: white;">⭐️ {rating} ({reviews} reviews)</div>', unsafe_allow_html=True)
+def markdown_html(text: Any) -> str:
+    """Convert the markdown the LLM writes (bullet lists, **bold**) to HTML for use inside a card"""
+    if isinstance(text, list):
+        text = '\n'.join(f"- {item}" for item in text)
+    parts = []
+    in_list = False
+    for line in str(text).split('\n'):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        bullet = re.match(r'^(?:[-*•]|\d+[.)])\s+(.*)$', stripped)
+        content = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', html.escape(bullet.group(1) if bullet else stripped))
+        if bullet and not in_list:
+            parts.append('<ul>')
+        elif not bullet and in_list:
+            parts.append('</ul>')
+        in_list = bool(bullet)
+        parts.append(f'<li>{content}</li>' if bullet else f'<div>{content}</div>')
+    if in_list:
+        parts.append('</ul>')
+    return ''.join(parts)
 
-def display_product_card(product: Dict[str, Any], compact: bool = False) -> None:
-    """Display a product card with all available information"""
-    # Add custom CSS for better styling
-    st.markdown("""
-        <style>
-        .product-card {
-            background-color: #ffffff;
-            border-radius: 10px;
-            padding: 20px;
-            margin: 10px 0;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        .product-title {
-            color: white !important;
-            font-size: 1.5em;
-            margin-bottom: 10px;
-            text-align: center;
-        }
-        .product-price {
-            color: white;
-            font-size: 1.2em;
-            font-weight: bold;
-            text-align: center;
-        }
-        .product-rating {
-            color: white;
-            margin: 5px 0;
-            text-align: center;
-        }
-        .product-features {
-            background-color: #f8f9fa;
-            padding: 15px;
-            border-radius: 5px;
-            margin: 10px 0;
-        }
-        .pros-cons {
-            display: flex;
-            gap: 20px;
-            margin: 10px 0;
-        }
-        .pros {
-            color: #2e7d32;
-        }
-        .cons {
-            color: #c62828;
-        }
-        .recommendation {
-            background-color: #e3f2fd;
-            padding: 15px;
-            border-radius: 5px;
-            margin: 10px 0;
-        }
-        .product-link {
-            display: inline-block;
-            background-color: white;
-            color: black !important;
-            padding: 8px 16px;
-            border-radius: 5px;
-            text-decoration: none;
-            margin-top: 10px;
-            font-weight: bold;
-            border: 1px solid #e0e0e0;
-            text-align: center;
-        }
-        .product-link:hover {
-            background-color: #f5f5f5;
-            border-color: #bdbdbd;
-        }
-        .score-container {
-            display: flex;
-            gap: 10px;
-            margin: 10px 0;
-            flex-wrap: wrap;
-        }
-        .score-item {
-            background-color: #f8f9fa;
-            padding: 5px 10px;
-            border-radius: 5px;
-            min-width: 100px;
-            text-align: center;
-        }
-        .score-label {
-            font-size: 0.8em;
-            color: #666;
-        }
-        .score-value {
-            font-size: 1.1em;
-            font-weight: bold;
-            color: #1a237e;
-        }
-        .overall-score {
-            background-color: white;
-            color: black;
-            padding: 8px;
-            border-radius: 5px;
-            text-align: center;
-            margin-top: 10px;
-            width: fit-content;
-        }
-        .overall-score-label {
-            font-size: 0.8em;
-            opacity: 0.9;
-            color: black;
-        }
-        .overall-score-value {
-            font-size: 1.2em;
-            font-weight: bold;
-            color: black;
-        }
-        .analysis-section {
-            background-color: #f8f9fa;
-            padding: 12px;
-            border-radius: 5px;
-            margin: 8px 0;
-        }
-        .analysis-title {
-            font-size: 0.9em;
-            font-weight: bold;
-            color: #1a237e;
-            margin-bottom: 5px;
-        }
-        .analysis-content {
-            font-size: 0.9em;
-            color: #333;
-            line-height: 1.4;
-        }
-        </style>
-    """, unsafe_allow_html=True)
+def card_fields(product: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields a card shows, which are also what its HTML is memoized on"""
+    return {field: product.get(field) for field in (
+        'title', 'url', 'image', 'price', 'rating', 'reviews', 'alternative_sellers',
+        'analysis', 'formatted_details', 'recommendation_reason'
+    )}
+
+def _price_html(product: Dict[str, Any], css_class: str = "card-price") -> str:
+    price = str(product.get('price') or 'N/A')
+    if price != 'N/A' and not price.startswith('€'):
+        price = f"€{price}"
+    return f'<div class="{css_class}">{html.escape(price)}</div>'
+
+def _rating_html(product: Dict[str, Any]) -> str:
+    rating = product.get('rating') or 'N/A'
+    if rating == 'N/A':
+        return ''
+    return f'<div class="product-rating">⭐️ {html.escape(str(rating))} ({html.escape(str(product.get("reviews") or "N/A"))} reviews)</div>'
+
+def _overall_score_html(product: Dict[str, Any]) -> str:
+    analysis = product.get('analysis')
+    if not isinstance(analysis, dict) or 'scores' not in analysis:
+        return ''
+    overall_score = analysis['scores'].get('overall_score', 5)
+    return (
+        '<div style="display: flex; justify-content: center; width: 100%;"><div class="overall-score">'
+        '<div class="overall-score-label">Overall Score</div>'
+        f'<div class="overall-score-value">{html.escape(str(overall_score))}/10</div>'
+        '</div></div>'
+    )
 
+def _summary_html(product: Dict[str, Any], width: int, image_src: str) -> str:
+    """Image, price, rating, link and overall score: the left column of every card"""
+    parts = []
+    if image_src:
+        parts.append(f'<div class="card-image"><img src="{image_src}" width="{width}"></div>')
+    parts.append(_price_html(product))
+    parts.append(_rating_html(product))
+    if product.get('url'):
+        parts.append(f'<a href="{html.escape(product["url"])}" class="product-link" target="_blank" style="margin-top: 0.5rem;">View Product</a>')
+    if product.get('alternative_sellers'):
+        parts.append(f'<div class="alternative-sellers">Also available from: {html.escape(", ".join(product["alternative_sellers"]))}</div>')
+    parts.append(_overall_score_html(product))
+    return ''.join(parts)
+
+def _analysis_html(analysis: Dict[str, Any]) -> str:
+    """Features, pros and cons, scores and detailed analyses: the right column of a full card"""
+    parts = []
+    if 'key_features' in analysis:
+        parts.append(f'<div><strong>Key Features:</strong>{markdown_html(analysis["key_features"])}</div>')
+    pros_cons = []
+    if 'pros' in analysis:
+        pros_cons.append(f'<div><strong>Pros:</strong>{markdown_html(analysis["pros"])}</div>')
+    if 'cons' in analysis:
+        pros_cons.append(f'<div><strong>Cons:</strong>{markdown_html(analysis["cons"])}</div>')
+    if pros_cons:
+        parts.append(f'<div class="pros-cons">{"".join(pros_cons)}</div>')
+    
+    # All scores in a compact format after pros/cons; the overall score is shown on the left
+    scores = analysis.get('scores') or {}
+    score_items = ''.join(
+        f'<div class="score-item"><div class="score-label">{html.escape(score_type.replace("_", " ").title())}</div>'
+        f'<div class="score-value">{html.escape(str(score_value))}/10</div></div>'
+        for score_type, score_value in scores.items() if score_type != 'overall_score'
+    )
+    if score_items:
+        parts.append(f'<div class="score-container">{score_items}</div>')
+    
+    analyses = analysis.get('analysis') or {}
+    for key, label in (('performance_analysis', 'Performance Analysis'), ('value_analysis', 'Value Analysis'),
+                       ('requirements_match', 'Requirements Match')):
+        if key in analyses:
+            parts.append(
+                f'<div class="analysis-section"><div class="analysis-title">{label}</div>'
+                f'<div class="analysis-content">{html.escape(str(analyses[key]))}</div></div>'
+            )
+    return ''.join(parts)
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def product_card_html(product: Dict[str, Any], compact: bool = False, image_src: str = '') -> str:
+    """Build a product card as a single HTML block, memoized per product, analysis and image source"""
+    title = f'<div class="product-title">{html.escape(product["title"])}</div>'
     if compact:
-        col1, col2 = st.columns([1, 3])
-        with col1:
-            if product.get('image'):
-                st.image(product['image'], width=150)
-            price = product.get('price', 'N/A')
-            if price != 'N/A' and not price.startswith('€'):
-                price = f"€{price}"
-            st.markdown(f'<div class="product-price">{price}</div>', unsafe_allow_html=True)
-            display_rating(product.get('rating', 'N/A'), product.get('reviews', 'N/A'))
-            if product.get('url'):
-                st.markdown(f'<a href="{product["url"]}" class="product-link" target="_blank">View Product</a>', unsafe_allow_html=True)
-        with col2:
-            st.markdown(f'<div class="product-title">{product["title"]}</div>', unsafe_allow_html=True)
-            if 'recommendation_reason' in product:
-                st.markdown(f'<div class="recommendation">{product["recommendation_reason"]}</div>', unsafe_allow_html=True)
-            # Add overall score for compact view
-            if 'analysis' in product and 'scores' in product['analysis']:
-                overall_score = product['analysis']['scores'].get('overall_score', 5)
-                st.markdown(f'''
-                    <div class="overall-score">
-                        <div class="overall-score-label">Overall Score</div>
-                        <div class="overall-score-value">{overall_score}/10</div>
-                    </div>
-                ''', unsafe_allow_html=True)
+        right = [title]
+        if product.get('recommendation_reason'):
+            right.append(f'<div class="recommendation">{html.escape(product["recommendation_reason"])}</div>')
+        return (
+            f'<div class="card-body compact"><div class="card-left">{_summary_html(product, 150, image_src)}</div>'
+            f'<div class="card-right">{"".join(right)}</div></div>'
+        )
+    
+    analysis = product.get('analysis')
+    right = _analysis_html(analysis) if isinstance(analysis, dict) else ''
+    return (
+        f'{title}<div class="card-body"><div class="card-left">{_summary_html(product, 200, image_src)}</div>'
+        f'<div class="card-right">{right}</div></div>'
+    )
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def recommendation_summary_html(product: Dict[str, Any], image_src: str = '') -> str:
+    """Left column of a top recommendation as a single HTML block, memoized per product, analysis and image source"""
+    return f'<div class="card-left">{_summary_html(product, 200, image_src)}</div>'
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def preview_card_html(product: Dict[str, Any], image_src: str = '', status: str = '') -> str:
+    """Lightweight card shown while the search is still running, as a single HTML block
+    
+    A status (such as "Not researched") replaces the specification summary until the product is scored.
+    """
+    left = []
+    if image_src:
+        left.append(f'<div class="card-image"><img src="{image_src}" width="150"></div>')
+    left.append(_price_html(product))
+    
+    right = [f'<div class="product-title">{html.escape(product["title"])}</div>', _rating_html(product)]
+    analysis = product.get('analysis')
+    if isinstance(analysis, dict) and 'scores' in analysis:
+        overall_score = analysis['scores'].get('overall_score', 5)
+        right.append(f'<div style="color: white; font-weight: bold;">Overall Score: {html.escape(str(overall_score))}/10</div>')
+    elif status:
+        right.append(f'<div class="preview-status">{html.escape(status)}</div>')
+    elif isinstance(product.get('formatted_details'), dict):
+        right.append(markdown_html(product['formatted_details'].get('summary', '')))
     else:
-        st.markdown('<div class="product-card">', unsafe_allow_html=True)
-        st.markdown(f'<div class="product-title">{product["title"]}</div>', unsafe_allow_html=True)
-        
-        col1, col2 = st.columns([1, 2])
-        
-        with col1:
-            # Left column container
-            st.markdown('<div style="display: flex; flex-direction: column; align-items: center; width: 100%;">', unsafe_allow_html=True)
-            
-            # Image section
-            st.markdown('<div style="width: 100%; display: flex; justify-content: center; align-items: center; margin-bottom: 1rem;">', unsafe_allow_html=True)
-            if product.get('image'):
-                st.image(product['image'], width=200, use_column_width=False)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Rating and reviews section
-            st.markdown('<div style="display: flex; flex-direction: column; align-items: center; width: 100%; margin-bottom: 1rem;">', unsafe_allow_html=True)
-            price = product.get('price', 'N/A')
-            if price != 'N/A' and not price.startswith('€'):
-                price = f"€{price}"
-            st.markdown(f'<div style="font-size: 1.2rem; color: white; font-weight: bold; margin-bottom: 0.5rem;">{price}</div>', unsafe_allow_html=True)
-            display_rating(product.get('rating', 'N/A'), product.get('reviews', 'N/A'))
-            if product.get('url'):
-                st.markdown(f'<a href="{product["url"]}" class="product-link" target="_blank" style="margin-top: 0.5rem;">View Product</a>', unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Overall score section
-            if 'analysis' in product and 'scores' in product['analysis']:
-                overall_score = product['analysis']['scores'].get('overall_score', 5)
-                st.markdown(f'''
-                    <div style="display: flex; justify-content: center; width: 100%;">
-                        <div style="
-                            background-color: white;
-                            color: black;
-                            padding: 8px;
-                            border-radius: 5px;
-                            text-align: center;
-                            margin-top: 10px;
-                            width: fit-content;
-                        ">
-                            <div style="font-size: 0.8em; opacity: 0.9; color: black;">Overall Score</div>
-                            <div style="font-size: 1.2em; font-weight: bold; color: black;">{overall_score}/10</div>
-                        </div>
-                    </div>
-                ''', unsafe_allow_html=True)
-            
-            st.markdown('</div>', unsafe_allow_html=True)  # End left column container
-        
-        with col2:
-            if 'analysis' in product:
-                analysis = product['analysis']
-                if isinstance(analysis, dict):
-                    if 'key_features' in analysis:
-                        st.markdown('<div class="product-features">', unsafe_allow_html=True)
-                        st.markdown("**Key Features:**")
-                        st.markdown(analysis['key_features'])
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    st.markdown('<div class="pros-cons">', unsafe_allow_html=True)
-                    if 'pros' in analysis:
-                        st.markdown('<div class="pros">', unsafe_allow_html=True)
-                        st.markdown("**Pros:**")
-                        st.markdown(analysis['pros'])
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    if 'cons' in analysis:
-                        st.markdown('<div class="cons">', unsafe_allow_html=True)
-                        st.markdown("**Cons:**")
-                        st.markdown(analysis['cons'])
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # Display all scores in a compact format after pros/cons
-                    if 'scores' in analysis:
-                        scores = analysis['scores']
-                        st.markdown('<div class="score-container">', unsafe_allow_html=True)
-                        for score_type, score_value in scores.items():
-                            if score_type != 'overall_score':  # Skip overall score here
-                                score_label = score_type.replace('_', ' ').title()
-                                st.markdown(f'''
-                                    <div class="score-item">
-                                        <div class="score-label">{score_label}</div>
-                                        <div class="score-value">{score_value}/10</div>
-                                    </div>
-                                ''', unsafe_allow_html=True)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # Display detailed analyses
-                    if 'analysis' in analysis:
-                        analyses = analysis['analysis']
-                        # Performance Analysis
-                        if 'performance_analysis' in analyses:
-                            st.markdown(f'''
-                                <div class="analysis-section">
-                                    <div class="analysis-title">Performance Analysis</div>
-                                    <div class="analysis-content">{analyses['performance_analysis']}</div>
-                                </div>
-                            ''', unsafe_allow_html=True)
-                        
-                        # Value Analysis
-                        if 'value_analysis' in analyses:
-                            st.markdown(f'''
-                                <div class="analysis-section">
-                                    <div class="analysis-title">Value Analysis</div>
-                                    <div class="analysis-content">{analyses['value_analysis']}</div>
-                                </div>
-                            ''', unsafe_allow_html=True)
-                        
-                        # Requirements Match
-                        if 'requirements_match' in analyses:
-                            st.markdown(f'''
-                                <div class="analysis-section">
-                                    <div class="analysis-title">Requirements Match</div>
-                                    <div class="analysis-content">{analyses['requirements_match']}</div>
-                                </div>
-                            ''', unsafe_allow_html=True)
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+        right.append('<div class="preview-status">Researching specifications...</div>')
+    return (
+        f'<div class="card-body compact"><div class="card-left">{"".join(left)}</div>'
+        f'<div class="card-right">{"".join(right)}</div></div>'
+    )
+
+def display_product_card(product: Dict[str, Any], compact: bool = False) -> None:
+    """Display a product card with all available information"""
+    image_src = product_image_src(product.get('image'), 150 if compact else 200)
+    st.markdown(product_card_html(card_fields(product), compact, image_src), unsafe_allow_html=True)
 
-def display_recommendations(recommendations: List[Dict[str, Any]], ranked_products: List[Dict[str, Any]], recommendations_analysis: str) -> None:
-    """Display recommendations with analysis"""
+def display_recommendations(recommendations: List[Dict[str, Any]], ranked_products: List[Dict[str, Any]], recommendations_analysis: str, live: bool = False) -> Dict[str, Any]:
+    """Display recommendations with analysis
+    
+    With live=True, placeholders are shown for text that is still being generated. Returns the
+    placeholders of the recommendation reasons and the overall analysis so they can be updated.
+    """
+    render_start = time.perf_counter()
+    reason_slots = []
+    
+    # Download all thumbnails of the page at once instead of one per card
+    get_thumbnail_cache().prefetch(product.get('image') for product in recommendations + ranked_products)
+    
     # Display the recommendations header with increased size
     st.markdown('<div class="recommendations-header" style="font-size: 2.5rem; font-weight: bold;">🌟 Top Recommendations</div>', unsafe_allow_html=True)
     
     # Display each recommendation
     for product in recommendations:
-        st.markdown('<div class="top-recommendation">', unsafe_allow_html=True)
-        st.markdown(f'<div class="recommendation-title" style="font-size: 1.8rem; margin-bottom: 1rem; text-align: center; width: 100%;">{product["title"]}</div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="recommendation-title">{html.escape(product["title"])}</div>', unsafe_allow_html=True)
         
         col1, col2 = st.columns([1, 2])
         with col1:
-            # Left column container
-            st.markdown('<div style="display: flex; flex-direction: column; align-items: center; width: 100%;">', unsafe_allow_html=True)
-            
-            # Image section
-            st.markdown('<div style="width: 100%; display: flex; justify-content: center; align-items: center; margin-bottom: 1rem;">', unsafe_allow_html=True)
-            if product.get('image'):
-                st.image(product['image'], width=200, use_column_width=False)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Rating and reviews section
-            st.markdown('<div style="display: flex; flex-direction: column; align-items: center; width: 100%; margin-bottom: 1rem;">', unsafe_allow_html=True)
-            price = product.get('price', 'N/A')
-            if price != 'N/A' and not price.startswith('€'):
-                price = f"€{price}"
-            st.markdown(f'<div style="font-size: 1.2rem; color: white; font-weight: bold; margin-bottom: 0.5rem;">{price}</div>', unsafe_allow_html=True)
-            display_rating(product.get('rating', 'N/A'), product.get('reviews', 'N/A'))
-            if product.get('url'):
-                st.markdown(f'''
-                    <a href="{product["url"]}" class="product-link" target="_blank" style="
-                        display: inline-block;
-                        background-color: white;
-                        color: black !important;
-                        padding: 8px 16px;
-                        border-radius: 5px;
-                        text-decoration: none;
-                        margin-top: 0.5rem;
-                        font-weight: bold;
-                        border: 1px solid #e0e0e0;
-                        text-align: center;
-                    ">View Product</a>
-                ''', unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Overall score section
-            if 'analysis' in product and 'scores' in product['analysis']:
-                overall_score = product['analysis']['scores'].get('overall_score', 5)
-                st.markdown(f'''
-                    <div style="display: flex; justify-content: center; width: 100%;">
-                        <div style="
-                            background-color: white;
-                            color: black;
-                            padding: 8px;
-                            border-radius: 5px;
-                            text-align: center;
-                            margin-top: 10px;
-                            width: fit-content;
-                        ">
-                            <div style="font-size: 0.8em; opacity: 0.9; color: black;">Overall Score</div>
-                            <div style="font-size: 1.2em; font-weight: bold; color: black;">{overall_score}/10</div>
-                        </div>
-                    </div>
-                ''', unsafe_allow_html=True)
-            
-            st.markdown('</div>', unsafe_allow_html=True)  # End left column container
+            image_src = product_image_src(product.get('image'), 200)
+            st.markdown(recommendation_summary_html(card_fields(product), image_src), unsafe_allow_html=True)
         
         with col2:
-            # Container for recommendation reason with vertical centering
-            st.markdown('<div style="display: flex; align-items: center; height: 100%; min-height: 200px;">', unsafe_allow_html=True)
+            reason_slot = st.empty()
             if 'recommendation_reason' in product:
-                st.markdown(f'''
-                    <div class="recommendation-reason" style="
-                        font-size: 1.1rem;
-                        line-height: 1.6;
-                        color: white;
-                        padding: 1rem;
-                        background: rgba(255, 255, 255, 0.1);
-                        border-radius: 8px;
-                        width: 100%;
-                    ">{product["recommendation_reason"]}</div>
-                ''', unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+                display_recommendation_reason(reason_slot, product["recommendation_reason"])
+            elif live:
+                display_recommendation_reason(reason_slot, "✍️ Writing recommendation...")
+            reason_slots.append(reason_slot)
     
     # Display overall analysis
-    if recommendations_analysis:
-        st.markdown('<div class="overall-analysis">', unsafe_allow_html=True)
+    analysis_slot = None
+    if recommendations_analysis or live:
         st.markdown("### Our Analysis")
-        # Extract and clean up the analysis text
-        if "Overall Analysis:" in recommendations_analysis:
-            analysis_text = recommendations_analysis.split("Overall Analysis:")[1].strip()
-        else:
-            analysis_text = recommendations_analysis
-            
-        # Clean up the text
-        analysis_text = analysis_text.replace("within the specified maximum budget", "within your budget")
-        analysis_text = analysis_text.replace("with a maximum budget of ", "")
-        analysis_text = analysis_text.replace("euros.", "")
-        analysis_text = analysis_text.replace("**", "")
-        
-        # Remove any lines that start with "Note"
-        analysis_text = '\n'.join(line for line in analysis_text.split('\n') if not line.strip().startswith('Note'))
-        
-        st.markdown(f'<div class="analysis-text">{analysis_text}</div>', unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
+        analysis_slot = st.empty()
+        # Extract the analysis text
+        analysis_text = parse_recommendations(recommendations_analysis)["analysis"] or recommendations_analysis
+        display_overall_analysis(analysis_slot, analysis_text)
     
     # Add section for all products with increased size
     st.markdown("---")
@@ -712,9 +705,166 @@ def display_recommendations(recommendations: List[Dict[str, Any]], ranked_produc
     for product in ranked_products:
         display_product_card(product)
         st.markdown("---")
+    
+    logger.info(f"Rendered {len(recommendations)} recommendations and {len(ranked_products)} products in {time.perf_counter() - render_start:.3f}s")
+    return {"titles": [product["title"] for product in recommendations], "reasons": reason_slots, "analysis": analysis_slot}
+
+def display_recommendation_reason(slot, reason: str) -> None:
+    """Render (or re-render) the "Why Recommended" text of a recommendation"""
+    slot.markdown(f'<div class="recommendation-reason">{reason}</div>', unsafe_allow_html=True)
+
+def display_overall_analysis(slot, analysis_text: str) -> None:
+    """Clean up and render (or re-render) the overall analysis text"""
+    analysis_text = analysis_text.replace("within the specified maximum budget", "within your budget")
+    analysis_text = analysis_text.replace("with a maximum budget of ", "")
+    analysis_text = analysis_text.replace("euros.", "")
+    analysis_text = analysis_text.replace("**", "")
+    
+    # Remove any lines that start with "Note"
+    analysis_text = '\n'.join(line for line in analysis_text.split('\n') if not line.strip().startswith('Note'))
+    
+    slot.markdown(f'<div class="analysis-text">{analysis_text}</div>', unsafe_allow_html=True)
+
+def display_product_preview(slot, product: Dict[str, Any], status: str = '') -> None:
+    """Render a lightweight product card into a placeholder while the search is still running"""
+    image_src = product_image_src(product.get('image'), 150)
+    slot.markdown(preview_card_html(card_fields(product), image_src, status), unsafe_allow_html=True)
+
+def display_preview_cards(placeholder, products: List[Dict[str, Any]]) -> List[Any]:
+    """Render preview cards for a list of products and return one placeholder per card"""
+    with placeholder.container():
+        st.markdown('<div class="recommendations-header" style="font-size: 2rem; font-weight: bold;">📋 Products Found</div>', unsafe_allow_html=True)
+        card_slots = [st.empty() for _ in products]
+    for slot, product in zip(card_slots, products):
+        display_product_preview(slot, product)
+    return card_slots
+
+async def stream_search(assistant: ShoppingAssistant, query: str, max_price: float, additional_requirements: str,
+                        profile: str = "thorough") -> Tuple[Dict[str, Any], bool]:
+    """Run the search and update the page as each step of the workflow completes
+    
+    Returns the results and whether the recommendations page was already rendered live.
+    """
+    status_placeholder = st.empty()
+    preview_placeholder = st.empty()
+    status_placeholder.info("✨ Understanding your request...")
+    
+    card_slots = []
+    live_slots = None
+    enriched_count = 0
+    skipped_count = 0
+    last_paint = 0.0
+    results = None
+    
+    async for update in assistant.stream_shopping_query(
+        query=query,
+        max_price=max_price,
+        additional_requirements=additional_requirements,
+        profile=profile
+    ):
+        event = update["event"]
+        
+        if event == "node_completed":
+            node = update["node"]
+            state = update["state"]
+            
+            if node == "process_query":
+                status_placeholder.info(f"🔎 Searching for: {state['processed_query'].get('restructured', query)}")
+            
+            elif node == "search_products":
+                # Start downloading all thumbnails while the rest of the workflow runs
+                get_thumbnail_cache().prefetch(product.get('image') for product in state.get("products", []))
+                # Show the raw search results straight away
+                card_slots = display_preview_cards(preview_placeholder, state.get("products", []))
+                status_placeholder.info(f"🧹 Filtering {len(card_slots)} products...")
+            
+            elif node == "filter_products":
+                # Only the products that passed the pre-filter are researched further
+                card_slots = display_preview_cards(preview_placeholder, state.get("products", []))
+                status_placeholder.info(f"🧩 Grouping offers of {len(card_slots)} products...")
+            
+            elif node == "deduplicate_products":
+                # Offers of the same product from several sellers are shown as one card
+                card_slots = display_preview_cards(preview_placeholder, state.get("products", []))
+                status_placeholder.info(f"📑 Researching {len(card_slots)} products...")
+            
+            elif node == "extract_specifications":
+                status_placeholder.info("⚖️ Ranking products...")
+            
+            elif node == "rank_products":
+                # Show the ranked page right away; the recommendation texts are painted as they stream in
+                ranked_products = state.get("ranked_products", [])
+                if ranked_products:
+                    with preview_placeholder.container():
+                        live_slots = display_recommendations(
+                            recommendations=ranked_products[:3],
+                            ranked_products=ranked_products,
+                            recommendations_analysis="",
+                            live=True
+                        )
+                status_placeholder.info("✨ Writing personalized recommendations...")
+        
+        elif event == "product_enriched":
+            # Fill in the specifications of a single card
+            enriched_count += 1
+            if update["index"] < len(card_slots):
+                display_product_preview(card_slots[update["index"]], update["product"])
+            status_placeholder.info(f"📑 Researched {enriched_count}/{len(card_slots) - skipped_count} products...")
+        
+        elif event == "product_skipped":
+            # The profile ranks this product from its listing data only
+            skipped_count += 1
+            if update["index"] < len(card_slots):
+                display_product_preview(card_slots[update["index"]], update["product"], status="Not researched")
+        
+        elif event == "recommendation_token":
+            # Repaint at most every 0.1s to keep the number of websocket messages down
+            if live_slots and time.perf_counter() - last_paint >= 0.1:
+                paint_recommendation_text(live_slots, update["text"])
+                last_paint = time.perf_counter()
+        
+        elif event == "completed":
+            results = update["results"]
+    
+    status_placeholder.empty()
+    if live_slots and results and results['recommendations']:
+        # Finish the live page with the final texts
+        for slot, product in zip(live_slots["reasons"], results['recommendations']):
+            display_recommendation_reason(slot, product["recommendation_reason"])
+        paint_recommendation_text(live_slots, results['recommendations_analysis'], reasons=False)
+        return results, True
+    
+    # The final page replaces the preview
+    preview_placeholder.empty()
+    return results, False
+
+def paint_recommendation_text(live_slots: Dict[str, Any], recommendations_text: str, reasons: bool = True) -> None:
+    """Update the live recommendation placeholders from the (partial) narrative text"""
+    parsed = parse_recommendations(recommendations_text, live_slots["titles"])
+    if reasons:
+        for index, reason in parsed["reasons"].items():
+            display_recommendation_reason(live_slots["reasons"][index], reason)
+    if live_slots["analysis"] is not None and parsed["analysis"]:
+        display_overall_analysis(live_slots["analysis"], parsed["analysis"])
+
+@st.cache_resource(show_spinner="Loading the language models...")
+def get_assistant() -> ShoppingAssistant:
+    """One assistant (compiled graph, caches and warm models) shared by all sessions of the server process"""
+    assistant = ShoppingAssistant()
+    assistant.warm_up()
+    return assistant
+
+@st.cache_resource
+def get_thumbnail_cache() -> ThumbnailCache:
+    """Thumbnail downloads and caches shared by all sessions of the server process"""
+    return ThumbnailCache(cache_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", THUMBNAIL_STATIC_PATH))
 
 def main():
     
+    # Loads the models on the first page view; later reruns only record that a session is active
+    assistant = get_assistant()
+    assistant.graph.llm.mark_active()
+    
     # Initialize session state
     if 'results' not in st.session_state:
         st.session_state.results = None
@@ -734,6 +884,16 @@ def main():
             height=121  
         )
     
+    # Search depth: faster modes research fewer products
+    profile = st.radio(
+        "⚡ Search mode",
+        options=[name.capitalize() for name in PIPELINE_PROFILES],
+        captions=[f"~{settings['expected_seconds']}s" for settings in PIPELINE_PROFILES.values()],
+        index=list(PIPELINE_PROFILES).index("thorough"),
+        help=" ".join(f"{name.capitalize()}: {settings['description']}." for name, settings in PIPELINE_PROFILES.items()),
+        horizontal=True
+    ).lower()
+    
     # Center the search button using CSS
     st.markdown("""
         <style>
@@ -749,21 +909,27 @@ def main():
     
     if st.button("Search"):
         if query:
-            with st.spinner("✨ Finding the best products for you..."):
-                # Initialize the shopping assistant
-                assistant = ShoppingAssistant()
-                
-                # Process the query
-                results = asyncio.run(assistant.process_shopping_query(
-                    query=query,
-                    max_price=max_price,
-                    additional_requirements=additional_requirements
-                ))
-                
-                # Store results in session state
-                st.session_state.results = results
-                
-                # Display recommendations
+            # Process the query, rendering intermediate results as they arrive
+            results, rendered = asyncio.run(stream_search(
+                assistant,
+                query=query,
+                max_price=max_price,
+                additional_requirements=additional_requirements,
+                profile=profile
+            ))
+            
+            profile_report = results.get('profile')
+            if profile_report and profile_report.get('measured_seconds') is not None:
+                st.caption(
+                    f"{profile_report['name'].capitalize()} mode: took {profile_report['measured_seconds']:.1f}s "
+                    f"(expected ~{profile_report['expected_seconds']}s)"
+                )
+            
+            # Store results in session state
+            st.session_state.results = results
+            
+            # Display recommendations unless they were already painted live
+            if not rendered:
                 if results['recommendations']:
                     display_recommendations(
                         recommendations=results['recommendations'],
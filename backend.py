@@ -1,21 +1,33 @@
 import os
 import re
 import json
-import ollama
+import math
+import asyncio
 import time
 import logging
-import pandas as pd
+import weakref
+import threading
 from datetime import datetime
-from typing import List, Dict, Any, Optional, TypedDict, Annotated
-from tavily import TavilyClient
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, List, Dict, Any, AsyncIterator, Callable, Optional, Tuple, TypedDict, Annotated
 from dotenv import load_dotenv
-from cachetools import cached, TTLCache
-from langchain_community.tools.tavily_search import TavilySearchResults
-from serpapi import GoogleSearch
+from cachetools import cached, TTLCache, LRUCache
+from caches import CACHE_DIR, SQLiteCache, StaleWhileRevalidateCache
 from langgraph.graph import Graph, END
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from llm_gateway import LLMGateway
+from context_assembly import DEFAULT_TOKEN_BUDGET, assemble_context
+from product_filters import deduplicate_products, parse_number, prefilter_products
+from recommendation_parser import NO_REASON, parse_recommendations
+from results_store import ResultsStore
+from query_processing import FEW_SHOT_EXAMPLES, format_examples, format_price, select_examples, template_restructure
+from tokens import count_tokens
+
+# langchain_community and serpapi are imported on first use to keep app start-up fast
+if TYPE_CHECKING:
+    from langchain_community.tools.tavily_search import TavilySearchResults
 
 
 # Configure logging
@@ -24,27 +36,162 @@ logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
-tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
 serpapi_key = os.getenv("SERPAPI_KEY")
 
+# Receives progress events emitted by graph nodes while a query is being streamed
+progress_listener: ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = ContextVar("progress_listener", default=None)
+
+def emit_progress(event: Dict[str, Any]) -> None:
+    """Forward a progress event to the listener of the current query, if any"""
+    listener = progress_listener.get()
+    if listener is not None:
+        listener(event)
+
+# SerpAPI results shared by every ShoppingGraph in the process
+shared_product_cache = StaleWhileRevalidateCache(maxsize=100, ttl=3600)  # Fresh for 1 hour
+# Restructured queries by (query, max price, requirements), shared across sessions
+shared_query_memo = LRUCache(maxsize=1024)
+shared_query_memo_lock = threading.Lock()
+
+# Prompt for structuring several products in one call; each product is answered under its ID
+EXTRACTION_BATCH_PROMPT = """You are a product analysis expert. Analyze and structure the product details of each of the following products into a clear, organized format.
+Focus on key specifications, features, and important information.
+
+{products}
+
+You MUST respond with a valid JSON object with one entry per product ID ({product_ids}) in this exact format:
+{{
+    "P1": {{
+        "key_features": ["feature 1", "feature 2", "feature 3"],
+        "pros": ["pro 1", "pro 2", "pro 3"],
+        "cons": ["con 1", "con 2", "con 3"],
+        "summary": "Brief overall summary of the product's value proposition"
+    }}
+}}
+
+CRITICAL RULES:
+1. Your response MUST be a valid JSON object keyed by product ID
+2. Analyze every product separately, using only its own details
+3. Use double quotes for all strings
+4. Provide at least 3 items in each list
+5. Use specific, detailed information
+6. Focus on concrete features and specifications
+7. Do not include any markdown formatting or explanatory text
+"""
+# Tokens reserved for the answer about each product in a batch
+EXTRACTION_ANSWER_TOKENS = 250
+
+# Pipeline profiles trading research depth for latency. Expected latencies are rough figures for
+# llama3.1 on a local GPU with cold caches; the measured latency is reported with every result.
+PIPELINE_PROFILES = {
+    "fast": {
+        "description": "Ranks the top search results from their listing data in a single LLM call",
+        "llm_query_restructuring": False,  # Template or plain concatenation only
+        "enrich_top_n": 0,                 # No Tavily research
+        "rank_top_n": 8,                   # Only the first search results are ranked...
+        "compact_ranking": True,           # ...with a short answer per product, in one batch
+        "write_recommendations": False,    # Reasons come from the ranking answer
+        "expected_seconds": 5
+    },
+    "balanced": {
+        "description": "Researches the top candidates and ranks the rest from their listing data",
+        "llm_query_restructuring": True,
+        "enrich_top_n": 5,
+        "rank_top_n": None,
+        "compact_ranking": False,
+        "write_recommendations": True,
+        "expected_seconds": 25
+    },
+    "thorough": {
+        "description": "Researches every product before ranking it",
+        "llm_query_restructuring": True,
+        "enrich_top_n": None,
+        "rank_top_n": None,
+        "compact_ranking": False,
+        "write_recommendations": True,
+        "expected_seconds": 60
+    }
+}
+DEFAULT_PROFILE = "thorough"
+
 class ProductState(TypedDict):
     """State for the shopping assistant workflow"""
     query: str
     max_price: Optional[float]
     additional_requirements: str  
+    profile: str
     products: List[Dict[str, Any]]
     processed_query: Dict[str, str]
     detailed_products: List[Dict[str, Any]]
+    pipelined_rankings: Optional[List[Tuple[int, Dict[str, Any]]]]
     ranked_products: List[Dict[str, Any]]
     recommendations: List[Dict[str, Any]]
     recommendations_analysis: str
     status: Dict[str, str]
+    metrics: Dict[str, Any]
+
+def spec_cache_key(product: Dict[str, Any]) -> str:
+    """Key a product by its SerpAPI product_id, falling back to its normalized title"""
+    if product.get('product_id'):
+        return f"id:{product['product_id']}"
+    normalized_title = re.sub(r'[^a-z0-9]+', ' ', product.get('title', '').lower()).strip()
+    return f"title:{normalized_title}"
 
 class ShoppingGraph:
-    def __init__(self):
+    def __init__(self, tavily_concurrency: int = 5, llm_concurrency: int = 2, llm: Optional[LLMGateway] = None,
+                 spec_cache: Optional[SQLiteCache] = None, stream_recommendations: bool = True,
+                 rank_batch_size: int = 5, rank_concurrency: int = 2, pipeline_ranking: bool = True,
+                 context_token_budget: int = DEFAULT_TOKEN_BUDGET, batch_extraction: bool = False,
+                 extraction_context_window: int = 8192):
+        # Stream the recommendation narrative token by token instead of waiting for the full completion
+        self.stream_recommendations = stream_recommendations
+        # Products per ranking prompt and how many ranking prompts may run at once
+        self.rank_batch_size = rank_batch_size
+        self.rank_concurrency = rank_concurrency
+        # Start ranking batches while the remaining products are still being enriched
+        self.pipeline_ranking = pipeline_ranking
+        # All LLM calls go through the gateway so repeated prompts are answered from its cache
+        self.llm = llm or LLMGateway()
+        # Structured specifications depend only on the product, so they are reused across searches
+        if spec_cache is None:
+            spec_cache = SQLiteCache(
+                os.getenv("SPEC_CACHE_PATH", os.path.join(CACHE_DIR, "product_specs.sqlite3")),
+                table="product_specs",
+                max_entries=5000,
+                default_ttl=7 * 24 * 3600  # Keep product details for a week
+            )
+        self.spec_cache = spec_cache
+        # Maximum number of Tavily tokens per product in the extraction prompt
+        self.context_token_budget = context_token_budget
+        # Structure several products per LLM call, as many as fit into the context window
+        self.batch_extraction = batch_extraction
+        self.extraction_context_window = extraction_context_window
+        # Maximum number of concurrent Tavily lookups / LLM calls, shared by all queries on an event loop
+        self.tavily_concurrency = tavily_concurrency
+        self.llm_concurrency = llm_concurrency
+        self._loop_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+        self._loop_semaphores_lock = threading.Lock()
         self.graph = self._build_graph()
-        self.product_cache = TTLCache(maxsize=100, ttl=3600)  # Cache for 1 hour
+        self.product_cache = shared_product_cache
+        
+    def _semaphores(self) -> Dict[str, asyncio.Semaphore]:
+        """Tavily, extraction LLM and ranking limits shared by all queries running on the current event loop
         
+        Semaphores are bound to an event loop. Queries run concurrently on one loop (as in the batch runner)
+        therefore share the limits, so they bound the total load rather than the load of each query.
+        """
+        loop = asyncio.get_running_loop()
+        with self._loop_semaphores_lock:
+            semaphores = self._loop_semaphores.get(loop)
+            if semaphores is None:
+                semaphores = {
+                    "tavily": asyncio.Semaphore(self.tavily_concurrency),
+                    "llm": asyncio.Semaphore(self.llm_concurrency),
+                    "rank": asyncio.Semaphore(self.rank_concurrency)
+                }
+                self._loop_semaphores[loop] = semaphores
+            return semaphores
+    
     def _build_graph(self) -> Graph:
         """Build the LangGraph workflow"""
         # Define the nodes
@@ -53,13 +200,17 @@ class ShoppingGraph:
         # Add nodes for each step in the workflow
         workflow.add_node("process_query", self._process_query_node)
         workflow.add_node("search_products", self._search_products_node)
+        workflow.add_node("filter_products", self._filter_products_node)
+        workflow.add_node("deduplicate_products", self._deduplicate_products_node)
         workflow.add_node("extract_specifications", self._extract_specifications_node)
         workflow.add_node("rank_products", self._rank_products_node)
         workflow.add_node("generate_recommendations", self._generate_recommendations_node)
                 
         # Define the edges
         workflow.add_edge("process_query", "search_products")
-        workflow.add_edge("search_products", "extract_specifications")
+        workflow.add_edge("search_products", "filter_products")
+        workflow.add_edge("filter_products", "deduplicate_products")
+        workflow.add_edge("deduplicate_products", "extract_specifications")
         workflow.add_edge("extract_specifications", "rank_products")
         workflow.add_edge("rank_products", "generate_recommendations")
         workflow.add_edge("generate_recommendations", END)  # Add direct edge to end
@@ -72,106 +223,46 @@ class ShoppingGraph:
     async def _process_query_node(self, state: ProductState) -> ProductState:
         """Process and restructure the user query with additional requirements"""
         try:
-            # Create the prompt
-            prompt = f"""You are an AI assistant that restructures user queries for product searches. 
-            Your task is to create a detailed search query that includes ALL requirements and price limit.
-            
-            Basic Query: {state['query']}
-            Max Price: {state['max_price']} euros
-            Additional Requirements: {state['additional_requirements']}
-            
-            Please provide your response in the following format:
-            Translated: [translated query if needed]
-            Restructured: [restructured query incorporating additional requirements and price limit]
-            
-            CRITICAL RULES:
-            1. ALWAYS include the price limit in the restructured query
-            2. ALWAYS include ALL additional requirements in the restructured query
-            3. Make the query specific and search-friendly
-            4. Keep the query concise but informative
-            5. For technical specifications (RAM, storage, etc.), add them AFTER the main product
-            6. For product type modifiers (Gaming, Professional, etc.), add them BEFORE the main product
-            7. Use natural language that search engines understand
-            8. Make sure that there are no repetitive phrases
-            
-            Examples:
-            Query: Laptop
-            Max Price: 1000 euros
-            Additional Requirements: 16GB RAM, Gaming
-            Restructured: Gaming Laptop with 16GB RAM under 1000 euros
-            
-            Query: Laptop
-            Max Price: 4000 euros
-            Additional Requirements: Gaming
-            Restructured: Gaming Laptop under 4000 euros
-            
-            Query: Washing Machine
-            Max Price: 800 euros
-            Additional Requirements: 
-            Restructured: Washing Machine under 800 euros
-            
-            Query: Smartphone
-            Max Price: 500 euros
-            Additional Requirements: 5G, 128GB
-            Restructured: 5G Smartphone with 128GB storage under 500 euros
-            
-            Query: Monitor
-            Max Price: 300 euros
-            Additional Requirements: 27 inch, 4K
-            Restructured: 27 inch 4K Monitor under 300 euros
-            
-            Query: Headphones
-            Max Price: 200 euros
-            Additional Requirements: Wireless, Noise Cancelling
-            Restructured: Wireless Noise Cancelling Headphones under 200 euros
-            
-            Query: Camera
-            Max Price: 1000 euros
-            Additional Requirements: DSLR, 24MP
-            Restructured: DSLR Camera with 24MP under 1000 euros
-            
-            Query: Printer
-            Max Price: 150 euros
-            Additional Requirements: Wireless, Color
-            Restructured: Wireless Color Printer under 150 euros"""
-            
-            # Call Ollama directly
-            response = ollama.chat(model='llama3.1', messages=[
-                {
-                    'role': 'user',
-                    'content': prompt
-                }
-            ])
-            
-            result = response['message']['content']
-            
-            # Extract translated and restructured queries
-            translated = re.search(r"^Translated: (.+)$", result, re.MULTILINE)
-            restructured = re.search(r"^Restructured: (.+)$", result, re.MULTILINE)
-            
-            # Ensure price is included in restructured query
-            final_restructured = restructured.group(1) if restructured else state["query"]
-            
-            # Ensure additional requirements are included
-            if state["additional_requirements"] and state["additional_requirements"].strip():
-                requirements = state["additional_requirements"].strip()
-                if requirements.lower() not in final_restructured.lower():
-                    # Add requirements at the beginning of the query
-                    final_restructured = f"{requirements} {final_restructured}"
-            
-            # Ensure price is included
-            if state["max_price"] and f"{state['max_price']} euros" not in final_restructured.lower():
-                final_restructured = f"{final_restructured} under {state['max_price']} euros"
-            
+            memo_key = (
+                state["query"].strip().lower(),
+                state["max_price"],
+                (state["additional_requirements"] or "").strip().lower()
+            )
+            with shared_query_memo_lock:
+                processed_query = shared_query_memo.get(memo_key)
+
+            if processed_query is None:
+                # Common English queries are restructured by a template; the LLM handles the rest
+                restructured = template_restructure(
+                    state["query"], state["max_price"], state["additional_requirements"]
+                )
+                if restructured is not None:
+                    processed_query = {"translated": state["query"], "restructured": restructured, "method": "template"}
+                elif PIPELINE_PROFILES[state["profile"]]["llm_query_restructuring"]:
+                    processed_query = await self._restructure_query_with_llm(state)
+                else:
+                    processed_query = {
+                        "translated": state["query"],
+                        "restructured": self._concatenate_query(state),
+                        "method": "concatenation"
+                    }
+                if processed_query["method"] != "concatenation":
+                    with shared_query_memo_lock:
+                        shared_query_memo[memo_key] = processed_query
+            else:
+                processed_query = {**processed_query, "method": "memo"}
+            logger.info(f"Restructured query via {processed_query['method']}: {processed_query['restructured']}")
+
             state["processed_query"] = {
-                "translated": translated.group(1) if translated else state["query"],
-                "restructured": final_restructured,
+                **processed_query,
                 "original_requirements": state["additional_requirements"]
             }
             
             state["status"] = {
                 "process_query": "Completed",
                 "search_products": "Pending",
+                "filter_products": "Pending",
+                "deduplicate_products": "Pending",
                 "extract_specifications": "Pending",
                 "rank_products": "Pending",
                 "generate_recommendations": "Pending"
@@ -189,12 +280,94 @@ class ShoppingGraph:
             state["status"] = {
                 "process_query": f"Failed: {str(e)}",
                 "search_products": "Pending",
+                "filter_products": "Pending",
+                "deduplicate_products": "Pending",
                 "extract_specifications": "Pending",
                 "rank_products": "Pending",
                 "generate_recommendations": "Pending"
             }
             return state
     
+    @staticmethod
+    def _concatenate_query(state: ProductState) -> str:
+        """Plain search query from the requirements, the query and the price limit"""
+        restructured = " ".join(part.strip() for part in (state["additional_requirements"] or "", state["query"]) if part.strip())
+        if state["max_price"]:
+            restructured = f"{restructured} under {format_price(state['max_price'])} euros"
+        return restructured
+    
+    async def _restructure_query_with_llm(self, state: ProductState) -> Dict[str, str]:
+        """Translate and restructure the query with the LLM"""
+        # Only the examples most similar to this query are sent to keep prompt evaluation short
+        examples = format_examples(select_examples(state['query'], state['additional_requirements']))
+        all_examples = format_examples(FEW_SHOT_EXAMPLES)
+        
+        # Create the prompt
+        prompt = f"""You are an AI assistant that restructures user queries for product searches. 
+        Your task is to create a detailed search query that includes ALL requirements and price limit.
+        
+        Basic Query: {state['query']}
+        Max Price: {state['max_price']} euros
+        Additional Requirements: {state['additional_requirements']}
+        
+        Please provide your response in the following format:
+        Translated: [translated query if needed]
+        Restructured: [restructured query incorporating additional requirements and price limit]
+        
+        CRITICAL RULES:
+        1. ALWAYS include the price limit in the restructured query
+        2. ALWAYS include ALL additional requirements in the restructured query
+        3. Make the query specific and search-friendly
+        4. Keep the query concise but informative
+        5. For technical specifications (RAM, storage, etc.), add them AFTER the main product
+        6. For product type modifiers (Gaming, Professional, etc.), add them BEFORE the main product
+        7. Use natural language that search engines understand
+        8. Make sure that there are no repetitive phrases
+        
+        Examples:
+{examples}"""
+        
+        prompt_tokens = count_tokens(prompt)
+        logger.info(
+            f"Query restructuring prompt: {prompt_tokens} tokens "
+            f"({prompt_tokens + count_tokens(all_examples) - count_tokens(examples)} with all examples)"
+        )
+        
+        # Call Ollama directly
+        response = await self.llm.achat('process_query', messages=[
+            {
+                'role': 'user',
+                'content': prompt
+            }
+        ])
+        
+        result = response['message']['content']
+        
+        # Extract translated and restructured queries
+        translated = re.search(r"^Translated: (.+)$", result, re.MULTILINE)
+        restructured = re.search(r"^Restructured: (.+)$", result, re.MULTILINE)
+        
+        # Ensure price is included in restructured query
+        final_restructured = restructured.group(1) if restructured else state["query"]
+        
+        # Ensure additional requirements are included
+        if state["additional_requirements"] and state["additional_requirements"].strip():
+            requirements = state["additional_requirements"].strip()
+            if requirements.lower() not in final_restructured.lower():
+                # Add requirements at the beginning of the query
+                final_restructured = f"{requirements} {final_restructured}"
+        
+        # Ensure price is included
+        # Worded as in the template and concatenation paths, so the same query gets the same search string
+        if state["max_price"] and f"{format_price(state['max_price'])} euros" not in final_restructured.lower():
+            final_restructured = f"{final_restructured} under {format_price(state['max_price'])} euros"
+        
+        return {
+            "translated": translated.group(1) if translated else state["query"],
+            "restructured": final_restructured,
+            "method": "llm"
+        }
+    
     async def _search_products_node(self, state: ProductState) -> ProductState:
         """Search for products using SerpAPI"""
         try:
@@ -208,44 +381,21 @@ class ShoppingGraph:
                 "hl": "en",
             }
 
-            search = GoogleSearch(params)
-            results = search.get_dict()
-            product_results = results.get("shopping_results", [])[:20]
-
-            products = []
-            for r in product_results:
-                # Get price directly without conversion
-                price = r.get('extracted_price', '')
-                if price and isinstance(price, (int, float)):
-                    price = f"€{price:.2f}"
-                else:
-                    price = f"€{price}" if price else 'N/A'
-
-                # Format reviews to preserve exact number
-                reviews = r.get('reviews', '')
-                if reviews and isinstance(reviews, (int, float)):
-                    reviews = str(int(reviews))  # Convert to integer and then string to remove decimal places
-                elif not reviews:
-                    reviews = 'N/A'
+            # Results are shared across sessions; stale entries are served while being refreshed
+            cache_key = (params["q"].strip().lower(), params["location"], params["gl"], params["hl"])
+            cached_products = await asyncio.to_thread(
+                self.product_cache.get_or_fetch, cache_key, lambda: self._fetch_shopping_results(params)
+            )
 
-                product = {
-                    "product_id": r.get('product_id', ''),
-                    "title": r.get('title', ''),
-                    "url": r.get('product_link', ''),
-                    "source": r.get('source', ''),
-                    "price": price,
-                    "old_price": r.get('extracted_old_price', ''),
-                    "rating": r.get('rating', ''),
-                    "reviews": reviews,
-                    "extensions": r.get('extensions', []),
-                    "image": r.get('thumbnail', ''),
-                    "processed_query": state["processed_query"]  # Add the processed query to each product
-                }
-                products.append(product)
+            # Add the processed query to each product (copies keep the cached entries untouched)
+            products = [
+                {**product, "processed_query": state["processed_query"]}
+                for product in cached_products
+            ]
             
             state["products"] = products
             state["status"]["search_products"] = f"Completed: Found {len(products)} products"
-            state["status"]["extract_specifications"] = "Pending"
+            state["status"]["filter_products"] = "Pending"
             
             return state
 
@@ -253,11 +403,104 @@ class ShoppingGraph:
             logger.error(f"Error in search: {e}")
             state["products"] = []
             state["status"]["search_products"] = f"Failed: {str(e)}"
+            state["status"]["filter_products"] = "Pending"
+            return state
+    
+    def _fetch_shopping_results(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Query SerpAPI Google Shopping and normalize the results"""
+        from serpapi import GoogleSearch
+        
+        search = GoogleSearch(params)
+        results = search.get_dict()
+        product_results = results.get("shopping_results", [])[:20]
+
+        products = []
+        for r in product_results:
+            # Get price directly without conversion
+            price = r.get('extracted_price', '')
+            if price and isinstance(price, (int, float)):
+                price = f"€{price:.2f}"
+            else:
+                price = f"€{price}" if price else 'N/A'
+
+            # Format reviews to preserve exact number
+            reviews = r.get('reviews', '')
+            if reviews and isinstance(reviews, (int, float)):
+                reviews = str(int(reviews))  # Convert to integer and then string to remove decimal places
+            elif not reviews:
+                reviews = 'N/A'
+            
+            # Numeric copies of the display fields for filtering and sorting
+            reviews_value = parse_number(r.get('reviews'))
+
+            product = {
+                "product_id": r.get('product_id', ''),
+                "title": r.get('title', ''),
+                "url": r.get('product_link', ''),
+                "source": r.get('source', ''),
+                "price": price,
+                "old_price": r.get('extracted_old_price', ''),
+                "rating": r.get('rating', ''),
+                "reviews": reviews,
+                "price_value": parse_number(r.get('extracted_price')),
+                "rating_value": parse_number(r.get('rating')),
+                "reviews_count": int(reviews_value) if reviews_value is not None else None,
+                "extensions": r.get('extensions', []),
+                "image": r.get('thumbnail', '')
+            }
+            products.append(product)
+        return products
+    
+    async def _filter_products_node(self, state: ProductState) -> ProductState:
+        """Drop over-budget and malformed products and deprioritize unpriced ones before any LLM work"""
+        try:
+            products, report = prefilter_products(state["products"], state["max_price"])
+            
+            # Each dropped product saves a Tavily lookup and a structuring call, plus its share of the ranking calls
+            dropped = report["input"] - report["kept"]
+            ranking_calls_saved = math.ceil(report["input"] / self.rank_batch_size) - math.ceil(report["kept"] / self.rank_batch_size)
+            report["tavily_calls_saved"] = dropped
+            report["llm_calls_saved"] = dropped + ranking_calls_saved
+            logger.info(f"Pre-filter: {report}")
+            
+            state["products"] = products
+            state.setdefault("metrics", {})["prefilter"] = report
+            state["status"]["filter_products"] = f"Completed: Kept {report['kept']} of {report['input']} products, saving {report['llm_calls_saved']} LLM calls"
+            state["status"]["deduplicate_products"] = "Pending"
+            return state
+        
+        except Exception as e:
+            logger.error(f"Error in filter_products_node: {e}")
+            state["status"]["filter_products"] = f"Failed: {str(e)}"
+            state["status"]["deduplicate_products"] = "Pending"
+            return state
+    
+    async def _deduplicate_products_node(self, state: ProductState) -> ProductState:
+        """Collapse offers of the same product from different sellers so each product is enriched once"""
+        try:
+            products, report = deduplicate_products(state["products"])
+            
+            # Every collapsed duplicate saves the same calls as a product dropped by the pre-filter
+            ranking_calls_saved = math.ceil(report["input"] / self.rank_batch_size) - math.ceil(report["clusters"] / self.rank_batch_size)
+            report["llm_calls_saved"] = report["duplicates_collapsed"] + ranking_calls_saved
+            logger.info(f"Deduplication: {report}")
+            
+            state["products"] = products
+            state.setdefault("metrics", {})["deduplication"] = report
+            state["status"]["deduplicate_products"] = f"Completed: Collapsed {report['duplicates_collapsed']} duplicate offers into {report['clusters']} products"
+            state["status"]["extract_specifications"] = "Pending"
+            return state
+        
+        except Exception as e:
+            logger.error(f"Error in deduplicate_products_node: {e}")
+            state["status"]["deduplicate_products"] = f"Failed: {str(e)}"
             state["status"]["extract_specifications"] = "Pending"
             return state
     
     async def _extract_specifications_node(self, state: ProductState) -> ProductState:
         """Extract and structure product specifications using Tavily and LLM"""
+        from langchain_community.tools.tavily_search import TavilySearchResults
+        
         tool = TavilySearchResults(
             max_results=2,
             search_depth="advanced",
@@ -265,368 +508,465 @@ class ShoppingGraph:
             include_raw_content=True
         )
         
-        detailed_products = []
-        for product in state["products"]:
+        semaphores = self._semaphores()
+        tavily_semaphore = semaphores["tavily"]
+        llm_semaphore = semaphores["llm"]
+        
+        # The profile may research only the top candidates; the others are ranked from their listing data
+        profile = PIPELINE_PROFILES[state["profile"]]
+        products = state["products"]
+        research_count = len(products) if profile["enrich_top_n"] is None else min(profile["enrich_top_n"], len(products))
+        pipeline_ranking = self.pipeline_ranking and not profile["compact_ranking"]
+        
+        # With pipelined ranking, a ranking batch starts as soon as all of its products are enriched. Batches
+        # hold the same products (by index) as in rank_products_node, so prompts and results do not depend
+        # on the order in which enrichment finishes, and the LLM cache can answer repeated queries.
+        rank_semaphore = semaphores["rank"]
+        rank_count = len(products[:profile["rank_top_n"]])
+        rank_tasks = []
+        ready_for_ranking = {}
+        
+        def add_to_ranking(index: int, detailed_product: Dict[str, Any]) -> None:
+            if not pipeline_ranking or index >= rank_count:
+                return
+            ready_for_ranking[index] = detailed_product
+            start = index - index % self.rank_batch_size
+            batch_indices = range(start, min(start + self.rank_batch_size, rank_count))
+            if all(i in ready_for_ranking for i in batch_indices):
+                batch = [(i, ready_for_ranking[i]) for i in batch_indices]
+                rank_tasks.append(asyncio.create_task(
+                    self._rank_batch(state, batch, start // self.rank_batch_size + 1, rank_semaphore)
+                ))
+        
+        # Enrich the products concurrently, storing each result at its original position
+        detailed_products = [None] * len(products)
+        for index in range(research_count, len(products)):
+            detailed_products[index] = self._placeholder_details(products[index], "Not researched.")
+            emit_progress({
+                "event": "product_skipped",
+                "node": "extract_specifications",
+                "index": index,
+                "product": detailed_products[index]
+            })
+            add_to_ranking(index, detailed_products[index])
+        
+        if self.batch_extraction:
+            enriched = self._enrich_in_batches(products[:research_count], tool, tavily_semaphore, llm_semaphore)
+        else:
+            enriched = self._enrich_one_by_one(products[:research_count], tool, tavily_semaphore, llm_semaphore)
+        async for index, detailed_product in enriched:
+            detailed_products[index] = detailed_product
+            emit_progress({
+                "event": "product_enriched",
+                "node": "extract_specifications",
+                "index": index,
+                "product": detailed_product
+            })
+            add_to_ranking(index, detailed_product)
+        
+        state["pipelined_rankings"] = None
+        if pipeline_ranking:
             try:
-                # First search for general product information
-                search_query = f"{product['title']} product technical description details specifications features pros cons"
-                details = tool.invoke(search_query)
-                
-                content = ""
-                if details and isinstance(details, list):
-                    for item in details:
-                        if isinstance(item, dict) and 'content' in item:
-                            content += item['content'] + '\n'
-                        elif isinstance(item, str):
-                            content += item + '\n'
-                
-                if not content:
-                    content = "No details found."
-                
-                # Use LLM to structure and summarize the details
-                prompt = f"""You are a product analysis expert. Analyze and structure the following product details into a clear, organized format.
-                Focus on key specifications, features, and important information.
-                
-                Product: {product['title']}
-                Price: {product.get('price', 'N/A')}
-                Rating: {product.get('rating', 'N/A')}
-                Reviews: {product.get('reviews', 'N/A')}
-                
-                Raw Details: {content}
-                
-                You MUST respond with a valid JSON object in this exact format:
-                {{
-                    "key_features": [
-                        "feature 1",
-                        "feature 2",
-                        "feature 3"
-                    ],
-                    "pros": [
-                        "pro 1",
-                        "pro 2",
-                        "pro 3"
-                    ],
-                    "cons": [
-                        "con 1",
-                        "con 2",
-                        "con 3"
-                    ],
-                    "summary": "Brief overall summary of the product's value proposition"
-                }}
+                batch_results = await asyncio.gather(*rank_tasks)
+                # Keep the batch order of rank_products_node, whatever order the batches finished in
+                batch_results = sorted(batch_results, key=lambda result: result[1]["batch"])
+                state["pipelined_rankings"] = [pair for ranked_products, _ in batch_results for pair in ranked_products]
+                state.setdefault("metrics", {})["rank_batches"] = [timing for _, timing in batch_results]
+            except Exception as e:
+                # rank_products_node ranks everything again on its own, so the other batches are not needed
+                logger.error(f"Error in pipelined ranking: {e}")
+                for task in rank_tasks:
+                    task.cancel()
+                await asyncio.gather(*rank_tasks, return_exceptions=True)
+        
+        cached_count = sum(1 for product in detailed_products if product.get("specs_from_cache"))
+        context_reports = [product["context_tokens"] for product in detailed_products if product.get("context_tokens")]
+        state.setdefault("metrics", {})["context_tokens"] = {
+            "tokens_in": sum(report["tokens_in"] for report in context_reports),
+            "tokens_kept": sum(report["tokens_kept"] for report in context_reports)
+        }
+        state["detailed_products"] = list(detailed_products)
+        state["status"]["extract_specifications"] = f"Completed: Extracted and structured details for {research_count} products ({cached_count} from cache)"
+        if research_count < len(detailed_products):
+            state["status"]["extract_specifications"] += f", {len(detailed_products) - research_count} ranked from listing data only"
+        state["status"]["rank_products"] = "Pending"
+        return state
+    
+    async def _enrich_product(self, product: Dict[str, Any], tool: "TavilySearchResults",
+                              tavily_semaphore: asyncio.Semaphore, llm_semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """Look up a single product with Tavily and structure its details with the LLM"""
+        try:
+            lookup = await self._look_up_product(product, tool, tavily_semaphore)
+            if lookup["specs_from_cache"]:
+                return {**product, **lookup}
+            return await self._structure_product(product, lookup, llm_semaphore)
+        except Exception as e:
+            logger.error(f"Error extracting specifications for product {product.get('title')}: {e}")
+            return self._placeholder_details(product)
+    
+    async def _enrich_one_by_one(self, products: List[Dict[str, Any]], tool: "TavilySearchResults",
+                                 tavily_semaphore: asyncio.Semaphore,
+                                 llm_semaphore: asyncio.Semaphore) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Yield (index, detailed product) pairs as products finish, with one LLM call per product"""
+        async def enrich(index: int, product: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+            return index, await self._enrich_product(product, tool, tavily_semaphore, llm_semaphore)
+        
+        for next_enriched in asyncio.as_completed([enrich(index, product) for index, product in enumerate(products)]):
+            yield await next_enriched
+    
+    async def _enrich_in_batches(self, products: List[Dict[str, Any]], tool: "TavilySearchResults",
+                                 tavily_semaphore: asyncio.Semaphore,
+                                 llm_semaphore: asyncio.Semaphore) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Yield (index, detailed product) pairs, structuring several looked-up products per LLM call"""
+        finished: asyncio.Queue = asyncio.Queue()
+        pending = []
+        batch_tasks = []
+        
+        def dispatch_batch() -> None:
+            batch = list(pending)
+            pending.clear()
+            batch_task = asyncio.create_task(self._structure_batch(batch, llm_semaphore, finished))
+            batch_task.add_done_callback(on_producer_done)
+            batch_tasks.append(batch_task)
+        
+        def on_producer_done(_: asyncio.Task) -> None:
+            # Batches are only dispatched by the lookup task, so once it and every batch are done nothing more
+            # will arrive; the sentinel is queued after everything they produced
+            if lookup_task.done() and all(task.done() for task in batch_tasks):
+                finished.put_nowait(None)
+        
+        async def look_up(index: int, product: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]:
+            try:
+                return index, product, await self._look_up_product(product, tool, tavily_semaphore)
+            except Exception as e:
+                logger.error(f"Error extracting specifications for product {product.get('title')}: {e}")
+                return index, product, None
+        
+        async def look_up_all() -> None:
+            lookups = [look_up(index, product) for index, product in enumerate(products)]
+            for next_lookup in asyncio.as_completed(lookups):
+                index, product, lookup = await next_lookup
+                if lookup is None:
+                    finished.put_nowait((index, self._placeholder_details(product)))
+                elif lookup["specs_from_cache"]:
+                    finished.put_nowait((index, {**product, **lookup}))
+                else:
+                    # Start a batch when the next product would no longer fit into the context window
+                    if pending and self._batch_prompt_tokens(pending + [(index, product, lookup)]) > self.extraction_context_window:
+                        dispatch_batch()
+                    pending.append((index, product, lookup))
+            if pending:
+                dispatch_batch()
+        
+        lookup_task = asyncio.create_task(look_up_all())
+        lookup_task.add_done_callback(on_producer_done)
+        remaining = set(range(len(products)))
+        while remaining:
+            item = await finished.get()
+            if item is None:
+                break
+            remaining.discard(item[0])
+            yield item
+        
+        # A product is missing only if a producer failed outside its own error handling
+        for result in await asyncio.gather(lookup_task, *batch_tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Error in batched specification extraction: {result}")
+        for index in sorted(remaining):
+            yield index, self._placeholder_details(products[index])
+    
+    async def _look_up_product(self, product: Dict[str, Any], tool: "TavilySearchResults",
+                               tavily_semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """Return cached details for a product, or its Tavily context for the LLM to structure"""
+        # Reuse details from any earlier search that returned the same product
+        # SQLite calls take a lock and touch the disk, so they run off the event loop like the LLM cache's
+        cached_details = await asyncio.to_thread(self.spec_cache.get, spec_cache_key(product))
+        if cached_details is not None:
+            return {**cached_details, "specs_from_cache": True}
+        
+        # First search for general product information
+        search_query = f"{product['title']} product technical description details specifications features pros cons"
+        async with tavily_semaphore:
+            details = await asyncio.to_thread(tool.invoke, search_query)
+        
+        # Keep only the most relevant passages within the per-product token budget
+        content, context_report = assemble_context(
+            details if isinstance(details, list) else [], product['title'], self.context_token_budget
+        )
+        logger.info(
+            f"Context for {product['title']}: kept {context_report['tokens_kept']} of "
+            f"{context_report['tokens_in']} tokens ({context_report['passages_kept']}/{context_report['passages_in']} passages)"
+        )
+        
+        return {
+            "specs_from_cache": False,
+            # Only cache details that are based on actual search results
+            "cacheable": bool(content),
+            "content": content or "No details found.",
+            "context_tokens": context_report
+        }
+    
+    async def _structure_product(self, product: Dict[str, Any], lookup: Dict[str, Any],
+                                 llm_semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """Structure the looked-up details of a single product with the LLM"""
+        # Use LLM to structure and summarize the details
+        prompt = f"""You are a product analysis expert. Analyze and structure the following product details into a clear, organized format.
+        Focus on key specifications, features, and important information.
+        
+        Product: {product['title']}
+        Price: {product.get('price', 'N/A')}
+        Rating: {product.get('rating', 'N/A')}
+        Reviews: {product.get('reviews', 'N/A')}
+        
+        Raw Details: {lookup['content']}
+        
+        You MUST respond with a valid JSON object in this exact format:
+        {{
+            "key_features": [
+                "feature 1",
+                "feature 2",
+                "feature 3"
+            ],
+            "pros": [
+                "pro 1",
+                "pro 2",
+                "pro 3"
+            ],
+            "cons": [
+                "con 1",
+                "con 2",
+                "con 3"
+            ],
+            "summary": "Brief overall summary of the product's value proposition"
+        }}
+        
+        CRITICAL RULES:
+        1. Your response MUST be a valid JSON object
+        2. Do not include any text before or after the JSON object
+        3. Use double quotes for all strings
+        4. Provide at least 3 items in each list
+        5. Use specific, detailed information
+        6. Focus on concrete features and specifications
+        7. Do not include any markdown formatting
+        8. Do not include any explanatory text
+        """
+        
+        async with llm_semaphore:
+            response = await self.llm.achat('extract_specifications', expect_json=True, messages=[
+                {
+                    'role': 'user',
+                    'content': prompt
+                }
+            ])
+        
+        # Clean the response to ensure it's valid JSON
+        content = response['message']['content'].strip()
+        try:
+            structured_details = self._parse_specifications(product, content)
+        except Exception as e:
+            logger.error(f"Error parsing response for product {product.get('title')}: {e}")
+            structured_details = None
+        return await self._finish_product(product, lookup, structured_details, content)
+    
+    async def _structure_batch(self, batch: List[Tuple[int, Dict[str, Any], Dict[str, Any]]],
+                               llm_semaphore: asyncio.Semaphore, finished: asyncio.Queue) -> None:
+        """Structure several products in one LLM call, falling back to single calls for entries that fail to parse"""
+        product_ids = {f"P{position}": item for position, item in enumerate(batch, 1)}
+        entries: Dict[str, Any] = {}
+        
+        try:
+            if len(batch) > 1:
+                products_text = "\n\n".join(
+                    f"Product ID: {product_id}\n"
+                    f"Product: {product['title']}\n"
+                    f"Price: {product.get('price', 'N/A')}\n"
+                    f"Rating: {product.get('rating', 'N/A')}\n"
+                    f"Reviews: {product.get('reviews', 'N/A')}\n"
+                    f"Raw Details: {lookup['content']}"
+                    for product_id, (_, product, lookup) in product_ids.items()
+                )
+                prompt = EXTRACTION_BATCH_PROMPT.format(products=products_text, product_ids=", ".join(product_ids))
                 
-                CRITICAL RULES:
-                1. Your response MUST be a valid JSON object
-                2. Do not include any text before or after the JSON object
-                3. Use double quotes for all strings
-                4. Provide at least 3 items in each list
-                5. Use specific, detailed information
-                6. Focus on concrete features and specifications
-                7. Do not include any markdown formatting
-                8. Do not include any explanatory text
-                """
+                start_time = time.perf_counter()
+                async with llm_semaphore:
+                    response = await self.llm.achat(
+                        'extract_specifications', format='json', expect_json=True,
+                        messages=[{'role': 'user', 'content': prompt}],
+                        options={'num_ctx': self.extraction_context_window}
+                    )
+                logger.info(f"Structured {len(batch)} products in one call in {time.perf_counter() - start_time:.2f}s")
                 
-                response = ollama.chat(model='llama3.1', messages=[
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ])
-                
-                try:
-                    # Clean the response to ensure it's valid JSON
-                    content = response['message']['content'].strip()
-                    # Remove any markdown code block markers
-                    content = content.replace('```json', '').replace('```', '').strip()
-                    
-                    # Try to fix common JSON formatting issues
-                    content = content.replace("'", '"')  # Replace single quotes with double quotes
-                    content = re.sub(r'(\w+):', r'"\1":', content)  # Add quotes to keys
-                    
-                    # Parse the JSON response
-                    try:
-                        structured_details = json.loads(content)
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"Initial JSON parsing failed for product {product.get('title')}, attempting to fix format")
-                        # Try to extract JSON-like structure using regex
-                        key_features_match = re.search(r'"key_features"\s*:\s*\[(.*?)\]', content, re.DOTALL)
-                        pros_match = re.search(r'"pros"\s*:\s*\[(.*?)\]', content, re.DOTALL)
-                        cons_match = re.search(r'"cons"\s*:\s*\[(.*?)\]', content, re.DOTALL)
-                        summary_match = re.search(r'"summary"\s*:\s*"(.*?)"', content, re.DOTALL)
-                        
-                        # Create structured details from matches
-                        structured_details = {
-                            'key_features': [f.strip().strip('"\'') for f in key_features_match.group(1).split(',')] if key_features_match else ['No key features found'],
-                            'pros': [p.strip().strip('"\'') for p in pros_match.group(1).split(',')] if pros_match else ['No pros found'],
-                            'cons': [c.strip().strip('"\'') for c in cons_match.group(1).split(',')] if cons_match else ['No cons found'],
-                            'summary': summary_match.group(1) if summary_match else 'No summary available'
-                        }
-                    
-                    # Validate the structure
-                    required_fields = ['key_features', 'pros', 'cons', 'summary']
-                    for field in required_fields:
-                        if field not in structured_details:
-                            structured_details[field] = [] if field != 'summary' else 'No summary available'
-                        elif field != 'summary' and not isinstance(structured_details[field], list):
-                            structured_details[field] = [str(structured_details[field])]
-                    
-                    # Format the sections for display
-                    formatted_details = {
-                        'key_features': '\n'.join(f"- {f}" for f in structured_details.get('key_features', [])) or "No key features found",
-                        'pros': '\n'.join(f"- {p}" for p in structured_details.get('pros', [])) or "No pros found",
-                        'cons': '\n'.join(f"- {c}" for c in structured_details.get('cons', [])) or "No cons found",
-                        'summary': structured_details.get('summary', 'No summary available')
-                    }
-                except Exception as e:
-                    logger.error(f"Error parsing response for product {product.get('title')}: {e}")
-                    # Create a default structured response
-                    structured_details = {
-                        'key_features': ['No key features found'],
-                        'pros': ['No pros found'],
-                        'cons': ['No cons found'],
-                        'summary': 'No summary available'
-                    }
-                    formatted_details = {
-                        'key_features': "No key features found",
-                        'pros': "No pros found",
-                        'cons': "No cons found",
-                        'summary': "No summary available"
-                    }
-                    
-                detailed_product = {
-                    **product,
-                    "raw_details": content,
-                    "structured_details": structured_details,
-                    "formatted_details": formatted_details
-                }
-                detailed_products.append(detailed_product)
-                    
+                content = response['message']['content'].replace('```json', '').replace('```', '').strip()
+                parsed = json.loads(content)
+                if isinstance(parsed, dict):
+                    entries = parsed
+        except Exception as e:
+            logger.error(f"Error in batched specification extraction: {e}")
+        
+        fallbacks = []
+        for product_id, (index, product, lookup) in product_ids.items():
+            entry = entries.get(product_id)
+            if isinstance(entry, dict) and all(field in entry for field in ('key_features', 'pros', 'cons', 'summary')):
+                finished.put_nowait((index, await self._finish_product(product, lookup, entry, json.dumps(entry))))
+            else:
+                fallbacks.append((index, product, lookup))
+        
+        if fallbacks and len(batch) > 1:
+            logger.warning(f"{len(fallbacks)} of {len(batch)} batched products failed to parse, structuring them one by one")
+        
+        async def structure_single(index: int, product: Dict[str, Any], lookup: Dict[str, Any]) -> None:
+            try:
+                detailed_product = await self._structure_product(product, lookup, llm_semaphore)
             except Exception as e:
                 logger.error(f"Error extracting specifications for product {product.get('title')}: {e}")
-                detailed_products.append({
-                    **product,
-                    "raw_details": "No details found.",
-                    "structured_details": "No structured details available.",
-                    "formatted_details": {
-                        'key_features': "No key features found",
-                        'pros': "No pros found",
-                        'cons': "No cons found",
-                        'summary': "No summary available"
-                    }
-                })
+                detailed_product = self._placeholder_details(product)
+            finished.put_nowait((index, detailed_product))
         
-        state["detailed_products"] = detailed_products
-        state["status"]["extract_specifications"] = f"Completed: Extracted and structured details for {len(detailed_products)} products"
-        state["status"]["rank_products"] = "Pending"
-        return state
+        await asyncio.gather(*(structure_single(*item) for item in fallbacks))
+    
+    def _batch_prompt_tokens(self, batch: List[Tuple[int, Dict[str, Any], Dict[str, Any]]]) -> int:
+        """Estimate the context a batch needs: instructions, product contexts and the expected answers"""
+        return (
+            count_tokens(EXTRACTION_BATCH_PROMPT)
+            + sum(count_tokens(product['title']) + count_tokens(lookup['content']) + 30 for _, product, lookup in batch)
+            + EXTRACTION_ANSWER_TOKENS * len(batch)
+        )
+    
+    def _parse_specifications(self, product: Dict[str, Any], content: str) -> Dict[str, Any]:
+        """Parse the JSON specification answer for a product, repairing common formatting issues"""
+        # Remove any markdown code block markers
+        content = content.replace('```json', '').replace('```', '').strip()
+        
+        # Try to fix common JSON formatting issues
+        content = content.replace("'", '"')  # Replace single quotes with double quotes
+        content = re.sub(r'(\w+):', r'"\1":', content)  # Add quotes to keys
+        
+        # Parse the JSON response
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Initial JSON parsing failed for product {product.get('title')}, attempting to fix format")
+            # Try to extract JSON-like structure using regex
+            key_features_match = re.search(r'"key_features"\s*:\s*\[(.*?)\]', content, re.DOTALL)
+            pros_match = re.search(r'"pros"\s*:\s*\[(.*?)\]', content, re.DOTALL)
+            cons_match = re.search(r'"cons"\s*:\s*\[(.*?)\]', content, re.DOTALL)
+            summary_match = re.search(r'"summary"\s*:\s*"(.*?)"', content, re.DOTALL)
+            
+            # Create structured details from matches
+            return {
+                'key_features': [f.strip().strip('"\'') for f in key_features_match.group(1).split(',')] if key_features_match else ['No key features found'],
+                'pros': [p.strip().strip('"\'') for p in pros_match.group(1).split(',')] if pros_match else ['No pros found'],
+                'cons': [c.strip().strip('"\'') for c in cons_match.group(1).split(',')] if cons_match else ['No cons found'],
+                'summary': summary_match.group(1) if summary_match else 'No summary available'
+            }
+    
+    async def _finish_product(self, product: Dict[str, Any], lookup: Dict[str, Any],
+                        structured_details: Optional[Dict[str, Any]], raw_details: str) -> Dict[str, Any]:
+        """Validate and format structured details, caching them when they are based on search results"""
+        cacheable = lookup["cacheable"]
+        try:
+            if not isinstance(structured_details, dict):
+                raise ValueError("No structured details")
+            
+            # Validate the structure
+            required_fields = ['key_features', 'pros', 'cons', 'summary']
+            for field in required_fields:
+                if field not in structured_details:
+                    structured_details[field] = [] if field != 'summary' else 'No summary available'
+                elif field != 'summary' and not isinstance(structured_details[field], list):
+                    structured_details[field] = [str(structured_details[field])]
+            
+            # Format the sections for display
+            formatted_details = {
+                'key_features': '\n'.join(f"- {f}" for f in structured_details.get('key_features', [])) or "No key features found",
+                'pros': '\n'.join(f"- {p}" for p in structured_details.get('pros', [])) or "No pros found",
+                'cons': '\n'.join(f"- {c}" for c in structured_details.get('cons', [])) or "No cons found",
+                'summary': structured_details.get('summary', 'No summary available')
+            }
+        except Exception as e:
+            logger.error(f"Error parsing response for product {product.get('title')}: {e}")
+            cacheable = False
+            # Create a default structured response
+            structured_details = {
+                'key_features': ['No key features found'],
+                'pros': ['No pros found'],
+                'cons': ['No cons found'],
+                'summary': 'No summary available'
+            }
+            formatted_details = {
+                'key_features': "No key features found",
+                'pros': "No pros found",
+                'cons': "No cons found",
+                'summary': "No summary available"
+            }
+        
+        details = {
+            "raw_details": raw_details,
+            "structured_details": structured_details,
+            "formatted_details": formatted_details
+        }
+        if cacheable:
+            await asyncio.to_thread(self.spec_cache.set, spec_cache_key(product), details)
+        
+        return {**product, **details, "specs_from_cache": False, "context_tokens": lookup["context_tokens"]}
+    
+    @staticmethod
+    def _placeholder_details(product: Dict[str, Any], raw_details: str = "No details found.") -> Dict[str, Any]:
+        """Placeholder details for a product that was not researched or whose lookup or extraction failed"""
+        return {
+            **product,
+            "raw_details": raw_details,
+            "structured_details": "No structured details available.",
+            "formatted_details": {
+                'key_features': "No key features found",
+                'pros': "No pros found",
+                'cons': "No cons found",
+                'summary': "No summary available"
+            }
+        }
     
     async def _rank_products_node(self, state: ProductState) -> ProductState:
         """Rank products based on LLM analysis of their details and user requirements"""
         try:
-            # Process products in batches of 5
-            batch_size = 5
-            all_ranked_products = []
-            
-            for i in range(0, len(state["detailed_products"]), batch_size):
-                batch_products = state["detailed_products"][i:i + batch_size]
-                
-                # Create a prompt for analyzing the batch of products
-                prompt = f"""You are a product analysis expert. Analyze and rank these products based on multiple criteria.
-                Consider the user's requirements and provide a comprehensive analysis with detailed scoring.
-                
-                User Requirements:
-                - Basic Query: {state['query']}
-                - Max Price: {state['max_price']} euros
-                - Additional Requirements: {state['additional_requirements']}
-                
-                Products to Analyze:
-                {json.dumps([{
-                    'title': p['title'],
-                    'price': p.get('price', 'N/A'),
-                    'rating': p.get('rating', 'N/A'),
-                    'reviews': p.get('reviews', 'N/A'),
-                    'structured_details': p.get('structured_details', '')
-                } for p in batch_products], indent=2)}
-                
-                You MUST respond with a valid JSON object in this exact format:
-                {{
-                    "products": [
-                        {{
-                            "title": "exact product title",
-                            "price": "price",
-                            "scores": {{
-                                "performance": 1-10,
-                                "value_for_money": 1-10,
-                                "matching_requirements": 1-10,
-                                "overall_score": 1-10
-                            }},
-                            "analysis": {{
-                                "performance_analysis": "Detailed analysis of product performance based on specs and features",
-                                "value_analysis": "Analysis of price vs features and quality",
-                                "requirements_match": "How well it matches user requirements",
-                                "why_recommended": "Overall recommendation reason"
-                            }}
-                        }},
-                        ...
-                    ],
-                    "overall_analysis": "Brief analysis comparing the products and explaining the rankings"
-                }}
-                
-                CRITICAL RULES:
-                1. Your response MUST be a valid JSON object
-                2. Do not include any text before or after the JSON object
-                3. Use double quotes for all strings
-                4. Include all products in the analysis
-                5. Provide specific, detailed explanations for each score
-                6. Consider the following for scoring:
-                   - Performance: Based on specifications, features, and capabilities
-                   - Value for Money: Price vs features, quality, and market comparison
-                   - Matching Requirements: How well it meets user's specific needs
-                   - Overall Score: Weighted combination of all factors
-                7. Scores must be between 1-10 (whole numbers)
-                8. Provide detailed analysis for each scoring category
-                9. Do not include any markdown formatting
-                10. Do not include any explanatory text
-                11. IMPORTANT: When evaluating ratings:
-                    - If a product has less than 10 reviews, give minimal weight to its rating
-                    - If a product has 10-50 reviews, give moderate weight to its rating
-                    - If a product has more than 50 reviews, give full weight to its rating
-                    - Products with no reviews should be evaluated based on their specifications and features only
-                12. Always mention the number of reviews in your analysis when discussing ratings
-                """
-                
-                # Get LLM's analysis for this batch
-                response = ollama.chat(model='llama3.1', messages=[
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ])
-                
+            # Batches may already have been ranked while specifications were being extracted
+            indexed_rankings = state.get("pipelined_rankings")
+            # The fast profile only ranks the first search results, all in one compact batch
+            profile = PIPELINE_PROFILES[state["profile"]]
+            candidates = state["detailed_products"][:profile["rank_top_n"]]
+            if indexed_rankings is None:
+                # Process products in batches, sending up to rank_concurrency batches to the LLM at once
+                batch_size = max(len(candidates), 1) if profile["compact_ranking"] else self.rank_batch_size
+                indexed_products = list(enumerate(candidates))
+                batches = [
+                    indexed_products[i:i + batch_size]
+                    for i in range(0, len(indexed_products), batch_size)
+                ]
+                semaphore = self._semaphores()["rank"]
+                rank_tasks = [
+                    asyncio.create_task(self._rank_batch(state, batch, batch_number, semaphore, compact=profile["compact_ranking"]))
+                    for batch_number, batch in enumerate(batches, 1)
+                ]
                 try:
-                    # Clean the response to ensure it's valid JSON
-                    content = response['message']['content'].strip()
-                    # Remove any markdown code block markers
-                    content = content.replace('```json', '').replace('```', '').strip()
-                    
-                    # Parse the JSON response
-                    analysis_data = json.loads(content)
-                    
-                    # Process the analysis to extract product rankings
-                    for product_analysis in analysis_data.get('products', []):
-                        # Validate required fields
-                        if 'title' not in product_analysis:
-                            continue
-                        
-                        # Ensure all required fields exist with defaults
-                        scores = product_analysis.get('scores', {})
-                        analysis = product_analysis.get('analysis', {})
-                        
-                        # Set default scores if missing
-                        default_scores = {
-                            'performance': 5,
-                            'value_for_money': 5,
-                            'matching_requirements': 5,
-                            'overall_score': 5
-                        }
-                        for key in default_scores:
-                            if key not in scores:
-                                scores[key] = default_scores[key]
-                        
-                        # Set default analysis if missing
-                        default_analysis = {
-                            'performance_analysis': 'No performance analysis available',
-                            'value_analysis': 'No value analysis available',
-                            'requirements_match': 'No requirements match analysis available',
-                            'why_recommended': 'No recommendation reason provided'
-                        }
-                        for key in default_analysis:
-                            if key not in analysis:
-                                analysis[key] = default_analysis[key]
-                        
-                        # Find the matching product
-                        matching_product = next(
-                            (p for p in batch_products 
-                             if p['title'].lower() in product_analysis['title'].lower() or 
-                             product_analysis['title'].lower() in p['title'].lower()),
-                            None
-                        )
-                        
-                        if matching_product:
-                            # Get the formatted details from extract_specifications_node
-                            formatted_details = matching_product.get('formatted_details', {})
-                            
-                            # Create the analysis object
-                            product_analysis = {
-                                'key_features': formatted_details.get('key_features', 'No key features found'),
-                                'pros': formatted_details.get('pros', 'No pros found'),
-                                'cons': formatted_details.get('cons', 'No cons found'),
-                                'scores': scores,
-                                'analysis': analysis,
-                                'price': matching_product.get('price', 'N/A')
-                            }
-                            
-                            # Add the analysis to the product
-                            all_ranked_products.append({
-                                **matching_product,
-                                "analysis": product_analysis
-                            })
-                
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing JSON response in rank_products_node for batch {i//batch_size + 1}: {e}")
-                    # Create a basic analysis for products in this batch
-                    for product in batch_products:
-                        formatted_details = product.get('formatted_details', {})
-                        basic_analysis = {
-                            'key_features': formatted_details.get('key_features', 'No key features found'),
-                            'pros': formatted_details.get('pros', 'No pros found'),
-                            'cons': formatted_details.get('cons', 'No cons found'),
-                            'scores': {
-                                'performance': 5,
-                                'value_for_money': 5,
-                                'matching_requirements': 5,
-                                'overall_score': 5
-                            },
-                            'analysis': {
-                                'performance_analysis': 'No performance analysis available',
-                                'value_analysis': 'No value analysis available',
-                                'requirements_match': 'No requirements match analysis available',
-                                'why_recommended': 'No recommendation reason provided'
-                            },
-                            'price': product.get('price', 'N/A')
-                        }
-                        all_ranked_products.append({
-                            **product,
-                            "analysis": basic_analysis
-                        })
+                    # Failed batches fall back to default scores inside _rank_batch; anything else fails the node
+                    batch_results = await asyncio.gather(*rank_tasks)
+                except Exception:
+                    for task in rank_tasks:
+                        task.cancel()
+                    await asyncio.gather(*rank_tasks, return_exceptions=True)
+                    raise
+                indexed_rankings = [pair for ranked_products, _ in batch_results for pair in ranked_products]
+                state.setdefault("metrics", {})["rank_batches"] = [timing for _, timing in batch_results]
+            
+            # Restore the original product order so that ties are broken the same way however batches were formed
+            indexed_rankings = sorted(indexed_rankings, key=lambda pair: pair[0])
+            all_ranked_products = [product for _, product in indexed_rankings]
             
             # Add any remaining products that weren't analyzed
-            analyzed_titles = {p['title'].lower() for p in all_ranked_products}
-            for product in state["detailed_products"]:
-                if product['title'].lower() not in analyzed_titles:
+            analyzed_indices = {index for index, _ in indexed_rankings}
+            for index, product in enumerate(candidates):
+                if index not in analyzed_indices:
                     # Create a basic analysis for unanalyzed products
-                    formatted_details = product.get('formatted_details', {})
-                    basic_analysis = {
-                        'key_features': formatted_details.get('key_features', 'No key features found'),
-                        'pros': formatted_details.get('pros', 'No pros found'),
-                        'cons': formatted_details.get('cons', 'No cons found'),
-                        'scores': {
-                            'performance': 5,
-                            'value_for_money': 5,
-                            'matching_requirements': 5,
-                            'overall_score': 5
-                        },
-                        'analysis': {
-                            'performance_analysis': 'No performance analysis available',
-                            'value_analysis': 'No value analysis available',
-                            'requirements_match': 'No requirements match analysis available',
-                            'why_recommended': 'No recommendation reason provided'
-                        },
-                        'price': product.get('price', 'N/A')
-                    }
-                    all_ranked_products.append({
-                        **product,
-                        "analysis": basic_analysis
-                    })
+                    all_ranked_products.append(self._default_ranking(product))
             
             # Sort products by overall score
             all_ranked_products.sort(key=lambda x: x.get('analysis', {}).get('scores', {}).get('overall_score', 0), reverse=True)
@@ -645,12 +985,253 @@ class ShoppingGraph:
             state["status"]["generate_recommendations"] = "Pending"
             return state
     
+    async def _rank_batch(self, state: ProductState, batch: List[Tuple[int, Dict[str, Any]]], batch_number: int,
+                          semaphore: asyncio.Semaphore, compact: bool = False) -> Tuple[List[Tuple[int, Dict[str, Any]]], Dict[str, Any]]:
+        """Score one batch of (index, product) pairs with the LLM and return them with the batch timing
+        
+        A compact ranking asks for a one-sentence reason instead of the detailed analysis, which keeps the answer short.
+        """
+        batch_products = [product for _, product in batch]
+        # Products are referred to by a short ID derived from their position, so answers can be joined back exactly
+        products_by_id = {f"P{index + 1}": (index, product) for index, product in batch}
+        
+        if compact:
+            analysis_format = """"analysis": {
+                        "why_recommended": "One sentence recommendation reason"
+                    }"""
+        else:
+            analysis_format = """"analysis": {
+                        "performance_analysis": "Detailed analysis of product performance based on specs and features",
+                        "value_analysis": "Analysis of price vs features and quality",
+                        "requirements_match": "How well it matches user requirements",
+                        "why_recommended": "Overall recommendation reason"
+                    }"""
+        
+        # Create a prompt for analyzing the batch of products
+        prompt = f"""You are a product analysis expert. Analyze and rank these products based on multiple criteria.
+        Consider the user's requirements and provide a comprehensive analysis with detailed scoring.
+        
+        User Requirements:
+        - Basic Query: {state['query']}
+        - Max Price: {state['max_price']} euros
+        - Additional Requirements: {state['additional_requirements']}
+        
+        Products to Analyze:
+        {json.dumps([{
+            'id': product_id,
+            'title': p['title'],
+            'price': p.get('price', 'N/A'),
+            'rating': p.get('rating', 'N/A'),
+            'reviews': p.get('reviews', 'N/A'),
+            'structured_details': p.get('structured_details', '')
+        } for product_id, (_, p) in products_by_id.items()], indent=2)}
+        
+        You MUST respond with a valid JSON object in this exact format:
+        {{
+            "products": [
+                {{
+                    "id": "product ID exactly as given",
+                    "title": "exact product title",
+                    "price": "price",
+                    "scores": {{
+                        "performance": 1-10,
+                        "value_for_money": 1-10,
+                        "matching_requirements": 1-10,
+                        "overall_score": 1-10
+                    }},
+                    {analysis_format}
+                }},
+                ...
+            ],
+            "overall_analysis": "Brief analysis comparing the products and explaining the rankings"
+        }}
+        
+        CRITICAL RULES:
+        1. Your response MUST be a valid JSON object
+        2. Do not include any text before or after the JSON object
+        3. Use double quotes for all strings
+        4. Include all products in the analysis, each with its exact "id"
+        5. Provide specific, detailed explanations for each score
+        6. Consider the following for scoring:
+           - Performance: Based on specifications, features, and capabilities
+           - Value for Money: Price vs features, quality, and market comparison
+           - Matching Requirements: How well it meets user's specific needs
+           - Overall Score: Weighted combination of all factors
+        7. Scores must be between 1-10 (whole numbers)
+        8. Provide detailed analysis for each scoring category
+        9. Do not include any markdown formatting
+        10. Do not include any explanatory text
+        11. IMPORTANT: When evaluating ratings:
+            - If a product has less than 10 reviews, give minimal weight to its rating
+            - If a product has 10-50 reviews, give moderate weight to its rating
+            - If a product has more than 50 reviews, give full weight to its rating
+            - Products with no reviews should be evaluated based on their specifications and features only
+        12. Always mention the number of reviews in your analysis when discussing ratings
+        """
+        
+        # Get LLM's analysis for this batch
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                response = await self.llm.achat('rank_products', expect_json=True, messages=[
+                    {
+                        'role': 'user',
+                        'content': prompt
+                    }
+                ])
+            except Exception as e:
+                # A timeout or request error only costs this batch its analyses, not the whole ranking
+                logger.error(f"Error ranking batch {batch_number}: {e!r}")
+                response = None
+            elapsed = time.perf_counter() - start_time
+        
+        timing = {
+            "batch": batch_number,
+            "size": len(batch_products),
+            "seconds": round(elapsed, 3),
+            "products_per_second": round(len(batch_products) / elapsed, 2) if elapsed > 0 else None,
+            "cached": bool(response and response.get("cached", False)),
+            "failed": response is None
+        }
+        
+        ranked_products = []
+        matched_ids = set()
+        unmatched = 0
+        
+        if response is None:
+            timing["unmatched"] = unmatched
+            return [(index, self._default_ranking(product)) for index, product in batch], timing
+        logger.info(f"Ranked batch {batch_number} ({len(batch_products)} products) in {elapsed:.2f}s")
+        
+        try:
+            # Clean the response to ensure it's valid JSON
+            content = response['message']['content'].strip()
+            # Remove any markdown code block markers
+            content = content.replace('```json', '').replace('```', '').strip()
+            
+            # Parse the JSON response
+            analysis_data = json.loads(content)
+            
+            # Process the analysis to extract product rankings
+            for product_analysis in analysis_data.get('products', []):
+                # Join the analysis back to its product by ID, or by exact title for answers without an ID
+                product_id = str(product_analysis.get('id', '')).strip().upper()
+                if product_id not in products_by_id:
+                    title = str(product_analysis.get('title', '')).strip().lower()
+                    product_id = next((pid for pid, (_, p) in products_by_id.items() if p['title'].strip().lower() == title), None)
+                if product_id is None or product_id in matched_ids:
+                    unmatched += 1
+                    continue
+                matched_ids.add(product_id)
+                matching_index, matching_product = products_by_id[product_id]
+                
+                # Ensure all required fields exist with defaults
+                scores = product_analysis.get('scores', {})
+                analysis = product_analysis.get('analysis', {})
+                
+                # Set default scores if missing
+                default_scores = {
+                    'performance': 5,
+                    'value_for_money': 5,
+                    'matching_requirements': 5,
+                    'overall_score': 5
+                }
+                for key in default_scores:
+                    if key not in scores:
+                        scores[key] = default_scores[key]
+                
+                # Set default analysis if missing
+                default_analysis = {
+                    'performance_analysis': 'No performance analysis available',
+                    'value_analysis': 'No value analysis available',
+                    'requirements_match': 'No requirements match analysis available',
+                    'why_recommended': 'No recommendation reason provided'
+                }
+                for key in default_analysis:
+                    if key not in analysis:
+                        analysis[key] = default_analysis[key]
+                
+                # Get the formatted details from extract_specifications_node
+                formatted_details = matching_product.get('formatted_details', {})
+                
+                # Create the analysis object
+                product_analysis = {
+                    'key_features': formatted_details.get('key_features', 'No key features found'),
+                    'pros': formatted_details.get('pros', 'No pros found'),
+                    'cons': formatted_details.get('cons', 'No cons found'),
+                    'scores': scores,
+                    'analysis': analysis,
+                    'price': matching_product.get('price', 'N/A')
+                }
+                
+                # Add the analysis to the product
+                ranked_products.append((matching_index, {
+                    **matching_product,
+                    "analysis": product_analysis
+                }))
+            
+            if unmatched:
+                logger.warning(f"{unmatched} analyses in ranking batch {batch_number} did not match a product")
+        
+        except Exception as e:
+            logger.error(f"Error parsing JSON response in rank_products_node for batch {batch_number}: {e}")
+            # Create a basic analysis for the products of this batch that were not ranked yet
+            ranked_indices = {index for index, _ in ranked_products}
+            ranked_products += [(index, self._default_ranking(product)) for index, product in batch
+                                if index not in ranked_indices]
+        
+        timing["unmatched"] = unmatched
+        return ranked_products, timing
+    
+    @staticmethod
+    def _default_ranking(product: Dict[str, Any]) -> Dict[str, Any]:
+        """A product with neutral scores, for batches whose ranking failed"""
+        formatted_details = product.get('formatted_details', {})
+        basic_analysis = {
+            'key_features': formatted_details.get('key_features', 'No key features found'),
+            'pros': formatted_details.get('pros', 'No pros found'),
+            'cons': formatted_details.get('cons', 'No cons found'),
+            'scores': {
+                'performance': 5,
+                'value_for_money': 5,
+                'matching_requirements': 5,
+                'overall_score': 5
+            },
+            'analysis': {
+                'performance_analysis': 'No performance analysis available',
+                'value_analysis': 'No value analysis available',
+                'requirements_match': 'No requirements match analysis available',
+                'why_recommended': 'No recommendation reason provided'
+            },
+            'price': product.get('price', 'N/A')
+        }
+        return {
+            **product,
+            "analysis": basic_analysis
+        }
+    
     async def _generate_recommendations_node(self, state: ProductState) -> ProductState:
         """Generate personalized product recommendations using LLM"""
         try:
             recommendations = []
             products = state["ranked_products"]  # Already limited to top 10
             
+            if not PIPELINE_PROFILES[state["profile"]]["write_recommendations"]:
+                # The ranking answer already gives a reason for each product, so no narrative is written
+                state["recommendations"] = [
+                    {
+                        **product,
+                        "recommendation_reason": product.get('analysis', {}).get('analysis', {}).get('why_recommended') or NO_REASON
+                    }
+                    for product in products[:3]
+                ]
+                state["recommendations_analysis"] = (
+                    "Overall Analysis:\nThese products were ranked from their search listings only. "
+                    "Choose the balanced or thorough mode for recommendations based on researched product details."
+                )
+                state["status"]["generate_recommendations"] = f"Completed: Took {len(state['recommendations'])} recommendations from the ranking"
+                return state
+            
             # Create a prompt for personalized recommendations
             prompt = f"""You are a product analysis expert. Analyze these products and give a detailed explanation on why this product is recommended.
             Consider the user's requirements and provide a comprehensive analysis.
@@ -688,22 +1269,36 @@ class ShoppingGraph:
             2. Don't give responses such as "Same as the above", or something similar. Make sure that you provide explanation to each product, individually.
             3. You must provide a detailed explaination based on the information you have regarding the product. """
             
-            response = ollama.chat(model='llama3.1', messages=[
+            messages = [
                 {
                     'role': 'user',
                     'content': prompt
                 }
-            ])
+            ]
             
-            recommendations_text = response['message']['content']
+            if self.stream_recommendations:
+                # Forward tokens as they are generated so the UI can paint the text live
+                recommendations_text = ""
+                async for token in self.llm.astream_chat('generate_recommendations', messages=messages):
+                    recommendations_text += token
+                    emit_progress({
+                        "event": "recommendation_token",
+                        "node": "generate_recommendations",
+                        "token": token,
+                        "text": recommendations_text
+                    })
+            else:
+                response = await self.llm.achat('generate_recommendations', messages=messages)
+                recommendations_text = response['message']['content']
             
             # Extract recommended products
+            top_products = products[:3]  # Only take top 3
+            parsed = parse_recommendations(recommendations_text, [product['title'] for product in top_products])
             recommended_products = []
-            for product in products[:3]:  # Only take top 3
-                recommendation_reason = self._extract_recommendation_reason(recommendations_text, product['title'])
+            for index, product in enumerate(top_products):
                 recommended_products.append({
                     **product,
-                    "recommendation_reason": recommendation_reason if recommendation_reason else "No specific reasoning found"
+                    "recommendation_reason": parsed["reasons"].get(index) or NO_REASON
                 })
             
             state["recommendations"] = recommended_products
@@ -718,171 +1313,211 @@ class ShoppingGraph:
             state["status"]["generate_recommendations"] = f"Failed: {str(e)}"
             return state
     
-    def _extract_recommendation_reason(self, recommendations_text: str, product_title: str) -> str:
-        """Extract the reasoning for a specific product recommendation"""
-        try:
-            # Find the section containing the product title
-            lines = recommendations_text.split('\n')
-            for i, line in enumerate(lines):
-                if product_title.lower() in line.lower():
-                    # Look for the next line starting with "Why Recommended:"
-                    for j in range(i, min(i + 5, len(lines))):
-                        if lines[j].strip().startswith("Why Recommended:"):
-                            return lines[j].replace("Why Recommended:", "").strip()
-            return "No specific reasoning found"
-        except Exception:
-            return "No specific reasoning found"
-
     def _should_end(self, state: ProductState) -> bool:
         """Determine if the workflow should end"""
         return True  # Always end after generating recommendations
 
 class ShoppingAssistant:
-    def __init__(self):
-        self.graph = ShoppingGraph()
+    """Entry point of the shopping workflow
     
-    async def process_shopping_query(self, query: str, max_price: Optional[float] = None, additional_requirements: str = "") -> Dict[str, Any]:
-        """Process a shopping query through the entire workflow"""
+    An assistant holds no per-query state, so one instance (with its compiled graph and caches) can be
+    shared by all sessions of a process. Queries from different threads each run on their own event loop.
+    """
+    
+    def __init__(self, results_store: Optional[ResultsStore] = None, **graph_options: Any):
+        # Options such as concurrency limits and caches are passed on to the ShoppingGraph
+        self.graph = ShoppingGraph(**graph_options)
+        # Results of every query are persisted in the background, off the request path
+        self.results_store = results_store if results_store is not None else ResultsStore()
+    
+    def warm_up(self, keep_alive_interval: Optional[float] = 60) -> Dict[str, float]:
+        """Preload all configured models so that the first query does not pay their load time
+        
+        With a keep_alive_interval, loaded models are also kept warm in the background while sessions are active.
+        Returns the load time of each model; warm-up time is not part of any query's timings.
+        """
+        start_time = time.perf_counter()
+        timings = self.graph.llm.warm_up()
+        logger.info(f"Warm-up of {len(timings)} models finished in {time.perf_counter() - start_time:.2f}s")
+        if keep_alive_interval:
+            self.graph.llm.start_keep_alive(interval=keep_alive_interval)
+        return timings
+    
+    async def process_shopping_query(self, query: str, max_price: Optional[float] = None, additional_requirements: str = "",
+                                     profile: str = DEFAULT_PROFILE) -> Dict[str, Any]:
+        """Process a shopping query through the entire workflow
+        
+        The profile ("fast", "balanced" or "thorough") trades research depth for latency, see PIPELINE_PROFILES.
+        """
+        results = None
+        async for update in self.stream_shopping_query(query, max_price, additional_requirements, profile):
+            if update["event"] == "completed":
+                results = update["results"]
+        return results
+    
+    async def stream_shopping_query(self, query: str, max_price: Optional[float] = None,
+                                    additional_requirements: str = "",
+                                    profile: str = DEFAULT_PROFILE) -> AsyncIterator[Dict[str, Any]]:
+        """Process a shopping query and yield state updates as the workflow progresses
+        
+        Yields dictionaries with an "event" key:
+        - "node_completed": a graph node finished ("node", "state", "elapsed")
+        - "product_enriched": one product got its specifications ("index", "product")
+        - "product_skipped": the profile does not research a product; it is ranked from its listing ("index", "product")
+        - "recommendation_token": the recommendation narrative grew ("token", "text" so far)
+        - "completed": the workflow finished ("results", same shape as process_shopping_query)
+        """
+        if profile not in PIPELINE_PROFILES:
+            raise ValueError(f"Unknown profile {profile!r}, expected one of {', '.join(PIPELINE_PROFILES)}")
+        self.graph.llm.mark_active()
+        
         initial_state = ProductState(
             query=query,
             max_price=max_price,
             additional_requirements=additional_requirements,
+            profile=profile,
             products=[],
             processed_query={},
             detailed_products=[],
+            pipelined_rankings=None,
             ranked_products=[],
             recommendations=[],
             recommendations_analysis="",
-            status={}
+            status={},
+            metrics={}
         )
         
+        updates: asyncio.Queue = asyncio.Queue()
+        
+        async def run_graph() -> None:
+            # Nodes report intermediate progress through the listener set in this task's context
+            progress_listener.set(updates.put_nowait)
+            start_time = time.perf_counter()
+            last_time = start_time
+            timings = {}
+            final_state = None
+            try:
+                async for chunk in self.graph.graph.astream(initial_state):
+                    for node, node_state in chunk.items():
+                        if node == END:
+                            final_state = node_state
+                            continue
+                        now = time.perf_counter()
+                        timings[node] = now - last_time
+                        last_time = now
+                        updates.put_nowait({
+                            "event": "node_completed",
+                            "node": node,
+                            "state": node_state,
+                            "elapsed": timings[node]
+                        })
+                timings["total"] = time.perf_counter() - start_time
+                results = self._build_results(initial_state, final_state, timings)
+            except Exception as e:
+                logger.error(f"Error in process_shopping_query: {e}")
+                results = self._failed_results(query, additional_requirements, f"Failed: {str(e)}")
+            updates.put_nowait({"event": "completed", "results": results})
+        
+        task = asyncio.create_task(run_graph())
         try:
-            # Execute the workflow
-            final_state = await self.graph.graph.ainvoke(initial_state)
-            
-            if final_state is None:
-                logger.error("Graph execution returned None")
-                return {
-                    "processed_query": {
-                        "translated": query,
-                        "restructured": query,
-                        "original_requirements": additional_requirements
-                    },
-                    "products": [],
-                    "detailed_products": [],
-                    "ranked_products": [],
-                    "recommendations": [],
-                    "recommendations_analysis": "Failed to generate recommendations",
-                    "status": {
-                        "process_query": "Failed: Graph execution returned None",
-                        "search_products": "Not started",
-                        "extract_specifications": "Not started",
-                        "rank_products": "Not started",
-                        "generate_recommendations": "Not started"
-                    }
-                }
-            
-            # Ensure we have a valid state
-            if not isinstance(final_state, dict):
-                logger.error(f"Invalid state type: {type(final_state)}")
-                return initial_state
-            
-            # Save results to CSV
-            save_to_csv(
+            while True:
+                update = await updates.get()
+                yield update
+                if update["event"] == "completed":
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+    
+    def _build_results(self, initial_state: ProductState, final_state: Optional[Dict[str, Any]],
+                       timings: Dict[str, float]) -> Dict[str, Any]:
+        """Turn the final graph state into the results dictionary returned to callers"""
+        query = initial_state["query"]
+        max_price = initial_state["max_price"]
+        additional_requirements = initial_state["additional_requirements"]
+        
+        if final_state is None:
+            logger.error("Graph execution returned None")
+            return self._failed_results(query, additional_requirements, "Failed: Graph execution returned None")
+        
+        # Ensure we have a valid state
+        if not isinstance(final_state, dict):
+            logger.error(f"Invalid state type: {type(final_state)}")
+            return initial_state
+        
+        profile = initial_state["profile"]
+        
+        # Queue the full product, score and timing records for the results store
+        try:
+            self.results_store.record_query(
                 query=query,
                 max_price=max_price,
                 additional_requirements=additional_requirements,
-                raw_products=final_state.get("products", []),
+                profile=profile,
+                processed_query=final_state.get("processed_query", {}),
+                products=final_state.get("products", []),
                 ranked_products=final_state.get("ranked_products", []),
-                recommendations=final_state.get("recommendations", [])
+                recommendations=final_state.get("recommendations", []),
+                recommendations_analysis=final_state.get("recommendations_analysis", ""),
+                timings=timings,
+                metrics=final_state.get("metrics", {}),
+                status=final_state.get("status", {})
             )
-            
-            return {
-                "processed_query": final_state.get("processed_query", {
-                    "translated": query,
-                    "restructured": query,
-                    "original_requirements": additional_requirements
-                }),
-                "products": final_state.get("products", []),
-                "detailed_products": final_state.get("detailed_products", []),
-                "ranked_products": final_state.get("ranked_products", []),
-                "recommendations": final_state.get("recommendations", []),
-                "recommendations_analysis": final_state.get("recommendations_analysis", ""),
-                "status": final_state.get("status", {})
-            }
         except Exception as e:
-            logger.error(f"Error in process_shopping_query: {e}")
-            return {
-                "processed_query": {
-                    "translated": query,
-                    "restructured": query,
-                    "original_requirements": additional_requirements
-                },
-                "products": [],
-                "detailed_products": [],
-                "ranked_products": [],
-                "recommendations": [],
-                "recommendations_analysis": "Failed to generate recommendations",
-                "status": {
-                    "process_query": f"Failed: {str(e)}",
-                    "search_products": "Not started",
-                    "extract_specifications": "Not started",
-                    "rank_products": "Not started",
-                    "generate_recommendations": "Not started"
-                }
-            }
-
-def save_to_csv(query: str, max_price: float, additional_requirements: str, 
-                raw_products: List[Dict], ranked_products: List[Dict], 
-                recommendations: List[Dict]) -> None:
-    """Save search results and rankings to a CSV file"""
-    try:
-        # Create a filename from the query
-        # Replace spaces and special characters with underscores
-        safe_query = re.sub(r'[^a-zA-Z0-9\s-]', '', query)
-        safe_query = safe_query.replace(' ', '_').lower()
-        filename = f"shopping_results_{safe_query}.csv"
-        
-        # Get the restructured query from the first product if available
-        restructured_query = query
-        if raw_products and 'processed_query' in raw_products[0]:
-            restructured_query = raw_products[0]['processed_query'].get('restructured', query)
-        
-        # Prepare data for raw products (all SerpAPI products)
-        raw_data = []
-        for product in raw_products:
-            raw_data.append({
-                'query': restructured_query,
-                'max_price': max_price,
-                'additional_requirements': additional_requirements,
-                'product_type': 'raw',
-                'title': product.get('title', ''),
-                'url': product.get('url', '')
-            })
+            logger.error(f"Error recording results: {e}")
         
-        # Prepare data for top 10 ranked products
-        ranked_data = []
-        # Ensure we're using the sorted ranked products (they should already be sorted by overall score)
-        for i, product in enumerate(ranked_products[:10], 1):  # Only take top 10 ranked products
-            ranked_data.append({
-                'query': restructured_query,
-                'max_price': max_price,
-                'additional_requirements': additional_requirements,
-                'product_type': f'ranked_{i}',  # Add rank number to product_type
-                'title': product.get('title', ''),
-                'url': product.get('url', '')
-            })
-        
-        # Combine data in the desired order: raw products first, then ranked products
-        all_data = raw_data + ranked_data
+        logger.info(f"LLM stats: {self.graph.llm.stats()}")
         
-        # Create DataFrame and save to CSV
-        df = pd.DataFrame(all_data)
-        df.to_csv(filename, index=False)
-        logger.info(f"Results saved to {filename}")
+        expected_seconds = PIPELINE_PROFILES[profile]["expected_seconds"]
+        logger.info(f"Profile {profile}: expected ~{expected_seconds}s, measured {timings.get('total', 0):.2f}s")
         
-    except Exception as e:
-        logger.error(f"Error saving results to CSV: {e}")
+        return {
+            "processed_query": final_state.get("processed_query", {
+                "translated": query,
+                "restructured": query,
+                "original_requirements": additional_requirements
+            }),
+            "products": final_state.get("products", []),
+            "detailed_products": final_state.get("detailed_products", []),
+            "ranked_products": final_state.get("ranked_products", []),
+            "recommendations": final_state.get("recommendations", []),
+            "recommendations_analysis": final_state.get("recommendations_analysis", ""),
+            "status": final_state.get("status", {}),
+            "metrics": final_state.get("metrics", {}),
+            "timings": timings,
+            "profile": {
+                "name": profile,
+                "expected_seconds": expected_seconds,
+                "measured_seconds": timings.get("total")
+            }
+        }
+    
+    @staticmethod
+    def _failed_results(query: str, additional_requirements: str, reason: str) -> Dict[str, Any]:
+        """Results returned when the workflow could not run"""
+        return {
+            "processed_query": {
+                "translated": query,
+                "restructured": query,
+                "original_requirements": additional_requirements
+            },
+            "products": [],
+            "detailed_products": [],
+            "ranked_products": [],
+            "recommendations": [],
+            "recommendations_analysis": "Failed to generate recommendations",
+            "status": {
+                "process_query": reason,
+                "search_products": "Not started",
+                "filter_products": "Not started",
+                "deduplicate_products": "Not started",
+                "extract_specifications": "Not started",
+                "rank_products": "Not started",
+                "generate_recommendations": "Not started"
+            },
+            "metrics": {},
+            "timings": {}
+        }
 
 # Export the ShoppingAssistant class
-__all__ = ['ShoppingAssistant'] 
\ No newline at end of file
+__all__ = ['ShoppingAssistant', 'PIPELINE_PROFILES'] 
\ No newline at end of file
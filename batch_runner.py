@@ -0,0 +1,222 @@
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from backend import DEFAULT_PROFILE, PIPELINE_PROFILES, ShoppingAssistant
+from results_store import ResultsStore
+
+
+logger = logging.getLogger(__name__)
+
+# Accepted spellings of the input columns
+COLUMN_ALIASES = {
+    "query": "query",
+    "max_price": "max_price",
+    "maximum_price": "max_price",
+    "price": "max_price",
+    "additional_requirements": "additional_requirements",
+    "requirements": "additional_requirements",
+}
+
+
+def _normalize_row(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Map an input row onto query/max_price/additional_requirements, or None if it has no query"""
+    normalized = {}
+    for column, value in row.items():
+        field = COLUMN_ALIASES.get(str(column).strip().lower().replace(" ", "_"))
+        if field and field not in normalized:
+            # Empty spreadsheet cells come in as NaN
+            if isinstance(value, float) and math.isnan(value):
+                value = None
+            normalized[field] = value
+
+    query = str(normalized.get("query") or "").strip()
+    if not query:
+        return None
+    try:
+        max_price = float(normalized["max_price"]) if normalized.get("max_price") not in (None, "") else None
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring invalid max_price {normalized.get('max_price')!r} for query {query!r}")
+        max_price = None
+    return {
+        "query": query,
+        "max_price": max_price or None,
+        "additional_requirements": str(normalized.get("additional_requirements") or "").strip()
+    }
+
+
+def read_queries(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the query rows of an .xlsx/.xls, .csv or .jsonl file, each with a stable row_id"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xlsx", ".xls"):
+        import pandas as pd
+        # Every sheet holds one query in its first row, followed by rows of rankings without a query
+        sheets = pd.read_excel(path, sheet_name=None)
+        rows = ((f"{sheet}:{index}", row) for sheet, frame in sheets.items()
+                for index, row in enumerate(frame.to_dict("records")))
+    elif extension == ".csv":
+        import pandas as pd
+        frame = pd.read_csv(path)
+        rows = ((str(index), row) for index, row in enumerate(frame.to_dict("records")))
+    elif extension in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as file:
+            rows = [(str(index), json.loads(line)) for index, line in enumerate(file) if line.strip()]
+    else:
+        raise ValueError(f"Unsupported input file {path}, expected .xlsx, .csv or .jsonl")
+
+    for row_id, row in rows:
+        normalized = _normalize_row(row)
+        if normalized is not None:
+            yield {"row_id": row_id, **normalized}
+
+
+def _completed_row_ids(output_path: str) -> Set[str]:
+    """Row ids already written to the output file by an earlier (interrupted) run"""
+    if not os.path.exists(output_path):
+        return set()
+    row_ids = set()
+    with open(output_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Failed queries are run again; older records may only show the failure in their status
+            if not (record.get("error") or failed_steps(record)):
+                row_ids.add(record.get("row_id"))
+    return row_ids
+
+
+def failed_steps(results: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The workflow reports errors as "Failed: ..." step statuses instead of raising; join them into one error"""
+    failures = [f"{step}: {status}" for step, status in ((results or {}).get("status") or {}).items()
+                if str(status).startswith("Failed")]
+    return "; ".join(failures) or None
+
+
+def _summarize_product(product: Dict[str, Any]) -> Dict[str, Any]:
+    analysis = product.get("analysis") if isinstance(product.get("analysis"), dict) else {}
+    return {
+        "title": product.get("title", ""),
+        "url": product.get("url", ""),
+        "price": product.get("price", ""),
+        "overall_score": (analysis.get("scores") or {}).get("overall_score"),
+        "recommendation_reason": product.get("recommendation_reason")
+    }
+
+
+def result_record(row: Dict[str, Any], results: Optional[Dict[str, Any]], seconds: float,
+                  error: Optional[str] = None) -> Dict[str, Any]:
+    """The JSON line written for a finished query; full records go to the results store"""
+    results = results or {}
+    return {
+        **row,
+        "restructured_query": (results.get("processed_query") or {}).get("restructured"),
+        "recommendations": [_summarize_product(product) for product in results.get("recommendations", [])],
+        "ranked_products": [_summarize_product(product) for product in results.get("ranked_products", [])],
+        "recommendations_analysis": results.get("recommendations_analysis"),
+        "status": results.get("status", {}),
+        "timings": results.get("timings", {}),
+        "seconds": round(seconds, 3),
+        "error": error
+    }
+
+
+async def run_batch(assistant: ShoppingAssistant, rows: List[Dict[str, Any]], output_path: str,
+                    concurrency: int = 4, profile: str = DEFAULT_PROFILE, report_every: int = 10) -> Dict[str, Any]:
+    """Run all rows with at most `concurrency` queries in flight, appending each result as it finishes
+
+    Queries share the assistant's Tavily and LLM limits (tavily_concurrency, llm_concurrency, rank_concurrency
+    of the graph), so a higher concurrency overlaps more queries without multiplying the load on those services.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    write_lock = asyncio.Lock()
+    stats = {"completed": 0, "failed": 0}
+    start_time = time.perf_counter()
+
+    def queries_per_minute() -> float:
+        elapsed = time.perf_counter() - start_time
+        return (stats["completed"] + stats["failed"]) / elapsed * 60 if elapsed else 0.0
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        async def run_one(row: Dict[str, Any]) -> None:
+            async with semaphore:
+                query_start = time.perf_counter()
+                try:
+                    results = await assistant.process_shopping_query(
+                        query=row["query"],
+                        max_price=row["max_price"],
+                        additional_requirements=row["additional_requirements"],
+                        profile=profile
+                    )
+                    error = failed_steps(results)
+                    if error:
+                        logger.error(f"Query {row['query']!r} (row {row['row_id']}) failed: {error}")
+                    record = result_record(row, results, time.perf_counter() - query_start, error=error)
+                    stats["failed" if error else "completed"] += 1
+                except Exception as e:
+                    logger.error(f"Error processing query {row['query']!r} (row {row['row_id']}): {e}")
+                    record = result_record(row, None, time.perf_counter() - query_start, error=str(e))
+                    stats["failed"] += 1
+
+            # Stream each result to disk as soon as it is ready
+            async with write_lock:
+                output.write(json.dumps(record, default=str) + "\n")
+                output.flush()
+            finished = stats["completed"] + stats["failed"]
+            if finished % report_every == 0 or finished == len(rows):
+                logger.info(f"Batch progress: {finished}/{len(rows)} queries, {stats['failed']} failed, "
+                            f"{queries_per_minute():.1f} queries/minute")
+
+        await asyncio.gather(*(run_one(row) for row in rows))
+
+    stats["seconds"] = time.perf_counter() - start_time
+    stats["queries_per_minute"] = queries_per_minute()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Run shopping queries from a file without the UI. Every sheet of an Excel workbook (such as "
+                    "Final Dataset.xlsx) is read; results are appended to the output file as each query finishes.",
+        epilog='example: python batch_runner.py "Final Dataset.xlsx" --concurrency 4 --profile balanced'
+    )
+    parser.add_argument("input", help="Excel workbook (.xlsx), CSV or JSONL file with query, max_price and additional_requirements")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of queries in flight; Tavily and LLM calls stay bounded by the "
+                             "assistant's limits across all of them")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=list(PIPELINE_PROFILES), help="Pipeline profile")
+    parser.add_argument("--limit", type=int, help="Only run the first N queries")
+    parser.add_argument("--results-dir", help="Root of the Parquet results dataset (default: $RESULTS_DIR or ./results)")
+    parser.add_argument("--resume", action="store_true", help="Skip rows already answered in the output file")
+    args = parser.parse_args(argv)
+
+    rows = list(read_queries(args.input))
+    if args.resume:
+        completed = _completed_row_ids(args.output)
+        rows = [row for row in rows if row["row_id"] not in completed]
+        logger.info(f"Resuming: {len(completed)} queries already answered")
+    if args.limit:
+        rows = rows[:args.limit]
+    logger.info(f"Running {len(rows)} queries from {args.input} with concurrency {args.concurrency} ({args.profile} profile)")
+
+    # One assistant for the whole batch, so all queries share its caches and loaded models
+    assistant = ShoppingAssistant(results_store=ResultsStore(root=args.results_dir))
+    assistant.warm_up(keep_alive_interval=None)
+    try:
+        stats = asyncio.run(run_batch(assistant, rows, args.output, args.concurrency, args.profile))
+    finally:
+        assistant.results_store.close()
+
+    logger.info(f"Batch finished: {stats['completed']} completed, {stats['failed']} failed in {stats['seconds']:.1f}s "
+                f"({stats['queries_per_minute']:.1f} queries/minute), results in {args.output}")
+    logger.info(f"LLM stats: {assistant.graph.llm.stats()}")
+
+
+if __name__ == "__main__":
+    main()
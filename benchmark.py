@@ -0,0 +1,475 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from unittest import mock
+
+import backend
+from backend import DEFAULT_PROFILE, PIPELINE_PROFILES, ShoppingAssistant
+from caches import SQLiteCache
+from llm_gateway import LLMGateway
+from query_processing import FEW_SHOT_EXAMPLES
+from results_store import ResultsStore
+
+
+logger = logging.getLogger(__name__)
+
+# Latencies are in seconds; payload sizes are numbers of results, characters and words
+DEFAULT_CONFIG = {
+    "search": {"latency": "lognormal:0.8,0.3", "failure_rate": 0.0, "results": 20, "duplicate_rate": 0.2},
+    "tavily": {"latency": "lognormal:1.2,0.4", "failure_rate": 0.02, "results": 2, "content_chars": 3000},
+    "llm": {"latency": "lognormal:0.4,0.3", "failure_rate": 0.0, "tokens_per_second": 60, "filler_words": 25},
+}
+BRANDS = ["Acme", "Globex", "Initech", "Umbrella", "Stark", "Wayne", "Hooli", "Vandelay", "Soylent", "Tyrell"]
+SPEC_SENTENCES = [
+    "The {title} offers solid performance for everyday use.",
+    "Build quality is good and the design feels premium.",
+    "Battery life lasts about {number} hours in mixed use.",
+    "The display is bright with a resolution that suits the price.",
+    "Reviewers praise the value for money compared to similar models.",
+    "However, some users report that it runs warm under load.",
+    "Warranty is {number} months from the manufacturer.",
+    "Cons: the included accessories are basic and the weight is above average.",
+    "Storage and memory are sufficient for most users.",
+    "The verdict: a good choice if the price matters more than premium features.",
+]
+FILLER_WORDS = ("reliable capable efficient compact solid quiet durable versatile practical balanced "
+                "affordable premium responsive sturdy lightweight").split()
+
+
+class SimulatedFailure(RuntimeError):
+    """Raised by the fake backends to simulate an outage or error response"""
+
+
+def latency_sampler(spec: str, rng: random.Random, time_scale: float = 1.0) -> Callable[[], float]:
+    """Build a sampler of latencies in seconds from a spec
+
+    Supported specs are "fixed:S", "uniform:MIN,MAX", "normal:MEAN,STD", "lognormal:MEDIAN,SIGMA"
+    and "exponential:MEAN". Samples are multiplied by time_scale and never negative.
+    """
+    kind, _, arguments = spec.partition(":")
+    values = [float(value) for value in arguments.split(",") if value.strip()]
+    samplers = {
+        "fixed": lambda: values[0],
+        "uniform": lambda: rng.uniform(values[0], values[1]),
+        "normal": lambda: rng.gauss(values[0], values[1]),
+        "lognormal": lambda: values[0] * math.exp(rng.gauss(0, values[1])),
+        "exponential": lambda: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0,
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution {spec!r}, expected one of {', '.join(samplers)}")
+    sampler = samplers[kind]
+    return lambda: max(0.0, sampler()) * time_scale
+
+
+class FakeService:
+    """Latency, failures and call counts shared by the fakes of one external service"""
+
+    def __init__(self, name: str, settings: Dict[str, Any], rng: random.Random, time_scale: float = 1.0):
+        self.name = name
+        self.settings = settings
+        self.rng = rng
+        self.time_scale = time_scale
+        self.sample_latency = latency_sampler(settings["latency"], rng, time_scale)
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def call(self, extra_seconds: float = 0.0) -> None:
+        """Block for one sampled latency and raise SimulatedFailure at the configured rate"""
+        with self._lock:
+            self.calls += 1
+            latency = self.sample_latency() + extra_seconds * self.time_scale
+            failed = self.rng.random() < self.settings.get("failure_rate", 0.0)
+            if failed:
+                self.failures += 1
+        time.sleep(latency)
+        if failed:
+            raise SimulatedFailure(f"Simulated {self.name} failure")
+
+    def filler(self, words: int) -> str:
+        with self._lock:
+            return " ".join(self.rng.choice(FILLER_WORDS) for _ in range(words))
+
+    def scores(self, count: int) -> List[int]:
+        with self._lock:
+            return [self.rng.randint(1, 10) for _ in range(count)]
+
+
+def make_google_search(service: FakeService) -> type:
+    """A stand-in for serpapi.GoogleSearch returning synthetic shopping results"""
+
+    class FakeGoogleSearch:
+        def __init__(self, params: Dict[str, Any]):
+            self.params = params
+
+        def get_dict(self) -> Dict[str, Any]:
+            service.call()
+            query = self.params.get("q", "product")
+            price_limit = re.search(r"under (\d+(?:\.\d+)?)", query)
+            max_price = float(price_limit.group(1)) if price_limit else 1000.0
+            product = re.sub(r"\s+(?:with|under)\s.*$", "", query).strip() or "Product"
+            # Results depend only on the query, like a real search engine
+            rng = random.Random(query)
+            results = []
+            for index in range(service.settings.get("results", 20)):
+                duplicate = results and rng.random() < service.settings.get("duplicate_rate", 0.0)
+                source = results[rng.randrange(len(results))] if duplicate else None
+                title = source["title"] if duplicate else f"{rng.choice(BRANDS)} {product} {rng.randint(100, 999)}"
+                results.append({
+                    "product_id": source["product_id"] if duplicate else f"fake-{rng.getrandbits(32):08x}",
+                    "title": title,
+                    "product_link": f"https://shop.example/{index}",
+                    "source": f"Shop {rng.randint(1, 9)}",
+                    "extracted_price": round(max_price * rng.uniform(0.3, 1.3), 2),
+                    "rating": round(rng.uniform(3.0, 5.0), 1),
+                    "reviews": rng.randint(0, 2000),
+                    "thumbnail": f"https://img.example/{index}.jpg",
+                })
+            return {"shopping_results": results}
+
+    return FakeGoogleSearch
+
+
+def make_tavily_search(service: FakeService) -> type:
+    """A stand-in for TavilySearchResults returning synthetic review passages"""
+
+    class FakeTavilySearchResults:
+        def __init__(self, max_results: int = 2, **kwargs: Any):
+            self.max_results = max_results
+
+        def invoke(self, query: str) -> List[Dict[str, Any]]:
+            service.call()
+            rng = random.Random(query)
+            results = []
+            for index in range(service.settings.get("results", self.max_results)):
+                sentences = []
+                while sum(len(sentence) + 1 for sentence in sentences) < service.settings.get("content_chars", 3000):
+                    sentences.append(rng.choice(SPEC_SENTENCES).format(title=query, number=rng.randint(6, 36)))
+                results.append({"url": f"https://reviews.example/{index}", "content": " ".join(sentences)})
+            return results
+
+    return FakeTavilySearchResults
+
+
+def _json_after(text: str, marker: str) -> Any:
+    start = text.find(marker)
+    if start < 0:
+        return []
+    return json.JSONDecoder().raw_decode(text[text.index("[", start):])[0]
+
+
+class FakeOllamaClient:
+    """A stand-in for the ollama module, answering each prompt of the workflow in the format it expects
+
+    Generation takes the sampled latency plus the response length divided by tokens_per_second.
+    """
+
+    def __init__(self, service: FakeService):
+        self.service = service
+
+    def chat(self, model: str = "", messages: Optional[List[Dict[str, Any]]] = None, stream: bool = False,
+             **kwargs: Any) -> Any:
+        prompt = messages[-1]["content"]
+        content = self._answer(prompt)
+        tokens = max(1, len(content) // 4)
+        tokens_per_second = self.service.settings.get("tokens_per_second") or 0
+        generation_seconds = tokens / tokens_per_second if tokens_per_second else 0.0
+        final = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                 "prompt_eval_count": len(prompt) // 4, "eval_count": tokens}
+
+        if not stream:
+            self.service.call(generation_seconds)
+            return {**final, "message": {"role": "assistant", "content": content}}
+
+        def chunks() -> Iterator[Dict[str, Any]]:
+            # The first token arrives after the sampled latency, the rest at the generation rate
+            self.service.call()
+            pieces = re.findall(r"\S+\s*", content)
+            for piece in pieces:
+                time.sleep(generation_seconds / len(pieces) * self.service.time_scale)
+                yield {"model": model, "message": {"role": "assistant", "content": piece}, "done": False}
+            yield final
+
+        return chunks()
+
+    def generate(self, model: str = "", prompt: str = "", **kwargs: Any) -> Dict[str, Any]:
+        self.service.call()
+        return {"model": model, "response": "", "done": True}
+
+    def _answer(self, prompt: str) -> str:
+        words = self.service.settings.get("filler_words", 25)
+        filler = lambda: self.service.filler(words)
+        if "Restructured:" in prompt:
+            queries = re.findall(r"^\s*Query: (.+)$", prompt, re.MULTILINE)
+            query = queries[-1].strip() if queries else "product"
+            return f"Translated: {query}\nRestructured: {query}"
+        if "Product ID:" in prompt:
+            product_ids = re.findall(r"^\s*Product ID: (\S+)$", prompt, re.MULTILINE)
+            return json.dumps({product_id: self._specifications(filler) for product_id in product_ids})
+        if "Raw Details:" in prompt:
+            return json.dumps(self._specifications(filler))
+        if "Products to Analyze:" in prompt:
+            products = _json_after(prompt, "Products to Analyze:")
+            scores = [self.service.scores(4) for _ in products]
+            return json.dumps({
+                "products": [{
+                    "id": product.get("id"),
+                    "title": product["title"],
+                    "price": product.get("price"),
+                    "scores": dict(zip(("performance", "value_for_money", "matching_requirements", "overall_score"), score)),
+                    "analysis": {
+                        "performance_analysis": filler(),
+                        "value_analysis": filler(),
+                        "requirements_match": filler(),
+                        "why_recommended": filler()
+                    }
+                } for product, score in zip(products, scores)],
+                "overall_analysis": filler()
+            })
+        if "Ranked Products:" in prompt:
+            products = _json_after(prompt, "Ranked Products:")
+            recommendations = "\n\n".join(f"{product['title']}\nWhy Recommended: {filler()}" for product in products)
+            return f"Top Recommendations:\n\n{recommendations}\n\nOverall Analysis:\n{filler()}"
+        return filler()
+
+    @staticmethod
+    def _specifications(filler: Callable[[], str]) -> Dict[str, Any]:
+        return {
+            "key_features": [filler() for _ in range(3)],
+            "pros": [filler() for _ in range(3)],
+            "cons": [filler() for _ in range(3)],
+            "summary": filler()
+        }
+
+
+@contextmanager
+def fake_backends(config: Dict[str, Dict[str, Any]], seed: int = 0, time_scale: float = 1.0) -> Iterator[Dict[str, FakeService]]:
+    """Replace GoogleSearch and TavilySearchResults with fakes for the duration of the block
+
+    Yields the fake services (search, tavily, llm); the LLM fake is passed to the gateway as its client.
+    """
+    rng = random.Random(seed)
+    services = {name: FakeService(name, settings, rng, time_scale) for name, settings in config.items()}
+    with mock.patch("serpapi.GoogleSearch", make_google_search(services["search"])), \
+            mock.patch("langchain_community.tools.tavily_search.TavilySearchResults", make_tavily_search(services["tavily"])):
+        yield services
+
+
+class _NoCache:
+    """Cache that never hits, so that every query pays the full cost of the pipeline"""
+
+    def get(self, key: Any) -> None:
+        return None
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        pass
+
+    def get_or_fetch(self, key: Any, fetch: Callable[[], Any]) -> Any:
+        return fetch()
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """q-th percentile of values with linear interpolation between the closest ranks"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    """Count, mean and p50/p95/p99/max of a list of latencies in seconds"""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None
+    }
+
+
+def default_workload() -> List[Dict[str, Any]]:
+    """The few-shot example queries, which cover both template and LLM restructuring"""
+    return [
+        {"query": example["query"], "max_price": example["max_price"], "additional_requirements": example["requirements"]}
+        for example in FEW_SHOT_EXAMPLES
+    ]
+
+
+async def _run_queries(assistant: ShoppingAssistant, workload: List[Dict[str, Any]], num_queries: int,
+                       concurrency: int, profile: str, warm: bool) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(index: int) -> Dict[str, Any]:
+        row = workload[index % len(workload)]
+        async with semaphore:
+            if not warm:
+                with backend.shared_query_memo_lock:
+                    backend.shared_query_memo.clear()
+            return await assistant.process_shopping_query(
+                query=row["query"],
+                max_price=row.get("max_price"),
+                additional_requirements=row.get("additional_requirements", ""),
+                profile=profile
+            )
+
+    return await asyncio.gather(*(run_one(index) for index in range(num_queries)))
+
+
+def run_benchmark(config: Dict[str, Dict[str, Any]], workload: List[Dict[str, Any]], num_queries: int = 20,
+                  concurrency: int = 4, profile: str = DEFAULT_PROFILE, warm: bool = False, seed: int = 0,
+                  time_scale: float = 1.0, graph_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Run the workload through ShoppingGraph against the fake backends and report latencies and throughput
+
+    Cold runs (the default) bypass the search, specification, query and LLM caches; warm runs first
+    answer the whole workload once, unmeasured, with caches enabled.
+    """
+    with tempfile.TemporaryDirectory(prefix="shopping-benchmark-") as directory, \
+            fake_backends(config, seed, time_scale) as services:
+        llm = LLMGateway(client=FakeOllamaClient(services["llm"]), use_cache=warm,
+                         cache_path=os.path.join(directory, "llm_cache.sqlite3"))
+        spec_cache = SQLiteCache(os.path.join(directory, "product_specs.sqlite3"), table="product_specs") if warm else _NoCache()
+        results_store = ResultsStore(root=os.path.join(directory, "results"))
+        assistant = ShoppingAssistant(results_store=results_store, llm=llm, spec_cache=spec_cache, **(graph_options or {}))
+        if not warm:
+            assistant.graph.product_cache = _NoCache()
+
+        try:
+            if warm:
+                asyncio.run(_run_queries(assistant, workload, len(workload), concurrency, profile, warm))
+                for service in services.values():
+                    service.calls = service.failures = 0
+
+            start_time = time.perf_counter()
+            results = asyncio.run(_run_queries(assistant, workload, num_queries, concurrency, profile, warm))
+            wall_seconds = time.perf_counter() - start_time
+        finally:
+            results_store.close()
+
+    # Per-node latencies in workflow order, as measured by the assistant
+    node_latencies: Dict[str, List[float]] = {}
+    for result in results:
+        for node, seconds in (result.get("timings") or {}).items():
+            if node != "total":
+                node_latencies.setdefault(node, []).append(seconds)
+    end_to_end = [result["timings"]["total"] for result in results if "total" in (result.get("timings") or {})]
+    failed_queries = sum(
+        1 for result in results
+        if any(str(status).startswith("Failed") for status in (result.get("status") or {}).values())
+    )
+
+    return {
+        "queries": num_queries,
+        "concurrency": concurrency,
+        "profile": profile,
+        "caches": "warm" if warm else "cold",
+        "time_scale": time_scale,
+        "config": config,
+        "wall_seconds": wall_seconds,
+        "queries_per_second": num_queries / wall_seconds if wall_seconds else None,
+        "queries_per_minute": num_queries / wall_seconds * 60 if wall_seconds else None,
+        "queries_with_failed_steps": failed_queries,
+        "end_to_end": summarize(end_to_end),
+        "nodes": {node: summarize(latencies) for node, latencies in node_latencies.items()},
+        "calls": {name: service.calls for name, service in services.items()},
+        "failures": {name: service.failures for name, service in services.items()},
+        "llm_stats": llm.stats()
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Render a benchmark report as a plain-text table"""
+    def milliseconds(value: Optional[float]) -> str:
+        return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+    lines = [
+        f"{report['queries']} queries, concurrency {report['concurrency']}, {report['profile']} profile, "
+        f"{report['caches']} caches, time scale {report['time_scale']}",
+        f"Throughput: {report['queries_per_second']:.2f} queries/s ({report['queries_per_minute']:.1f} queries/minute) "
+        f"in {report['wall_seconds']:.2f}s",
+        f"Calls: " + ", ".join(f"{name} {calls} ({report['failures'][name]} failed)" for name, calls in report["calls"].items())
+        + f"; queries with failed steps: {report['queries_with_failed_steps']}",
+        "",
+        f"{'latency (ms)':<26}{'p50':>9}{'p95':>9}{'p99':>9}{'mean':>9}{'max':>9}",
+    ]
+    for name, stats in [*report["nodes"].items(), ("end to end", report["end_to_end"])]:
+        lines.append(f"{name:<26}" + "".join(milliseconds(stats[key]) for key in ("p50", "p95", "p99", "mean", "max")))
+    return "\n".join(lines)
+
+
+def _apply_override(config: Dict[str, Dict[str, Any]], override: str) -> None:
+    """Apply a service.setting=value override, parsing the value as JSON when possible"""
+    path, _, value = override.partition("=")
+    service, _, setting = path.partition(".")
+    if service not in config or not setting:
+        raise ValueError(f"Invalid override {override!r}, expected one of {', '.join(config)} followed by .setting=value")
+    try:
+        config[service][setting] = json.loads(value)
+    except json.JSONDecodeError:
+        config[service][setting] = value
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the shopping workflow offline against fake SerpAPI, Tavily and Ollama backends.",
+        epilog="example: python benchmark.py --queries 40 --concurrency 8 --set tavily.failure_rate=0.1 --time-scale 0.1"
+    )
+    parser.add_argument("--queries", type=int, default=20, help="Number of queries to run")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of queries in flight")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=list(PIPELINE_PROFILES), help="Pipeline profile")
+    parser.add_argument("--input", help="Workload file (.xlsx, .csv or .jsonl) as read by batch_runner; defaults to built-in queries")
+    parser.add_argument("--config", help="JSON file overriding the fake backend settings")
+    parser.add_argument("--set", action="append", default=[], metavar="SERVICE.SETTING=VALUE",
+                        help="Override one setting, e.g. llm.latency=fixed:0.5 or search.results=40")
+    parser.add_argument("--warm", action="store_true", help="Measure with warm caches instead of bypassing them")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply all simulated latencies, e.g. 0.1 for quick runs")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of latencies, failures and scores")
+    parser.add_argument("--output", help="Also write the full report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the workflow's log output")
+    args = parser.parse_args(argv)
+
+    # The workflow logs every step; simulated failures would flood the report
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if args.config:
+        with open(args.config, encoding="utf-8") as file:
+            for service, settings in json.load(file).items():
+                config.setdefault(service, {}).update(settings)
+    for override in args.set:
+        try:
+            _apply_override(config, override)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.input:
+        from batch_runner import read_queries
+        workload = list(read_queries(args.input))
+    else:
+        workload = default_workload()
+
+    report = run_benchmark(config, workload, args.queries, args.concurrency, args.profile, args.warm,
+                           args.seed, args.time_scale)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
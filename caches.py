@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from cachetools import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+# Default location for all on-disk caches
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+
+class SQLiteCache:
+    """Persistent key/value cache backed by SQLite with per-entry TTL and LRU eviction"""
+
+    def __init__(self, path: str, table: str = "cache", max_entries: int = 5000, default_ttl: Optional[float] = None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # A single connection shared between threads, serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "expires_at REAL, "
+                "last_access REAL NOT NULL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for a key, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            # Touch the entry so that it becomes the most recently used one
+            self._conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            logger.warning(f"Dropping undecodable cache entry {key} from {self.table}")
+            self.delete(key)
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a JSON-serializable value, evicting the least recently used entries when full"""
+        ttl = ttl if ttl is not None else self.default_ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        payload = json.dumps(value)
+
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, expires_at, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        """Remove a single entry"""
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Remove all entries"""
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current number of entries"""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones above max_entries (lock must be held)"""
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY last_access ASC LIMIT ?)",
+                (excess,)
+            )
+
+
+class StaleWhileRevalidateCache:
+    """In-memory LRU cache that serves expired entries immediately and refreshes them in the background"""
+
+    def __init__(self, maxsize: int = 100, ttl: float = 3600, max_stale: float = 24 * 3600):
+        self.ttl = ttl
+        # Entries older than max_stale are too old to serve and are fetched synchronously
+        self.max_stale = max_stale
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = LRUCache(maxsize=maxsize)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        """Return the cached value for a key, calling fetch on a miss. Empty values are not cached."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = now - entry[0] if entry is not None else None
+            # Counters are updated under the lock as the cache is shared between sessions
+            if age is not None and age <= self.ttl:
+                self.hits += 1
+            elif age is not None and age <= self.max_stale:
+                self.stale_hits += 1
+            else:
+                self.misses += 1
+
+        if age is not None and age <= self.ttl:
+            return entry[1]
+        if age is not None and age <= self.max_stale:
+            self._schedule_refresh(key, fetch)
+            return entry[1]
+
+        value = fetch()
+        if value:
+            self.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/stale-hit/miss counters and the current number of entries"""
+        with self._lock:
+            entries = len(self._entries)
+        return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses, "entries": entries}
+
+    def _schedule_refresh(self, key: Hashable, fetch: Callable[[], Any]) -> None:
+        """Start a background refresh for a key unless one is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key, fetch), daemon=True).start()
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], Any]) -> None:
+        try:
+            value = fetch()
+            if value:
+                self.set(key, value)
+        except Exception as e:
+            logger.error(f"Background refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
@@ -0,0 +1,103 @@
+import re
+import math
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from tokens import count_tokens
+
+
+logger = logging.getLogger(__name__)
+
+# Terms that mark passages useful for extracting key features, pros and cons
+SPEC_QUERY_TERMS = [
+    "specifications", "specs", "features", "feature", "processor", "cpu", "gpu", "graphics", "ram",
+    "memory", "storage", "ssd", "display", "screen", "resolution", "battery", "weight", "size",
+    "performance", "quality", "design", "build", "camera", "sound", "warranty",
+    "pros", "cons", "advantages", "disadvantages", "drawbacks", "review", "verdict", "however"
+]
+DEFAULT_TOKEN_BUDGET = 800
+# Passages are built from whole sentences up to roughly this many tokens
+PASSAGE_TOKENS = 80
+
+
+def _terms(text: str) -> List[str]:
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def split_passages(text: str, passage_tokens: int = PASSAGE_TOKENS) -> List[str]:
+    """Split text into passages of consecutive sentences of about passage_tokens tokens each"""
+    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+|\n+', text) if s.strip()]
+    passages = []
+    current = []
+    current_tokens = 0
+    for sentence in sentences:
+        tokens = count_tokens(sentence)
+        if current and current_tokens + tokens > passage_tokens:
+            passages.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def bm25_scores(passages: List[str], query_terms: List[str], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """Okapi BM25 score of each passage for the query terms, with IDF taken over the passages themselves"""
+    documents = [Counter(_terms(passage)) for passage in passages]
+    if not documents:
+        return []
+    lengths = [sum(document.values()) for document in documents]
+    average_length = sum(lengths) / len(documents) or 1.0
+
+    scores = []
+    unique_terms = set(query_terms)
+    document_frequency = {term: sum(1 for document in documents if term in document) for term in unique_terms}
+    for document, length in zip(documents, lengths):
+        score = 0.0
+        for term in unique_terms:
+            frequency = document.get(term, 0)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores.append(score)
+    return scores
+
+
+def assemble_context(results: List[Any], title: str, token_budget: int = DEFAULT_TOKEN_BUDGET) -> Tuple[str, Dict[str, int]]:
+    """Build the LLM context for a product from Tavily results within a token budget
+
+    The results are split into passages, ranked with BM25 against the product title and
+    specification/pros/cons terms, and the best passages that fit the budget are kept in
+    their original order. Returns the context and a report of tokens in versus tokens kept.
+    """
+    texts = []
+    for item in results or []:
+        if isinstance(item, dict):
+            texts.extend(item.get(field) for field in ('content', 'raw_content') if item.get(field))
+        elif isinstance(item, str):
+            texts.append(item)
+
+    # The same sentences often appear in both the snippet and the raw page
+    passages = list(dict.fromkeys(passage for text in texts for passage in split_passages(text)))
+    passage_tokens = [count_tokens(passage) for passage in passages]
+    scores = bm25_scores(passages, _terms(title) + SPEC_QUERY_TERMS)
+
+    kept = set()
+    tokens_kept = 0
+    for index in sorted(range(len(passages)), key=lambda i: -scores[i]):
+        if tokens_kept + passage_tokens[index] <= token_budget:
+            kept.add(index)
+            tokens_kept += passage_tokens[index]
+
+    context = "\n".join(passages[index] for index in sorted(kept))
+    report = {
+        "tokens_in": sum(count_tokens(text) for text in texts),
+        "tokens_kept": tokens_kept,
+        "passages_in": len(passages),
+        "passages_kept": len(kept)
+    }
+    return context, report
@@ -0,0 +1,152 @@
+import os
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Sequence
+
+import requests
+from cachetools import TTLCache
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from caches import CACHE_DIR
+
+
+logger = logging.getLogger(__name__)
+
+# Widths at which the product cards show images
+THUMBNAIL_WIDTHS = (150, 200)
+
+
+class ThumbnailCache:
+    """Fetches product thumbnails concurrently, downscales them to the card widths and caches the files
+
+    Thumbnails are kept in a size-bounded LRU directory on disk, which the app serves as static files,
+    so re-renders and products seen in earlier searches never fetch an image again.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, widths: Sequence[int] = THUMBNAIL_WIDTHS,
+                 max_disk_bytes: int = 256 * 1024 * 1024,
+                 timeout: float = 5.0, max_workers: int = 8):
+        self.cache_dir = cache_dir or os.getenv("THUMBNAIL_CACHE_DIR", os.path.join(CACHE_DIR, "thumbnails"))
+        self.widths = tuple(widths)
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._inflight: Dict[str, Future] = {}
+        # URLs that failed recently are not retried on every re-render
+        self._failed = TTLCache(maxsize=1024, ttl=300)
+        self._lock = threading.Lock()
+        self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+
+        # Pooled connections for all downloads, with one retry on connection errors
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers,
+                              max_retries=Retry(total=1, backoff_factor=0.2))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails")
+
+    def prefetch(self, urls: Iterable[str]) -> None:
+        """Start fetching the thumbnails of a result set in the background"""
+        for url in dict.fromkeys(url for url in urls if url):
+            if url not in self._failed and not self._is_cached(url):
+                self._submit(url)
+
+    def cached_filename(self, url: str, width: int) -> Optional[str]:
+        """Name of the cached thumbnail file inside cache_dir, or None (starting the download) if there is none yet"""
+        if not url:
+            return None
+        filename = self._key(url, width)
+        try:
+            # Touch the file so that it becomes the most recently used one on disk
+            os.utime(os.path.join(self.cache_dir, filename))
+        except OSError:
+            self.prefetch([url])
+            return None
+        return filename
+
+    def _submit(self, url: str) -> Future:
+        with self._lock:
+            future = self._inflight.get(url)
+            if future is None:
+                future = self._executor.submit(self._fetch, url)
+                self._inflight[url] = future
+                future.add_done_callback(lambda _: self._discard_inflight(url))
+            return future
+
+    def _discard_inflight(self, url: str) -> None:
+        with self._lock:
+            self._inflight.pop(url, None)
+
+    def _fetch(self, url: str) -> None:
+        """Download an image once and store it at every configured width"""
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            image = Image.open(BytesIO(response.content))
+            image.load()
+        except Exception:
+            with self._lock:
+                self._failed[url] = True
+            raise
+        for width in self.widths:
+            self._store(url, width, self._downscale(image, width))
+
+    @staticmethod
+    def _downscale(image: Image.Image, width: int) -> bytes:
+        """Resize an image to at most the given width and encode it as JPEG"""
+        image = image.copy()
+        if image.width > width:
+            image.thumbnail((width, image.height), Image.LANCZOS)
+        if image.mode != "RGB":
+            # JPEG has no transparency; flatten onto the white card background
+            background = Image.new("RGB", image.size, "white")
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=85, optimize=True)
+        return output.getvalue()
+
+    def _key(self, url: str, width: int) -> str:
+        return f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}-{width}.jpg"
+
+    def _is_cached(self, url: str) -> bool:
+        return all(os.path.exists(os.path.join(self.cache_dir, self._key(url, width))) for width in self.widths)
+
+    def _store(self, url: str, width: int, thumbnail: bytes) -> None:
+        key = self._key(url, width)
+        path = os.path.join(self.cache_dir, key)
+        with self._lock:
+            try:
+                previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+                with open(path, "wb") as file:
+                    file.write(thumbnail)
+                self._disk_bytes += len(thumbnail) - previous_size
+            except OSError as e:
+                logger.error(f"Could not write thumbnail {path}: {e}")
+                return
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """Delete the least recently used files until the directory is 10% below its limit (lock must be held)"""
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        target = self.max_disk_bytes * 0.9
+        for entry in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._disk_bytes -= size
+            except OSError:
+                pass
@@ -0,0 +1,416 @@
+import os
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+import ollama
+
+from caches import CACHE_DIR, SQLiteCache
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama3.1"
+
+# Model routing per graph node: the model to use, an optional fallback model that is tried when the
+# primary model times out (timeout in seconds) or returns unparseable JSON, and the timeout itself.
+# Each entry can be overridden with environment variables, e.g. PROCESS_QUERY_MODEL=llama3.2:3b,
+# PROCESS_QUERY_FALLBACK_MODEL=llama3.1 and PROCESS_QUERY_TIMEOUT=10.
+NODE_MODEL_ROUTES = {
+    "process_query": {"model": DEFAULT_MODEL, "fallback_model": None, "timeout": None},
+    "extract_specifications": {"model": DEFAULT_MODEL, "fallback_model": None, "timeout": None},
+    "rank_products": {"model": DEFAULT_MODEL, "fallback_model": None, "timeout": None},
+    "generate_recommendations": {"model": DEFAULT_MODEL, "fallback_model": None, "timeout": None},
+}
+
+
+def _routes_from_env() -> Dict[str, Dict[str, Any]]:
+    routes = {}
+    for node, route in NODE_MODEL_ROUTES.items():
+        prefix = node.upper()
+        timeout = os.getenv(f"{prefix}_TIMEOUT")
+        routes[node] = {
+            "model": os.getenv(f"{prefix}_MODEL", route["model"]),
+            "fallback_model": os.getenv(f"{prefix}_FALLBACK_MODEL", route["fallback_model"]),
+            "timeout": float(timeout) if timeout else route["timeout"]
+        }
+    return routes
+
+
+# How long Ollama keeps a model loaded after a request (Ollama duration string or seconds)
+DEFAULT_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# When this process last used each model and when a query last ran, shared by all gateways since
+# the Ollama server (and so the set of loaded models) is shared too
+_model_last_used: Dict[str, float] = {}
+_last_activity = 0.0
+_usage_lock = threading.Lock()
+
+
+def parse_keep_alive(keep_alive: Union[str, float]) -> float:
+    """Convert an Ollama keep_alive value ("30m", "1h", "90s", 300, -1) to seconds; negative means forever"""
+    if isinstance(keep_alive, (int, float)):
+        seconds = float(keep_alive)
+    else:
+        units = {"s": 1, "m": 60, "h": 3600}
+        value = keep_alive.strip().lower()
+        seconds = float(value[:-1]) * units[value[-1]] if value[-1] in units else float(value)
+    return math.inf if seconds < 0 else seconds
+
+
+def _touch_model(model: str) -> None:
+    global _last_activity
+    now = time.time()
+    with _usage_lock:
+        _model_last_used[model] = now
+        _last_activity = now
+
+
+def looks_like_json(content: str) -> bool:
+    """Whether a response contains a JSON object, possibly wrapped in a code block or surrounding text"""
+    content = content.replace('```json', '').replace('```', '')
+    start = content.find('{')
+    if start < 0:
+        return False
+    try:
+        json.JSONDecoder().raw_decode(content[start:])
+        return True
+    except json.JSONDecodeError:
+        return False
+
+# How long cached responses stay valid for each graph node (in seconds)
+NODE_CACHE_TTLS = {
+    "process_query": 7 * 24 * 3600,          # Query restructuring is stable
+    "extract_specifications": 24 * 3600,     # Product details change slowly
+    "rank_products": 6 * 3600,               # Depends on current prices
+    "generate_recommendations": 6 * 3600,
+}
+DEFAULT_CACHE_TTL = 3600
+
+
+class LLMGateway:
+    """Single entry point for all LLM calls with a persistent, content-addressed response cache"""
+
+    def __init__(self, cache_path: Optional[str] = None, max_entries: int = 5000,
+                 node_ttls: Optional[Dict[str, float]] = None, use_cache: bool = True, client: Any = None,
+                 routes: Optional[Dict[str, Dict[str, Any]]] = None, keep_alive: Optional[Union[str, float]] = None):
+        self.client = client or ollama
+        # Sent with every request so models stay loaded for a known time
+        self.keep_alive = keep_alive if keep_alive is not None else DEFAULT_KEEP_ALIVE
+        self._keep_alive_stop: Optional[threading.Event] = None
+        self.node_ttls = {**NODE_CACHE_TTLS, **(node_ttls or {})}
+        self.routes = _routes_from_env()
+        for node, route in (routes or {}).items():
+            self.routes[node] = {**self.routes.get(node, {"model": DEFAULT_MODEL, "fallback_model": None, "timeout": None}), **route}
+        self.cache = None
+        if use_cache:
+            self.cache = SQLiteCache(
+                cache_path or os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_cache.sqlite3")),
+                table="llm_responses",
+                max_entries=max_entries
+            )
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(model: str, messages: List[Dict[str, Any]], options: Optional[Dict[str, Any]] = None,
+                  format: str = "") -> str:
+        """Hash of everything that determines the model output"""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "options": options or {}, "format": format},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def route(self, node: str) -> Dict[str, Any]:
+        """Return the model routing of a node"""
+        return self.routes.get(node, {"model": DEFAULT_MODEL, "fallback_model": None, "timeout": None})
+    
+    async def achat(self, node: str, messages: List[Dict[str, Any]], model: Optional[str] = None,
+                    options: Optional[Dict[str, Any]] = None, format: str = "", expect_json: bool = False) -> Dict[str, Any]:
+        """Send a chat request on behalf of a graph node, answering from the cache when possible
+        
+        The blocking request runs in a worker thread. Uses the node's routed model unless a model is given.
+        If the node has a fallback model, it is asked instead when the request times out or, with
+        expect_json, when the answer holds no JSON object.
+        Only the answer that is returned is cached, never one that was rejected or arrived after a timeout.
+        """
+        route = self.route(node)
+        model = model or route["model"]
+        fallback_model = route["fallback_model"] if route["fallback_model"] != model else None
+        key = self.cache_key(model, messages, options, format)
+        try:
+            response = await self._achat_uncached(node, key, model, messages, options, format, route["timeout"])
+        except asyncio.TimeoutError:
+            if not fallback_model:
+                raise
+            logger.warning(f"{model} timed out after {route['timeout']}s for {node}, falling back to {fallback_model}")
+            self._count(node, "fallbacks")
+            return await self._achat_fallback(node, fallback_model, messages, options, format)
+        
+        if response["cached"]:
+            return response
+        if expect_json and fallback_model and not looks_like_json(response["message"]["content"]):
+            logger.warning(f"{model} returned no valid JSON for {node}, falling back to {fallback_model}")
+            self._count(node, "fallbacks")
+            return await self._achat_fallback(node, fallback_model, messages, options, format)
+        await asyncio.to_thread(self._store, node, key, response)
+        return response
+
+    async def _achat_uncached(self, node: str, key: str, model: str, messages: List[Dict[str, Any]],
+                              options: Optional[Dict[str, Any]], format: str,
+                              timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Answer from the cache, or ask the model in a worker thread without caching its answer
+        
+        A request that times out keeps running in its thread, but its answer is dropped.
+        """
+        cached_response = await asyncio.to_thread(self._cached, node, key)
+        if cached_response is not None:
+            return cached_response
+        return await asyncio.wait_for(
+            asyncio.to_thread(self._request, node, model, messages, options, format),
+            timeout=timeout
+        )
+
+    async def _achat_fallback(self, node: str, model: str, messages: List[Dict[str, Any]],
+                              options: Optional[Dict[str, Any]], format: str) -> Dict[str, Any]:
+        key = self.cache_key(model, messages, options, format)
+        response = await self._achat_uncached(node, key, model, messages, options, format)
+        if not response["cached"]:
+            await asyncio.to_thread(self._store, node, key, response)
+        return response
+
+    async def astream_chat(self, node: str, messages: List[Dict[str, Any]], model: Optional[str] = None,
+                           options: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Yield the response text piece by piece as the model generates it
+        
+        A cached response is yielded in one piece; a fresh one is cached once the stream ends. The
+        node's timeout applies to the first chunk: if the model has not started answering by then,
+        the stream is abandoned and the fallback model is asked instead, as in achat.
+        """
+        route = self.route(node)
+        model = model or route["model"]
+        fallback_model = route["fallback_model"] if route["fallback_model"] != model else None
+        
+        for attempt_model, timeout in [(model, route["timeout"]), (fallback_model, None)]:
+            if attempt_model is None:
+                break
+            key = self.cache_key(attempt_model, messages, options)
+            cached_response = await asyncio.to_thread(self._cached, node, key)
+            if cached_response is not None:
+                yield cached_response["message"]["content"]
+                return
+            
+            loop = asyncio.get_running_loop()
+            chunks: asyncio.Queue = asyncio.Queue()
+            end_of_stream = object()
+            abandoned = threading.Event()
+            
+            def produce(stream_model: str, chunks: asyncio.Queue, abandoned: threading.Event) -> None:
+                # Runs in a worker thread and hands chunks over to the event loop until the stream is abandoned
+                try:
+                    for chunk in self.client.chat(model=stream_model, messages=messages, options=options, stream=True,
+                                                  keep_alive=self.keep_alive):
+                        if abandoned.is_set():
+                            return
+                        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                except Exception as e:
+                    loop.call_soon_threadsafe(chunks.put_nowait, e)
+                finally:
+                    loop.call_soon_threadsafe(chunks.put_nowait, end_of_stream)
+            
+            start_time = time.perf_counter()
+            producer = loop.run_in_executor(None, produce, attempt_model, chunks, abandoned)
+            try:
+                try:
+                    chunk = await asyncio.wait_for(chunks.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    abandoned.set()
+                    if not fallback_model:
+                        raise
+                    logger.warning(f"{attempt_model} sent nothing within {timeout}s for {node}, falling back to {fallback_model}")
+                    self._count(node, "fallbacks")
+                    continue
+                
+                parts = []
+                last_chunk = None
+                while chunk is not end_of_stream:
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    last_chunk = chunk
+                    text = chunk["message"]["content"]
+                    if text:
+                        if not parts:
+                            logger.info(f"First token for {node} after {time.perf_counter() - start_time:.2f}s")
+                        parts.append(text)
+                        yield text
+                    chunk = await chunks.get()
+                await producer
+            finally:
+                # Stop reading the model's answer if the caller stopped consuming the stream
+                abandoned.set()
+            elapsed = time.perf_counter() - start_time
+            _touch_model(attempt_model)
+            
+            if last_chunk is not None:
+                response = self._normalize(last_chunk, attempt_model)
+                response["message"]["content"] = "".join(parts)
+                self._record(node, attempt_model, elapsed, response)
+                await asyncio.to_thread(self._store, node, key, response)
+            return
+
+    def _cached(self, node: str, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a key and count the hit or miss"""
+        if self.cache is None:
+            return None
+        cached_response = self.cache.get(key)
+        if cached_response is None:
+            self._count(node, "misses")
+            return None
+        self._count(node, "hits")
+        logger.debug(f"LLM cache hit for {node}")
+        return {**cached_response, "cached": True}
+
+    def _request(self, node: str, model: str, messages: List[Dict[str, Any]],
+                 options: Optional[Dict[str, Any]], format: str) -> Dict[str, Any]:
+        """Ask the model without touching the cache"""
+        start_time = time.perf_counter()
+        raw_response = self.client.chat(model=model, messages=messages, options=options, format=format,
+                                        keep_alive=self.keep_alive)
+        elapsed = time.perf_counter() - start_time
+        _touch_model(model)
+
+        response = self._normalize(raw_response, model)
+        self._record(node, model, elapsed, response)
+        return {**response, "cached": False}
+
+    def _store(self, node: str, key: str, response: Dict[str, Any]) -> None:
+        if self.cache is not None:
+            stored = {field: value for field, value in response.items() if field != "cached"}
+            self.cache.set(key, stored, ttl=self.node_ttls.get(node, DEFAULT_CACHE_TTL))
+
+    def models(self) -> List[str]:
+        """All models the routing table may use, primary models first"""
+        models = [route["model"] for route in self.routes.values()]
+        models += [route["fallback_model"] for route in self.routes.values() if route["fallback_model"]]
+        return list(dict.fromkeys(models))
+
+    def warm_up(self, models: Optional[List[str]] = None) -> Dict[str, float]:
+        """Load models into Ollama ahead of the first query and return the load time of each"""
+        timings = {}
+        for model in models or self.models():
+            start_time = time.perf_counter()
+            try:
+                # A request without a prompt only loads the model
+                self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+                timings[model] = time.perf_counter() - start_time
+                _touch_model(model)
+                logger.info(f"Warm-up of {model} took {timings[model]:.2f}s")
+            except Exception as e:
+                logger.error(f"Warm-up of {model} failed: {e}")
+        return timings
+
+    def mark_active(self) -> None:
+        """Record that a session is active, which keeps the loaded models warm"""
+        global _last_activity
+        with _usage_lock:
+            _last_activity = time.time()
+
+    def start_keep_alive(self, interval: float = 60, idle_after: float = 1800) -> None:
+        """Ping loaded models in the background before Ollama unloads them
+
+        Models are pinged while there was activity in the last idle_after seconds, so an idle
+        server still frees its memory.
+        """
+        if self._keep_alive_stop is not None:
+            return
+        keep_alive_seconds = parse_keep_alive(self.keep_alive)
+        if math.isinf(keep_alive_seconds):
+            return
+        self._keep_alive_stop = threading.Event()
+        threading.Thread(
+            target=self._keep_alive_loop,
+            args=(self._keep_alive_stop, interval, idle_after, keep_alive_seconds),
+            daemon=True
+        ).start()
+
+    def stop_keep_alive(self) -> None:
+        if self._keep_alive_stop is not None:
+            self._keep_alive_stop.set()
+            self._keep_alive_stop = None
+
+    def _keep_alive_loop(self, stop: threading.Event, interval: float, idle_after: float,
+                         keep_alive_seconds: float) -> None:
+        while not stop.wait(interval):
+            now = time.time()
+            with _usage_lock:
+                if now - _last_activity > idle_after:
+                    continue
+                last_used = {model: _model_last_used.get(model) for model in self.models()}
+            for model, used_at in last_used.items():
+                # Ping models that would expire before the next check
+                if used_at is not None and now - used_at > keep_alive_seconds - 2 * interval:
+                    try:
+                        self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+                        with _usage_lock:
+                            _model_last_used[model] = time.time()
+                        logger.debug(f"Kept {model} loaded")
+                    except Exception as e:
+                        logger.error(f"Keep-alive ping for {model} failed: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return per-node counters: cache hits/misses, fallbacks, and latency and tokens of the model calls"""
+        with self._stats_lock:
+            stats = {node: {**counters, "models": dict(counters["models"])} for node, counters in self._stats.items()}
+        for counters in stats.values():
+            if counters["calls"]:
+                counters["avg_seconds"] = round(counters["seconds"] / counters["calls"], 3)
+            counters["seconds"] = round(counters["seconds"], 3)
+        return stats
+
+    def _node_stats(self, node: str) -> Dict[str, Any]:
+        """Counters of a node (lock must be held)"""
+        return self._stats.setdefault(node, {
+            "hits": 0, "misses": 0, "fallbacks": 0, "calls": 0, "seconds": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "models": {}
+        })
+
+    def _count(self, node: str, counter: str) -> None:
+        with self._stats_lock:
+            self._node_stats(node)[counter] += 1
+
+    def _record(self, node: str, model: str, elapsed: float, response: Dict[str, Any]) -> None:
+        """Record the latency and token counts of a model call"""
+        prompt_tokens = response.get("prompt_eval_count") or 0
+        completion_tokens = response.get("eval_count") or 0
+        logger.info(
+            f"LLM call for {node} on {model} took {elapsed:.2f}s "
+            f"({prompt_tokens} prompt tokens, {completion_tokens} completion tokens)"
+        )
+        with self._stats_lock:
+            node_stats = self._node_stats(node)
+            node_stats["calls"] += 1
+            node_stats["seconds"] += elapsed
+            node_stats["prompt_tokens"] += prompt_tokens
+            node_stats["completion_tokens"] += completion_tokens
+            node_stats["models"][model] = node_stats["models"].get(model, 0) + 1
+
+    @staticmethod
+    def _normalize(response: Any, model: str) -> Dict[str, Any]:
+        """Reduce an Ollama response to the JSON-serializable fields the graph uses"""
+        message = response["message"]
+        return {
+            "model": response.get("model", model),
+            "message": {
+                "role": message.get("role", "assistant"),
+                "content": message.get("content", "")
+            },
+            "prompt_eval_count": response.get("prompt_eval_count"),
+            "eval_count": response.get("eval_count")
+        }
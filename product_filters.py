@@ -0,0 +1,170 @@
+import re
+import math
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """Convert a SerpAPI numeric field to a float, returning None for missing or invalid values"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        cleaned = value.replace('€', '').replace(',', '').strip()
+        try:
+            number = float(cleaned)
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+    return None
+
+
+def prefilter_products(products: List[Dict[str, Any]], max_price: Optional[float]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Apply cheap rules before any LLM work is spent on the products
+
+    - Products without a title or link, or with a non-positive price, are dropped as malformed
+    - Products priced above max_price are dropped
+    - Products without a price are kept but moved behind the priced ones
+
+    Returns the remaining products and a report with the number of products per outcome.
+    """
+    kept = []
+    unpriced = []
+    report = {
+        "input": len(products),
+        "dropped_malformed": 0,
+        "dropped_over_budget": 0,
+        "deprioritized_unpriced": 0
+    }
+
+    for product in products:
+        price_value = product.get('price_value')
+        if not product.get('title') or not (product.get('url') or product.get('product_id')):
+            report["dropped_malformed"] += 1
+        elif price_value is not None and price_value <= 0:
+            report["dropped_malformed"] += 1
+        elif max_price and price_value is not None and price_value > max_price:
+            report["dropped_over_budget"] += 1
+        elif price_value is None:
+            report["deprioritized_unpriced"] += 1
+            unpriced.append(product)
+        else:
+            kept.append(product)
+
+    filtered_products = kept + unpriced
+    report["kept"] = len(filtered_products)
+    return filtered_products, report
+
+
+# Capacities and measurements such as 16gb, 1tb, 144hz or 27inch tell product variants apart
+SPEC_TOKEN_PATTERN = re.compile(r'^\d+(?:\.\d+)?(?:gb|tb|mb|mp|hz|w|mah|k|g|inch|zoll|in|cm|mm)$')
+# Manufacturer part numbers mix letters and digits, e.g. 82rk00abge or sm-s911b
+MODEL_NUMBER_PATTERN = re.compile(r'^(?=.*\d)(?=.*[a-z])[a-z0-9-]{5,}$')
+# Component names such as i7-1255u or 7840hs are shared by many different products
+COMPONENT_PATTERN = re.compile(r'^(?:i[3579]-)?\d{4,5}[a-z]{0,2}$')
+
+
+# "128 GB" and "128GB" are the same capacity; units that are also words ("in", "g") are left alone
+UNIT_SPACING_PATTERN = re.compile(r'\b(\d+(?:\.\d+)?)\s+(gb|tb|mb|mp|hz|w|mah|k|inch|zoll|cm|mm)\b')
+
+
+def _title_tokens(title: str) -> List[str]:
+    text = re.sub(r'[^a-z0-9.\- ]+', ' ', title.lower()).replace(' - ', ' ')
+    return UNIT_SPACING_PATTERN.sub(r'\1\2', text).split()
+
+
+def _title_features(title: str) -> Dict[str, Any]:
+    """Word shingles, model number and capacity tokens of a product title"""
+    tokens = _title_tokens(title)
+    spec_tokens = {token for token in tokens if SPEC_TOKEN_PATTERN.match(token)}
+    model_numbers = [
+        token for token in tokens
+        if MODEL_NUMBER_PATTERN.match(token) and not COMPONENT_PATTERN.match(token) and token not in spec_tokens
+    ]
+    # The longest part number is the most specific one (82rk00abge rather than the series code 15iau7)
+    model_number = max(model_numbers, key=len) if model_numbers else None
+    words = [token.strip('.-') for token in tokens if token.strip('.-')]
+    shingles = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+    return {"shingles": shingles, "model_number": model_number, "spec_tokens": spec_tokens}
+
+
+def _is_near_duplicate(a: Dict[str, Any], b: Dict[str, Any], threshold: float) -> bool:
+    # Different capacities are different variants, however similar the titles are
+    specs_a, specs_b = a["spec_tokens"], b["spec_tokens"]
+    if specs_a and specs_b and not (specs_a <= specs_b or specs_b <= specs_a):
+        return False
+
+    union = a["shingles"] | b["shingles"]
+    if not union:
+        return False
+    similarity = len(a["shingles"] & b["shingles"]) / len(union)
+
+    # Model numbers are decisive when both titles have one, as long as the titles overlap at all
+    if a["model_number"] and b["model_number"]:
+        return a["model_number"] == b["model_number"] and similarity >= threshold / 2
+    return similarity >= threshold
+
+
+def deduplicate_products(products: List[Dict[str, Any]], threshold: float = 0.6) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Collapse offers of the same product from different sellers into one product record
+
+    Titles are clustered by shared model numbers or by the Jaccard similarity of their word shingles
+    (exact rather than MinHash-estimated, as a search returns at most a few dozen results).
+    Each cluster is represented by its cheapest offer, with all offers kept under "offers" and the
+    other sellers under "alternative_sellers". Clusters keep the position of their first member.
+
+    Returns the deduplicated products and a report with the number of collapsed duplicates.
+    """
+    features = [_title_features(product.get('title', '')) for product in products]
+
+    # Union-find over all pairs of products
+    parent = list(range(len(products)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(products)):
+        for j in range(i + 1, len(products)):
+            if find(i) != find(j) and _is_near_duplicate(features[i], features[j], threshold):
+                parent[find(j)] = find(i)
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(len(products)):
+        clusters.setdefault(find(i), []).append(i)
+
+    deduplicated = []
+    for members in sorted(clusters.values(), key=lambda indices: indices[0]):
+        offers = sorted(
+            (products[i] for i in members),
+            key=lambda p: (p.get('price_value') is None, p.get('price_value') or 0, -(p.get('reviews_count') or 0))
+        )
+        cheapest = offers[0]
+        deduplicated.append({
+            **cheapest,
+            "offers": [
+                {
+                    "title": offer.get('title', ''),
+                    "source": offer.get('source', ''),
+                    "price": offer.get('price', 'N/A'),
+                    "price_value": offer.get('price_value'),
+                    "url": offer.get('url', ''),
+                    "product_id": offer.get('product_id', '')
+                }
+                for offer in offers
+            ],
+            "alternative_sellers": [offer.get('source', '') for offer in offers[1:]]
+        })
+
+    report = {
+        "input": len(products),
+        "clusters": len(deduplicated),
+        "duplicates_collapsed": len(products) - len(deduplicated)
+    }
+    return deduplicated, report
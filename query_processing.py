@@ -0,0 +1,191 @@
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Words that suggest the input is not English and needs the LLM to translate it
+NON_ENGLISH_WORDS = {
+    "und", "mit", "für", "fur", "unter", "oder", "ohne", "nicht", "bis", "zoll",
+    "avec", "pour", "sans", "moins", "con", "para", "sin", "menos", "senza", "meno"
+}
+# Words that make a requirement more than a plain feature (negations, comparisons, budgets)
+AMBIGUOUS_WORDS = {
+    "not", "no", "without", "except", "or", "than", "between", "less", "more", "least", "most",
+    "cheap", "cheapest", "best", "budget", "price", "euro", "euros", "under", "below", "above", "max"
+}
+# Requirements that are technical specifications go after the product ("with ...")
+SPEC_KEYWORDS = {
+    "ram", "storage", "ssd", "hdd", "memory", "battery", "processor", "cpu", "gpu", "graphics",
+    "mah", "mp", "megapixel", "megapixels", "core", "cores", "warranty"
+}
+# English words the template may pass through as they are; any other word (such as the German "Handy")
+# could be a foreign product name, so the query goes to the LLM to be translated
+ENGLISH_VOCABULARY = {
+    # Product types
+    "laptop", "laptops", "notebook", "notebooks", "computer", "pc", "desktop", "tablet", "tablets",
+    "smartphone", "smartphones", "phone", "phones", "mobile", "smartwatch", "watch", "monitor", "monitors",
+    "tv", "television", "projector", "headphones", "headset", "earbuds", "earphones", "speaker", "speakers",
+    "soundbar", "camera", "cameras", "lens", "drone", "printer", "printers", "scanner", "keyboard", "mouse",
+    "router", "console", "controller", "drive", "disk", "card", "charger", "cable", "washing", "machine",
+    "machines", "dryer", "dishwasher", "fridge", "refrigerator", "freezer", "oven", "microwave", "stove",
+    "vacuum", "cleaner", "robot", "coffee", "espresso", "maker", "kettle", "toaster", "blender", "mixer",
+    "fan", "heater", "iron", "hair", "shaver", "toothbrush", "chair", "desk", "bike", "ebike",
+    # Modifiers and specifications
+    "gaming", "wireless", "wired", "bluetooth", "noise", "cancelling", "canceling", "color", "colour", "dslr",
+    "mirrorless", "portable", "mechanical", "curved", "smart", "ultrawide", "lightweight", "thin", "waterproof",
+    "electric", "cordless", "compact", "mini", "touchscreen", "touch", "screen", "display", "oled", "led",
+    "lcd", "hd", "uhd", "full", "inch", "inches", "hz", "gb", "tb", "mp", "mah", "external", "internal",
+    "black", "white", "silver", "large", "small", "dual", "sim", "front", "loader", "top", "energy",
+    "efficient", "office", "business", "student", "professional", "with", "for", "in", "of", "a", "the",
+} | SPEC_KEYWORDS
+SPEC_PATTERN = re.compile(r'\b\d+(?:\.\d+)?\s*(?:mp|mah|megapixels?)\b', re.IGNORECASE)
+# A bare capacity such as "128GB" needs to be told apart as RAM or storage
+CAPACITY_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*(gb|tb)$', re.IGNORECASE)
+
+
+def format_price(max_price: Optional[float]) -> str:
+    """Format a price limit without a trailing .0 for whole numbers"""
+    if float(max_price).is_integer():
+        return str(int(max_price))
+    return f"{max_price:.2f}"
+
+
+def _split_requirements(additional_requirements: str) -> List[str]:
+    """Split requirements into parts, dropping repeats ("Gaming, gaming") case-insensitively"""
+    parts = re.split(r'[,;\n]|\band\b', additional_requirements or "")
+    unique = {}
+    for part in parts:
+        if part.strip():
+            unique.setdefault(part.strip().lower(), part.strip())
+    return list(unique.values())
+
+
+def _is_unambiguous_english(text: str) -> bool:
+    if not text:
+        return True
+    if any(not char.isascii() for char in text if char.isalpha()):
+        return False
+    if re.search(r'[.?!/()€$%"]', text):
+        return False
+    words = set(re.findall(r'[a-z]+', text.lower()))
+    if words & NON_ENGLISH_WORDS or words & AMBIGUOUS_WORDS:
+        return False
+    # Tokens with digits (4K, 5G, 16GB, 27) are specifications; every other word must be known English
+    plain_words = {token for token in re.findall(r'[a-z0-9]+', text.lower()) if not any(char.isdigit() for char in token)}
+    return plain_words <= ENGLISH_VOCABULARY
+
+
+def _classify_capacity(requirement: str) -> Optional[str]:
+    """Describe a bare capacity as RAM or storage, or return None when it could be either"""
+    match = CAPACITY_PATTERN.match(requirement)
+    amount, unit = float(match.group(1)), match.group(2).upper()
+    if unit == "TB" or amount >= 64:
+        return f"{requirement} storage"
+    if amount <= 16:
+        return f"{requirement} RAM"
+    return None
+
+
+def template_restructure(query: str, max_price: Optional[float], additional_requirements: str) -> Optional[str]:
+    """Restructure a common English query without an LLM call
+
+    Follows the same rules as the LLM prompt: product type modifiers (Gaming, Wireless, 27 inch)
+    go before the product, technical specifications (16GB RAM, 24MP) go after it with "with",
+    and the price limit comes last. Returns None for non-English or ambiguous input, including any
+    word outside ENGLISH_VOCABULARY.
+    """
+    query = (query or "").strip()
+    if not query or len(query.split()) > 4 or not _is_unambiguous_english(query):
+        return None
+
+    modifiers = []
+    specs = []
+    for requirement in _split_requirements(additional_requirements):
+        if len(requirement.split()) > 4 or not _is_unambiguous_english(requirement):
+            return None
+        # Avoid repeating what the query already says
+        if requirement.lower() in query.lower():
+            continue
+
+        words = set(requirement.lower().split())
+        if CAPACITY_PATTERN.match(requirement):
+            capacity = _classify_capacity(requirement)
+            if capacity is None:
+                return None
+            specs.append(capacity)
+        elif words & SPEC_KEYWORDS or SPEC_PATTERN.search(requirement):
+            specs.append(requirement)
+        else:
+            modifiers.append(requirement)
+
+    restructured = " ".join(modifiers + [query])
+    if specs:
+        restructured += " with " + " and ".join(specs)
+    if max_price:
+        restructured += f" under {format_price(max_price)} euros"
+    return restructured
+
+
+# Few-shot examples for the LLM restructuring prompt
+FEW_SHOT_EXAMPLES = [
+    {"query": "Laptop", "max_price": 1000, "requirements": "16GB RAM, Gaming",
+     "restructured": "Gaming Laptop with 16GB RAM under 1000 euros"},
+    {"query": "Laptop", "max_price": 4000, "requirements": "Gaming",
+     "restructured": "Gaming Laptop under 4000 euros"},
+    {"query": "Washing Machine", "max_price": 800, "requirements": "",
+     "restructured": "Washing Machine under 800 euros"},
+    {"query": "Smartphone", "max_price": 500, "requirements": "5G, 128GB",
+     "restructured": "5G Smartphone with 128GB storage under 500 euros"},
+    {"query": "Monitor", "max_price": 300, "requirements": "27 inch, 4K",
+     "restructured": "27 inch 4K Monitor under 300 euros"},
+    {"query": "Headphones", "max_price": 200, "requirements": "Wireless, Noise Cancelling",
+     "restructured": "Wireless Noise Cancelling Headphones under 200 euros"},
+    {"query": "Camera", "max_price": 1000, "requirements": "DSLR, 24MP",
+     "restructured": "DSLR Camera with 24MP under 1000 euros"},
+    {"query": "Printer", "max_price": 150, "requirements": "Wireless, Color",
+     "restructured": "Wireless Color Printer under 150 euros"},
+]
+# Used when nothing in the bank resembles the query: one modifier and one specification example
+DEFAULT_EXAMPLE_INDICES = [0, 4]
+
+
+def _example_terms(query: str, requirements: str) -> set:
+    """Lowercase words of a query, with numeric specifications reduced to their unit (16gb -> #gb)"""
+    terms = set()
+    for word in re.findall(r'\w+', f"{query} {requirements}".lower()):
+        unit = re.fullmatch(r'\d+(?:\.\d+)?([a-z]+)', word)
+        terms.add(f"#{unit.group(1)}" if unit else word)
+    return terms
+
+
+def select_examples(query: str, additional_requirements: str, k: int = 2) -> List[Dict[str, Any]]:
+    """Pick the k examples from the bank that share the most terms with the query"""
+    terms = _example_terms(query, additional_requirements)
+    scored = []
+    for index, example in enumerate(FEW_SHOT_EXAMPLES):
+        example_terms = _example_terms(example["query"], example["requirements"])
+        union = terms | example_terms
+        similarity = len(terms & example_terms) / len(union) if union else 0.0
+        scored.append((similarity, index))
+
+    scored.sort(key=lambda item: -item[0])
+    selected = [index for similarity, index in scored[:k] if similarity > 0]
+    for index in DEFAULT_EXAMPLE_INDICES:
+        if len(selected) >= k:
+            break
+        if index not in selected:
+            selected.append(index)
+    return [FEW_SHOT_EXAMPLES[index] for index in selected]
+
+
+def format_examples(examples: List[Dict[str, Any]]) -> str:
+    """Render examples in the Query / Max Price / Additional Requirements / Restructured format"""
+    return "\n\n".join(
+        f"Query: {example['query']}\n"
+        f"Max Price: {example['max_price']} euros\n"
+        f"Additional Requirements: {example['requirements']}\n"
+        f"Restructured: {example['restructured']}"
+        for example in examples
+    )
@@ -0,0 +1,110 @@
+import re
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+REASON_MARKER = "Why Recommended:"
+ANALYSIS_MARKER = "Overall Analysis:"
+NO_REASON = "No specific reasoning found"
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+class TitleMatcher:
+    """Fuzzy matcher from a header line written by the LLM to one of a fixed list of product titles
+
+    The titles are tokenized once, so matching many lines against them stays cheap.
+    """
+
+    def __init__(self, titles: Sequence[str], threshold: float = 0.4):
+        self.titles = [title.lower().strip() for title in titles]
+        self.title_words = [_words(title) for title in titles]
+        self.threshold = threshold
+
+    def match(self, line: str, exclude: Sequence[int] = ()) -> Optional[int]:
+        """Return the index of the title that best matches the line, or None if none is close enough"""
+        text = line.lower().strip()
+        words = _words(text)
+        if not words:
+            return None
+
+        best_index, best_score = None, self.threshold
+        for index, (title, title_words) in enumerate(zip(self.titles, self.title_words)):
+            if index in exclude or not title_words:
+                continue
+            if title and (title in text or text in title):
+                score = 1.0
+            else:
+                # How much of the line is in the title, and how much of the title is in the line
+                common = len(words & title_words)
+                score = (common / len(words) + common / len(title_words)) / 2
+            # Ties go to the earlier (higher ranked) title
+            if score > best_score:
+                best_index, best_score = index, score
+        return best_index
+
+
+def parse_recommendations(recommendations_text: str, titles: Sequence[str] = ()) -> Dict[str, Any]:
+    """Parse the (possibly partial) recommendation narrative in a single pass
+
+    Returns a dict with:
+    - "reasons": the "Why Recommended" text of each title, keyed by its index in titles. A reason is
+      attributed to the title matched by the nearest header line above it, or to the next title
+      without a reason when no header matches.
+    - "ordered_reasons": all reasons in the order they appear
+    - "analysis": the text after "Overall Analysis:"
+    """
+    matcher = TitleMatcher(titles)
+    reasons: Dict[int, str] = {}
+    ordered_reasons: List[str] = []
+    analysis_lines = []
+    section = None
+    header_index = None
+    current_index = None
+
+    def match_header(line: str, exclude: List[int]) -> Optional[int]:
+        if not titles:
+            return None
+        # Product header lines are often numbered or prefixed ("1. Product: ...")
+        header = re.sub(r'^(?:#+|\d+[.)]|[-*])?\s*(?:Product(?: Name)?:)?\s*', '', line)
+        return matcher.match(header, exclude=exclude)
+
+    for line in recommendations_text.split('\n'):
+        stripped = line.replace('**', '').strip()
+        if stripped.startswith(REASON_MARKER):
+            reason = stripped[len(REASON_MARKER):].strip()
+            current_index = header_index
+            if current_index is None or current_index in reasons:
+                current_index = next((i for i in range(len(titles)) if i not in reasons), None)
+            if current_index is not None:
+                reasons[current_index] = reason
+            ordered_reasons.append(reason)
+            header_index = None
+            section = "reason"
+        elif stripped.startswith(ANALYSIS_MARKER):
+            analysis_lines.append(stripped[len(ANALYSIS_MARKER):].strip())
+            section = "analysis"
+        elif section == "analysis":
+            analysis_lines.append(line)
+        else:
+            # The next product header can follow a reason without a blank line in between
+            matched = match_header(stripped, list(reasons)) if stripped else None
+            if section == "reason" and stripped and matched is None:
+                # A reason runs until the next blank line or product header
+                ordered_reasons[-1] = f"{ordered_reasons[-1]} {stripped}".strip()
+                if current_index is not None:
+                    reasons[current_index] = ordered_reasons[-1]
+            else:
+                section = None
+                if matched is not None:
+                    header_index = matched
+
+    return {
+        "reasons": reasons,
+        "ordered_reasons": ordered_reasons,
+        "analysis": '\n'.join(analysis_lines).strip()
+    }
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Default location of the results dataset
+RESULTS_DIR = os.getenv("RESULTS_DIR", "results")
+# One row per query (timings, metrics, status) and one row per product of a query
+TABLES = ("queries", "products")
+# Compaction stages its files in a directory that dataset readers skip (leading underscore)
+COMPACTION_STAGING_PREFIX = "_compacting-"
+SCORE_FIELDS = ("overall_score", "performance", "value_for_money", "matching_requirements")
+
+
+@lru_cache(maxsize=1)
+def _schemas() -> Dict[str, Any]:
+    """Fixed Parquet schemas, so that files written at different times can be read as one dataset"""
+    import pyarrow as pa
+
+    return {
+        "queries": pa.schema([
+            ("query_id", pa.string()),
+            ("recorded_at", pa.timestamp("ms", tz="UTC")),
+            ("query", pa.string()),
+            ("restructured_query", pa.string()),
+            ("restructure_method", pa.string()),
+            ("max_price", pa.float64()),
+            ("additional_requirements", pa.string()),
+            ("profile", pa.string()),
+            ("num_products", pa.int32()),
+            ("num_ranked", pa.int32()),
+            ("num_recommendations", pa.int32()),
+            ("total_seconds", pa.float64()),
+            ("timings_json", pa.string()),
+            ("metrics_json", pa.string()),
+            ("status_json", pa.string()),
+            ("recommendations_analysis", pa.string()),
+        ]),
+        "products": pa.schema([
+            ("query_id", pa.string()),
+            ("recorded_at", pa.timestamp("ms", tz="UTC")),
+            ("product_type", pa.string()),
+            ("rank", pa.int32()),
+            ("product_id", pa.string()),
+            ("title", pa.string()),
+            ("url", pa.string()),
+            ("source", pa.string()),
+            ("image", pa.string()),
+            ("price", pa.string()),
+            ("price_value", pa.float64()),
+            ("rating_value", pa.float64()),
+            ("reviews_count", pa.int64()),
+            *[(field, pa.float64()) for field in SCORE_FIELDS],
+            ("recommendation_reason", pa.string()),
+            ("analysis_json", pa.string()),
+            ("details_json", pa.string()),
+        ]),
+    }
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value: Any) -> Optional[int]:
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+
+def _to_json(value: Any) -> Optional[str]:
+    return json.dumps(value, default=str) if value is not None else None
+
+
+def product_row(query_id: str, recorded_at: datetime, product_type: str, rank: Optional[int],
+                product: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a product, its scores and its analysis into a row of the products table"""
+    analysis = product.get("analysis") if isinstance(product.get("analysis"), dict) else {}
+    scores = analysis.get("scores") or {}
+    return {
+        "query_id": query_id,
+        "recorded_at": recorded_at,
+        "product_type": product_type,
+        "rank": rank,
+        "product_id": str(product.get("product_id") or ""),
+        "title": product.get("title", ""),
+        "url": product.get("url", ""),
+        "source": product.get("source", ""),
+        "image": product.get("image", ""),
+        "price": str(product.get("price", "")),
+        "price_value": _to_float(product.get("price_value")),
+        "rating_value": _to_float(product.get("rating_value")),
+        "reviews_count": _to_int(product.get("reviews_count")),
+        **{field: _to_float(scores.get(field)) for field in SCORE_FIELDS},
+        "recommendation_reason": product.get("recommendation_reason"),
+        "analysis_json": _to_json(analysis or None),
+        "details_json": _to_json(product.get("structured_details") or product.get("formatted_details")),
+    }
+
+
+class ResultsStore:
+    """Append-only, date-partitioned Parquet dataset of search results
+
+    Records are queued by the request path and written by a background thread in batches, one new file
+    per partition and flush. The same thread periodically compacts partitions that have accumulated many
+    small files. Files are laid out as <root>/<table>/date=YYYY-MM-DD/*.parquet and can be read with
+    pyarrow.dataset, pandas.read_parquet or read().
+    """
+
+    def __init__(self, root: Optional[str] = None, flush_rows: int = 500, flush_interval: float = 5.0,
+                 compact_interval: float = 600.0, compact_min_files: int = 8):
+        self.root = root or RESULTS_DIR
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.compact_min_files = compact_min_files
+        self.rows_written = 0
+        self.files_written = 0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._closed = False
+        atexit.register(self.close)
+
+    def record_query(self, query: str, max_price: Optional[float], additional_requirements: str, profile: str,
+                     processed_query: Dict[str, Any], products: List[Dict[str, Any]],
+                     ranked_products: List[Dict[str, Any]], recommendations: List[Dict[str, Any]],
+                     recommendations_analysis: str, timings: Dict[str, float], metrics: Dict[str, Any],
+                     status: Dict[str, str]) -> str:
+        """Queue the full results of a query for writing and return its query_id; never blocks on disk"""
+        query_id = uuid.uuid4().hex
+        recorded_at = datetime.now(timezone.utc)
+        query_row = {
+            "query_id": query_id,
+            "recorded_at": recorded_at,
+            "query": query,
+            "restructured_query": (processed_query or {}).get("restructured", query),
+            "restructure_method": (processed_query or {}).get("method"),
+            "max_price": _to_float(max_price),
+            "additional_requirements": additional_requirements,
+            "profile": profile,
+            "num_products": len(products),
+            "num_ranked": len(ranked_products),
+            "num_recommendations": len(recommendations),
+            "total_seconds": _to_float(timings.get("total")),
+            "timings_json": _to_json(timings),
+            "metrics_json": _to_json(metrics),
+            "status_json": _to_json(status),
+            "recommendations_analysis": recommendations_analysis,
+        }
+        product_rows = (
+            [product_row(query_id, recorded_at, "raw", None, product) for product in products]
+            + [product_row(query_id, recorded_at, "ranked", rank, product) for rank, product in enumerate(ranked_products, 1)]
+            + [product_row(query_id, recorded_at, "recommended", rank, product) for rank, product in enumerate(recommendations, 1)]
+        )
+        self.append("queries", [query_row])
+        self.append("products", product_rows)
+        return query_id
+
+    def append(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Queue rows for a table; they are written by the background thread"""
+        if table not in TABLES:
+            raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(TABLES)}")
+        if self._closed:
+            logger.warning(f"Results store is closed, dropping {len(rows)} {table} rows")
+            return
+        self._ensure_writer()
+        self._queue.put((table, rows))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is on disk; returns False on timeout"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        """Write the remaining rows and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def read(self, table: str = "products", filter: Any = None):
+        """Read a table (optionally with a pyarrow.dataset filter expression) as a pyarrow Table"""
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        # The partition directory becomes a "date" column
+        partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+        schema = _schemas()[table].append(pa.field("date", pa.string()))
+        path = os.path.join(self.root, table)
+        if not os.path.isdir(path):
+            return schema.empty_table()
+        dataset = ds.dataset(path, format="parquet", schema=schema, partitioning=partitioning,
+                             exclude_invalid_files=True)
+        return dataset.to_table(filter=filter)
+
+    def _ensure_writer(self) -> None:
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="results-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        buffers: Dict[str, List[Dict[str, Any]]] = {table: [] for table in TABLES}
+        last_flush = time.monotonic()
+        last_compaction = time.monotonic()
+        try:
+            for _, directory in self._partitions():
+                self._recover_compaction(directory)
+        except Exception as e:
+            logger.error(f"Error recovering interrupted compactions in {self.root}: {e}")
+
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+
+            stop = item is None
+            waiter = item if isinstance(item, threading.Event) else None
+            # An error must never stop the thread, or every later row would be dropped and flush() would hang
+            try:
+                if isinstance(item, tuple) and item:
+                    table, rows = item
+                    buffers[table].extend(rows)
+
+                # Write in batches: when enough rows are buffered, the interval elapsed, or a flush was requested
+                buffered = sum(len(rows) for rows in buffers.values())
+                if buffered and (stop or waiter or buffered >= self.flush_rows
+                                 or time.monotonic() - last_flush >= self.flush_interval):
+                    for table, rows in buffers.items():
+                        if rows:
+                            buffers[table] = []
+                            self._write(table, rows)
+                    last_flush = time.monotonic()
+
+                if time.monotonic() - last_compaction >= self.compact_interval:
+                    last_compaction = time.monotonic()
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Error in results writer: {e}")
+
+            if waiter is not None:
+                waiter.set()
+            if stop:
+                return
+
+    def _write(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Append rows as one new Parquet file per date partition"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        partitions: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            partitions.setdefault(row["recorded_at"].strftime("%Y-%m-%d"), []).append(row)
+
+        for date, partition_rows in partitions.items():
+            directory = os.path.join(self.root, table, f"date={date}")
+            try:
+                os.makedirs(directory, exist_ok=True)
+                data = pa.Table.from_pylist(partition_rows, schema=_schemas()[table])
+                path = os.path.join(directory, f"part-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.parquet")
+                # Write under a temporary name so that readers never see a partial file
+                pq.write_table(data, f"{path}.tmp", compression="zstd")
+                os.replace(f"{path}.tmp", path)
+                self.rows_written += len(partition_rows)
+                self.files_written += 1
+            except Exception as e:
+                logger.error(f"Error writing {len(partition_rows)} {table} rows to {directory}: {e}")
+
+    def compact(self) -> None:
+        """Merge the small files of each partition into one file (called from the writer thread)
+
+        The merged file is written into a staging directory, which dataset readers ignore because of its
+        leading underscore. The input files are then moved into the staging directory and the merged file
+        is moved out, so readers never see the same rows twice. This is not atomic: a reader that lists the
+        partition between those renames misses the compacted rows. A compaction interrupted by a crash is
+        completed or rolled back by _recover_compaction.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for table, directory in self._partitions():
+            self._recover_compaction(directory)
+            files = sorted(
+                os.path.join(directory, name) for name in os.listdir(directory)
+                if name.endswith(".parquet") and os.path.isfile(os.path.join(directory, name))
+            )
+            if len(files) < self.compact_min_files:
+                continue
+            try:
+                start_time = time.perf_counter()
+                data = pa.concat_tables(pq.read_table(path, schema=_schemas()[table]) for path in files)
+                stamp = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+                staging = os.path.join(directory, f"{COMPACTION_STAGING_PREFIX}{stamp}")
+                name = f"compacted-{stamp}.parquet"
+                os.makedirs(staging)
+                pq.write_table(data, os.path.join(staging, name), compression="zstd")
+                for old_path in files:
+                    os.replace(old_path, os.path.join(staging, os.path.basename(old_path)))
+                # Publishing the merged file is the commit point of the compaction
+                os.replace(os.path.join(staging, name), os.path.join(directory, name))
+                shutil.rmtree(staging)
+                logger.info(f"Compacted {len(files)} files of {directory} into one "
+                            f"({data.num_rows} rows) in {time.perf_counter() - start_time:.2f}s")
+            except Exception as e:
+                logger.error(f"Error compacting {directory}: {e}")
+                self._recover_compaction(directory)
+
+    def _partitions(self) -> List[Tuple[str, str]]:
+        """(table, directory) of every date partition"""
+        partitions = []
+        for table in TABLES:
+            table_dir = os.path.join(self.root, table)
+            if os.path.isdir(table_dir):
+                # Skip stray files such as .DS_Store
+                partitions += [(table, os.path.join(table_dir, partition)) for partition in sorted(os.listdir(table_dir))
+                               if os.path.isdir(os.path.join(table_dir, partition))]
+        return partitions
+
+    def _recover_compaction(self, directory: str) -> None:
+        """Finish or undo compactions of a partition that were interrupted, depending on whether the merged file was published"""
+        for staging_name in os.listdir(directory):
+            if not staging_name.startswith(COMPACTION_STAGING_PREFIX):
+                continue
+            staging = os.path.join(directory, staging_name)
+            name = f"compacted-{staging_name[len(COMPACTION_STAGING_PREFIX):]}.parquet"
+            try:
+                if not os.path.exists(os.path.join(directory, name)):
+                    # Not published yet: put the input files back and drop the merged file
+                    for input_name in os.listdir(staging):
+                        if input_name != name:
+                            os.replace(os.path.join(staging, input_name), os.path.join(directory, input_name))
+                shutil.rmtree(staging)
+                logger.warning(f"Recovered interrupted compaction {staging}")
+            except OSError as e:
+                logger.error(f"Error recovering interrupted compaction {staging}: {e}")
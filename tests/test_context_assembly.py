@@ -0,0 +1,48 @@
+from context_assembly import assemble_context, bm25_scores, split_passages
+from tokens import count_tokens
+
+
+def test_split_passages_keeps_whole_sentences_within_the_passage_size():
+    text = " ".join(f"Sentence number {i} is about the laptop." for i in range(40))
+    passages = split_passages(text, passage_tokens=30)
+    assert len(passages) > 1
+    assert " ".join(passages) == text
+    # A passage only exceeds the size when a single sentence does
+    assert all(count_tokens(passage) <= 30 for passage in passages)
+
+
+def test_bm25_ranks_passages_with_query_terms_first():
+    passages = [
+        "Shipping is free and returns are accepted within thirty days.",
+        "The battery lasts ten hours and the display is bright.",
+        "The battery is good. The battery charges fast. Battery battery.",
+    ]
+    scores = bm25_scores(passages, ["battery", "display"])
+    assert scores[0] == 0
+    assert scores[1] > 0 and scores[2] > 0
+    assert bm25_scores([], ["battery"]) == []
+
+
+def test_assemble_context_stays_within_the_budget_and_keeps_the_original_order():
+    store = "Our store opened in 1999 and we love our customers, so visit us on weekends for coffee and cake with the whole family."
+    specs = "Acme X1 specifications: 16GB RAM, 512GB SSD and a bright 14 inch display. The battery drains fast under load."
+    pros = "Pros of the Acme X1: great performance and build quality."
+    context, report = assemble_context([{"content": pros}, store, {"raw_content": specs}], "Acme X1", token_budget=45)
+    # The two relevant passages fill the budget; the store blurb does not fit next to them
+    assert context == f"{pros}\n{specs}"
+    assert report["tokens_kept"] == count_tokens(pros) + count_tokens(specs) <= 45
+    assert report["passages_in"] == 3
+    assert report["passages_kept"] == 2
+
+
+def test_assemble_context_drops_passages_repeated_in_snippet_and_page():
+    passage = "The Acme X1 has 16GB RAM and a fast processor."
+    context, report = assemble_context([{"content": passage, "raw_content": passage}], "Acme X1")
+    assert context == passage
+    assert report["passages_in"] == 1
+
+
+def test_assemble_context_without_results():
+    context, report = assemble_context([], "Acme X1")
+    assert context == ""
+    assert report == {"tokens_in": 0, "tokens_kept": 0, "passages_in": 0, "passages_kept": 0}
@@ -0,0 +1,119 @@
+import math
+
+import pytest
+
+from product_filters import deduplicate_products, parse_number, prefilter_products
+
+
+@pytest.mark.parametrize("value, expected", [
+    (12, 12.0),
+    (19.99, 19.99),
+    ("€1,299.00", 1299.0),
+    (" 45 ", 45.0),
+    ("n/a", None),
+    ("", None),
+    (None, None),
+    (True, None),
+    (math.inf, None),
+    ("nan", None),
+    ([1], None),
+])
+def test_parse_number(value, expected):
+    assert parse_number(value) == expected
+
+
+def product(title="Laptop", price_value=500.0, url="https://shop/item", **fields):
+    return {"title": title, "price_value": price_value, "url": url, **fields}
+
+
+def test_prefilter_drops_malformed_and_over_budget_products():
+    products = [
+        product("Cheap"),
+        product("", 100.0),
+        product("No link", 100.0, url=""),
+        product("Free", 0.0),
+        product("Expensive", 1500.0),
+    ]
+    kept, report = prefilter_products(products, 1000)
+    assert [p["title"] for p in kept] == ["Cheap"]
+    assert report == {"input": 5, "dropped_malformed": 3, "dropped_over_budget": 1,
+                      "deprioritized_unpriced": 0, "kept": 1}
+
+
+def test_prefilter_keeps_products_with_a_product_id_instead_of_a_link():
+    kept, _ = prefilter_products([product(url="", product_id="123")], 1000)
+    assert len(kept) == 1
+
+
+def test_prefilter_moves_unpriced_products_last():
+    products = [product("Unpriced", None), product("Priced", 200.0)]
+    kept, report = prefilter_products(products, 1000)
+    assert [p["title"] for p in kept] == ["Priced", "Unpriced"]
+    assert report["deprioritized_unpriced"] == 1
+
+
+def test_prefilter_without_budget_keeps_every_price():
+    kept, report = prefilter_products([product(price_value=99999.0)], None)
+    assert len(kept) == 1
+    assert report["dropped_over_budget"] == 0
+
+
+def offer(title, price_value, source, **fields):
+    return {"title": title, "price_value": price_value, "price": f"€{price_value}", "source": source,
+            "url": f"https://{source}/item", **fields}
+
+
+def test_deduplicate_merges_offers_of_the_same_product_into_the_cheapest():
+    products = [
+        offer("Samsung Galaxy S23 128GB Phantom Black", 799.0, "shop-a"),
+        offer("Apple iPhone 15 128GB Black", 899.0, "shop-a"),
+        offer("Samsung Galaxy S23 128GB Phantom Black Smartphone", 749.0, "shop-b"),
+    ]
+    deduplicated, report = deduplicate_products(products)
+    assert [p["title"] for p in deduplicated] == [
+        "Samsung Galaxy S23 128GB Phantom Black Smartphone",
+        "Apple iPhone 15 128GB Black",
+    ]
+    assert deduplicated[0]["alternative_sellers"] == ["shop-a"]
+    assert [o["price_value"] for o in deduplicated[0]["offers"]] == [749.0, 799.0]
+    assert report == {"input": 3, "clusters": 2, "duplicates_collapsed": 1}
+
+
+def test_deduplicate_merges_titles_that_only_differ_in_unit_spacing():
+    products = [
+        offer("Samsung Galaxy S23 128GB Phantom Black", 799.0, "shop-a"),
+        offer("Samsung Galaxy S23 128 GB Phantom Black", 779.0, "shop-b"),
+    ]
+    deduplicated, _ = deduplicate_products(products)
+    assert len(deduplicated) == 1
+
+
+def test_deduplicate_keeps_capacity_variants_apart():
+    products = [
+        offer("Samsung Galaxy S23 128GB Phantom Black", 799.0, "shop-a"),
+        offer("Samsung Galaxy S23 256GB Phantom Black", 859.0, "shop-b"),
+    ]
+    deduplicated, _ = deduplicate_products(products)
+    assert len(deduplicated) == 2
+
+
+def test_deduplicate_uses_model_numbers():
+    same_model = [
+        offer("Lenovo IdeaPad 5 15IAU7 82RK00ABGE Notebook", 699.0, "shop-a"),
+        offer("Lenovo IdeaPad 5 82RK00ABGE 15.6 Zoll Notebook grau", 689.0, "shop-b"),
+    ]
+    assert len(deduplicate_products(same_model)[0]) == 1
+
+    different_models = [
+        offer("Lenovo IdeaPad 5 82RK00ABGE Notebook grau", 699.0, "shop-a"),
+        offer("Lenovo IdeaPad 5 82RK00CDGE Notebook grau", 689.0, "shop-b"),
+    ]
+    assert len(deduplicate_products(different_models)[0]) == 2
+
+
+def test_deduplicate_does_not_treat_shared_components_as_model_numbers():
+    products = [
+        offer("HP Laptop with Intel i7-1255U 16GB", 899.0, "shop-a"),
+        offer("Dell Inspiron i7-1255U 16GB", 949.0, "shop-b"),
+    ]
+    assert len(deduplicate_products(products)[0]) == 2
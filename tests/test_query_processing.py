@@ -0,0 +1,76 @@
+import pytest
+
+from query_processing import (
+    DEFAULT_EXAMPLE_INDICES, FEW_SHOT_EXAMPLES, format_examples, format_price, select_examples, template_restructure
+)
+
+
+@pytest.mark.parametrize("example", FEW_SHOT_EXAMPLES, ids=lambda example: example["restructured"])
+def test_template_reproduces_the_few_shot_examples(example):
+    assert template_restructure(example["query"], example["max_price"], example["requirements"]) == example["restructured"]
+
+
+@pytest.mark.parametrize("max_price, expected", [(1000, "1000"), (1500.0, "1500"), (99.5, "99.50")])
+def test_format_price(max_price, expected):
+    assert format_price(max_price) == expected
+
+
+def test_template_formats_float_budgets_like_integers():
+    assert template_restructure("Laptop", 1500.0, "Gaming") == "Gaming Laptop under 1500 euros"
+
+
+def test_template_without_budget_has_no_price():
+    assert template_restructure("Laptop", None, "Gaming") == "Gaming Laptop"
+
+
+def test_template_drops_repeated_requirements():
+    assert template_restructure("Laptop", 1000, "Gaming, gaming, 16GB RAM") == "Gaming Laptop with 16GB RAM under 1000 euros"
+
+
+def test_template_skips_requirements_the_query_already_states():
+    assert template_restructure("Gaming Laptop", 1000, "Gaming") == "Gaming Laptop under 1000 euros"
+
+
+@pytest.mark.parametrize("requirements, expected", [
+    ("1TB", "Laptop with 1TB storage under 1000 euros"),
+    ("512GB", "Laptop with 512GB storage under 1000 euros"),
+    ("8GB", "Laptop with 8GB RAM under 1000 euros"),
+])
+def test_template_classifies_bare_capacities(requirements, expected):
+    assert template_restructure("Laptop", 1000, requirements) == expected
+
+
+@pytest.mark.parametrize("query, requirements", [
+    ("Handy", "5G"),                      # Unknown (German) product word
+    ("Waschmaschine", ""),
+    ("Laptop", "mit 16GB RAM"),           # Non-English function word
+    ("Laptop", "not too heavy"),          # Negation
+    ("Laptop", "cheaper than 800"),       # Comparison
+    ("Laptop", "32GB"),                   # Could be RAM or storage
+    ("Télévision", ""),                   # Non-ASCII letters
+    ("Laptop for video editing and gaming at home", ""),  # Too long for the template
+])
+def test_template_leaves_ambiguous_or_foreign_queries_to_the_llm(query, requirements):
+    assert template_restructure(query, 1000, requirements) is None
+
+
+def test_select_examples_prefers_similar_queries():
+    examples = select_examples("Laptop", "Gaming")
+    assert [example["restructured"] for example in examples] == [
+        "Gaming Laptop under 4000 euros",
+        "Gaming Laptop with 16GB RAM under 1000 euros",
+    ]
+
+
+def test_select_examples_falls_back_to_the_default_examples():
+    examples = select_examples("Kettle", "")
+    assert examples == [FEW_SHOT_EXAMPLES[index] for index in DEFAULT_EXAMPLE_INDICES]
+
+
+def test_format_examples():
+    assert format_examples(FEW_SHOT_EXAMPLES[:1]) == (
+        "Query: Laptop\n"
+        "Max Price: 1000 euros\n"
+        "Additional Requirements: 16GB RAM, Gaming\n"
+        "Restructured: Gaming Laptop with 16GB RAM under 1000 euros"
+    )
@@ -0,0 +1,65 @@
+from recommendation_parser import TitleMatcher, parse_recommendations
+
+
+TITLES = ["Acme Laptop X1 16GB", "Beta Phone Z9 128GB", "Gamma Monitor 27 inch"]
+
+
+def test_title_matcher_finds_the_closest_title():
+    matcher = TitleMatcher(TITLES)
+    assert matcher.match("Beta Phone Z9") == 1
+    assert matcher.match("gamma monitor 27 inch 4K") == 2
+    assert matcher.match("Shipping and returns") is None
+    assert matcher.match("") is None
+
+
+def test_title_matcher_skips_excluded_titles():
+    matcher = TitleMatcher(TITLES)
+    assert matcher.match("Acme Laptop X1 16GB", exclude=[0]) is None
+
+
+def test_reasons_are_attributed_to_their_headers():
+    text = (
+        "1. **Beta Phone Z9 128GB**\n"
+        "**Why Recommended:** Great camera.\n"
+        "\n"
+        "2. Product: Acme Laptop X1 16GB\n"
+        "Why Recommended: Fast and light.\n"
+        "\n"
+        "Overall Analysis: Both are good value.\n"
+        "The phone wins on price."
+    )
+    parsed = parse_recommendations(text, TITLES)
+    assert parsed["reasons"] == {1: "Great camera.", 0: "Fast and light."}
+    assert parsed["ordered_reasons"] == ["Great camera.", "Fast and light."]
+    assert parsed["analysis"] == "Both are good value.\nThe phone wins on price."
+
+
+def test_a_reason_continues_until_a_blank_line():
+    text = "Acme Laptop X1 16GB\nWhy Recommended: Fast\nand light.\n\nSome closing words."
+    assert parse_recommendations(text, TITLES)["reasons"] == {0: "Fast and light."}
+
+
+def test_a_header_right_after_a_reason_starts_the_next_product():
+    text = (
+        "1. Acme Laptop X1 16GB\n"
+        "Why Recommended: Fast and light.\n"
+        "2. Beta Phone Z9 128GB\n"
+        "Why Recommended: Great camera."
+    )
+    assert parse_recommendations(text, TITLES)["reasons"] == {0: "Fast and light.", 1: "Great camera."}
+
+
+def test_reasons_without_a_matching_header_go_to_the_next_title_without_one():
+    text = "Why Recommended: First.\n\nSomething else entirely\nWhy Recommended: Second."
+    assert parse_recommendations(text, TITLES)["reasons"] == {0: "First.", 1: "Second."}
+
+
+def test_partial_text_while_streaming():
+    parsed = parse_recommendations("1. Acme Laptop X1 16GB\nWhy Recomm", TITLES)
+    assert parsed == {"reasons": {}, "ordered_reasons": [], "analysis": ""}
+
+
+def test_parsing_without_titles_keeps_the_reasons_in_order():
+    parsed = parse_recommendations("Why Recommended: First.\n\nWhy Recommended: Second.")
+    assert parsed["reasons"] == {}
+    assert parsed["ordered_reasons"] == ["First.", "Second."]
@@ -0,0 +1,31 @@
+import math
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+
+logger = logging.getLogger(__name__)
+
+# Llama has its own tokenizer; cl100k_base is close enough for budgeting prompt sizes
+ENCODING_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        # The encoding is downloaded on first use, which fails on machines without internet access
+        logger.warning(f"Could not load tiktoken encoding {ENCODING_NAME}, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text, estimating 4 characters per token if no encoding is available"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))